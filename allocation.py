@@ -0,0 +1,235 @@
+# allocation.py - balanced between-subjects condition assignment
+"""Assign each new session to one of the 15 (anthro_level x pov) cells.
+
+Assignments follow permuted blocks. Each block of ``SHADE_ALLOCATION_BLOCK``
+sessions (a multiple of 15) holds every cell equally often, in an order
+shuffled by a block RNG seeded from ``SHADE_ALLOCATION_SALT`` and the block
+number. So after any number of sessions no two cells differ by more than one
+block's share.
+
+The salt is the study's secret: anyone who has it can predict the next cell,
+so it is never committed. There is no default; allocating or replaying
+without one raises.
+
+The only shared state is a sequence counter. ``allocate()`` takes the next
+number atomically and looks its cell up in the (cached) block permutation, so
+it is O(1). The counter is shared by every server process on the host:
+
+- ``file`` (default): an 8-byte counter under ``fcntl.flock``
+- ``sqlite``: one row, updated in a ``BEGIN IMMEDIATE`` transaction, for a
+  database on a shared volume
+- ``memory``: process-local, for tests and single-process runs
+
+The sequence number is the session's ``seed``. ``replay(seed)`` recomputes its
+condition, and ``Allocation.rng()`` is a per-session ``random.Random`` for
+anything else a session should draw, so the global ``random`` is never
+reseeded. Keep the salt and block size fixed for the life of a study, or old
+seeds replay to different cells.
+
+    python allocation.py replay 42 [--salt SALT]
+"""
+import argparse
+import functools
+import os
+import random
+import sqlite3
+import struct
+import threading
+from dataclasses import dataclass
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts fall back to SQLite
+    fcntl = None
+
+LEVELS = ("A0", "A1", "A2", "A3", "A4")
+POVS = ("first", "third", "none")
+CELLS = tuple((level, pov) for level in LEVELS for pov in POVS)
+
+BACKEND = os.environ.get("SHADE_ALLOCATOR", "file")
+BLOCK_SIZE = int(os.environ.get("SHADE_ALLOCATION_BLOCK", str(len(CELLS))))
+SALT = os.environ.get("SHADE_ALLOCATION_SALT")
+COUNTER_PATH = os.environ.get("SHADE_ALLOCATION_PATH",
+                              os.path.join(os.environ.get("SHADE_DATA_DIR", "study_data"), ".allocation"))
+
+
+# ---------------------------
+# Shared counters
+# ---------------------------
+class MemoryCounter:
+    """Process-local counter."""
+
+    def __init__(self, start: int = 0):
+        self._value = start
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            n = self._value
+            self._value += 1
+            return n
+
+    def close(self):
+        pass
+
+
+class FileCounter:
+    """Counter in an 8-byte file, incremented under an exclusive ``flock``.
+
+    ``flock`` excludes other processes; threads of this one share the file
+    description, so they also take a thread lock.
+    """
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("FileCounter needs fcntl; use SHADE_ALLOCATOR=sqlite")
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                raw = os.pread(self._fd, 8, 0)
+                n = struct.unpack("<Q", raw)[0] if len(raw) == 8 else 0
+                os.pwrite(self._fd, struct.pack("<Q", n + 1), 0)
+                return n
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class SQLiteCounter:
+    """Counter row in a SQLite database (WAL mode), bumped in one transaction."""
+
+    def __init__(self, path: str, name: str = "sessions"):
+        self.path = path
+        self.name = name
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (name,))
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (value,) = self._conn.execute(
+                    "UPDATE counters SET value = value + 1 WHERE name = ? RETURNING value", (self.name,)).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return value - 1
+
+    def close(self):
+        self._conn.close()
+
+
+def counter_from_env(backend: str = BACKEND, path: str = COUNTER_PATH):
+    if backend == "file" and fcntl is not None:
+        return FileCounter(path)
+    if backend in ("sqlite", "file"):
+        return SQLiteCounter(path + ".sqlite")
+    if backend == "memory":
+        return MemoryCounter()
+    raise ValueError(f"unknown SHADE_ALLOCATOR: {backend!r}")
+
+
+# ---------------------------
+# Permuted blocks
+# ---------------------------
+@dataclass(frozen=True)
+class Allocation:
+    seed: int
+    condition: dict
+
+    @property
+    def block(self) -> int:
+        return self.seed // BLOCK_SIZE
+
+    def rng(self) -> random.Random:
+        """This session's own RNG."""
+        return random.Random(self.seed)
+
+
+@functools.lru_cache(maxsize=64)
+def _block(salt: str, block_size: int, block: int) -> tuple:
+    cells = list(CELLS) * (block_size // len(CELLS))
+    random.Random(f"{salt}:{block}").shuffle(cells)
+    return tuple(cells)
+
+
+def require_salt(salt: str = None) -> str:
+    """``salt``, else ``SHADE_ALLOCATION_SALT``; raises when neither is set."""
+    salt = salt or SALT
+    if not salt:
+        raise RuntimeError("no allocation salt: set SHADE_ALLOCATION_SALT")
+    return salt
+
+
+def replay(seed: int, salt: str = None, block_size: int = BLOCK_SIZE) -> dict:
+    """The condition the allocator gave sequence number ``seed``."""
+    block, pos = divmod(seed, block_size)
+    level, pov = _block(require_salt(salt), block_size, block)[pos]
+    return {"anthro_level": level, "pov": pov}
+
+
+class Allocator:
+    """Next sequence number from ``counter``, mapped to its cell."""
+
+    def __init__(self, counter, salt: str = None, block_size: int = BLOCK_SIZE):
+        salt = require_salt(salt)
+        if block_size <= 0 or block_size % len(CELLS):
+            raise ValueError(f"block size must be a positive multiple of {len(CELLS)}, got {block_size}")
+        self.counter = counter
+        self.salt = salt
+        self.block_size = block_size
+
+    def allocate(self) -> Allocation:
+        seed = self.counter.next()
+        return Allocation(seed, replay(seed, self.salt, self.block_size))
+
+    def close(self):
+        self.counter.close()
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def allocator(salt: str = None) -> Allocator:
+    """Process-wide allocator over the ``SHADE_ALLOCATOR`` counter, created on first use."""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            salt = require_salt(salt)
+            _allocator = Allocator(counter_from_env(), salt)
+        return _allocator
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("replay", help="print the condition for stored seeds")
+    p.add_argument("seeds", type=int, nargs="+")
+    p.add_argument("--salt", default=SALT, help="the study's salt (default: $SHADE_ALLOCATION_SALT)")
+    args = ap.parse_args()
+    if not args.salt:
+        ap.error("no allocation salt: set SHADE_ALLOCATION_SALT or pass --salt")
+    for seed in args.seeds:
+        c = replay(seed, args.salt)
+        print(f"{seed}\t{c['anthro_level']}\t{c['pov']}")
+
+
+if __name__ == '__main__':
+    main()
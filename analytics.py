@@ -0,0 +1,366 @@
+# analytics.py - offline analytics over study_data with columnar export
+"""Flatten every session in study_data/ into two Parquet tables and aggregate
+them by condition (anthro_level x pov x error_type).
+
+- ``messages.parquet``: one row per message (session, condition, step, role,
+  ts, latency to reply, content length)
+- ``sessions.parquet``: one row per session (condition, status, completion,
+  poem_attempts, duration, feedback scores)
+- ``aggregates.csv``: completion rate, poem_attempts, feedback scores and mean
+  time per step for each condition
+
+Sessions are read through ``archive.SessionSource``, so sessions packed into
+the archive (and removed from study_data/) are still counted.
+
+Runs are incremental: ``index.json`` in the output directory records the mtime
+and size of each session's snapshot and journal (or its archive record), and
+only sessions whose files changed (or appeared, or vanished) are re-parsed; the
+rest of the rows are carried over from the previous tables.
+
+    python analytics.py [--data-dir study_data] [--out study_data/.analytics] [--full]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from archive import SessionSource
+from fsutil import write_atomic
+
+INDEX_VERSION = 1
+MISSING = "unknown"
+
+MESSAGE_SCHEMA = pa.schema([
+    ('file', pa.string()),
+    ('session_id', pa.string()),
+    ('anthro_level', pa.string()),
+    ('pov', pa.string()),
+    ('error_type', pa.string()),
+    ('idx', pa.int32()),
+    ('step', pa.int16()),
+    ('role', pa.string()),
+    ('ts', pa.timestamp('us', tz='UTC')),
+    ('latency_to_reply', pa.float64()),
+    ('content_len', pa.int32()),
+])
+
+SESSION_SCHEMA = pa.schema([
+    ('file', pa.string()),
+    ('session_id', pa.string()),
+    ('participant_id', pa.string()),
+    ('anthro_level', pa.string()),
+    ('pov', pa.string()),
+    ('error_type', pa.string()),
+    ('status', pa.string()),
+    ('completed', pa.bool_()),
+    ('poem_attempts', pa.int32()),
+    ('max_step', pa.int16()),
+    ('n_messages', pa.int32()),
+    ('started_at', pa.timestamp('us', tz='UTC')),
+    ('duration_s', pa.float64()),
+    ('timer_expired', pa.bool_()),
+    ('ended_by_user', pa.bool_()),
+    ('difficulty', pa.float64()),
+    ('ai_helpful', pa.float64()),
+    ('noticed_error', pa.string()),
+])
+
+
+# ---------------------------
+# Change detection
+# ---------------------------
+def load_index(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, 'index.json')) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index.get('files', {})
+
+
+# ---------------------------
+# Flattening
+# ---------------------------
+def _ts_us(value):
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1_000_000)
+    except (TypeError, ValueError):
+        return None
+
+
+def _score(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def flatten(key: str, payload: dict, messages: dict, sessions: dict):
+    """Append one session's message rows and session row to the column dicts."""
+    state = payload.get('study_state') or {}
+    condition = payload.get('condition') or {}
+    feedback = state.get('feedback') or {}
+    session_id = payload.get('session_id') or key
+    level = condition.get('anthro_level') or MISSING
+    pov = condition.get('pov') or MISSING
+    error_type = state.get('error_type') or MISSING
+
+    msgs = payload.get('messages') or []
+    prev_user_ts = None
+    first_ts = last_ts = None
+    max_step = -1
+    for i, m in enumerate(msgs):
+        ts = _ts_us(m.get('ts'))
+        step = m.get('step')
+        role = m.get('role')
+        latency = None
+        if role == 'user':
+            prev_user_ts = ts
+        elif role == 'assistant' and prev_user_ts is not None and ts is not None:
+            latency = (ts - prev_user_ts) / 1e6
+            prev_user_ts = None
+        if ts is not None:
+            first_ts = ts if first_ts is None else first_ts
+            last_ts = ts
+        if step is not None:
+            max_step = max(max_step, step)
+        messages['file'].append(key)
+        messages['session_id'].append(session_id)
+        messages['anthro_level'].append(level)
+        messages['pov'].append(pov)
+        messages['error_type'].append(error_type)
+        messages['idx'].append(i)
+        messages['step'].append(step)
+        messages['role'].append(role)
+        messages['ts'].append(ts)
+        messages['latency_to_reply'].append(latency)
+        messages['content_len'].append(len(m.get('content') or ''))
+
+    status = payload.get('status') or MISSING
+    sessions['file'].append(key)
+    sessions['session_id'].append(session_id)
+    sessions['participant_id'].append(payload.get('id'))
+    sessions['anthro_level'].append(level)
+    sessions['pov'].append(pov)
+    sessions['error_type'].append(error_type)
+    sessions['status'].append(status)
+    # Same rule as summary_writer.rebuild_sessions_csv: recorded feedback counts as submitted.
+    sessions['completed'].append(status == 'final' or bool(feedback))
+    sessions['poem_attempts'].append(int(state.get('poem_attempts') or 0))
+    sessions['max_step'].append(max_step)
+    sessions['n_messages'].append(len(msgs))
+    sessions['started_at'].append(first_ts)
+    sessions['duration_s'].append((last_ts - first_ts) / 1e6 if first_ts is not None else None)
+    sessions['timer_expired'].append(bool(state.get('timer_expired')))
+    sessions['ended_by_user'].append(bool(state.get('ended_by_user')))
+    sessions['difficulty'].append(_score(feedback.get('difficulty')))
+    sessions['ai_helpful'].append(_score(feedback.get('ai_helpful')))
+    sessions['noticed_error'].append(feedback.get('noticed_error'))
+
+
+def _read_table(path: str, schema: pa.Schema):
+    try:
+        table = pq.read_table(path)
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return table if table.schema.equals(schema) else None
+
+
+def build(data_dir: str, out_dir: str, full: bool = False) -> dict:
+    """Bring the Parquet tables in ``out_dir`` up to date. Returns run stats."""
+    os.makedirs(out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    with SessionSource(data_dir) as source:
+        return _build(source, out_dir, full, t0)
+
+
+def _build(source: SessionSource, out_dir: str, full: bool, t0: float) -> dict:
+    messages_path = os.path.join(out_dir, 'messages.parquet')
+    sessions_path = os.path.join(out_dir, 'sessions.parquet')
+    current = source.signatures()
+    previous = {} if full else load_index(out_dir)
+    messages_table = _read_table(messages_path, MESSAGE_SCHEMA) if previous else None
+    sessions_table = _read_table(sessions_path, SESSION_SCHEMA) if previous else None
+    if messages_table is None or sessions_table is None:
+        # No usable previous run (or tables lost behind the index's back): parse everything.
+        previous = {}
+        messages_table, sessions_table = MESSAGE_SCHEMA.empty_table(), SESSION_SCHEMA.empty_table()
+    changed = sorted(k for k, sig in current.items() if previous.get(k) != sig)
+    removed = sorted(k for k in previous if k not in current)
+
+    if changed or removed:
+        stale = pa.array(changed + removed, pa.string())
+        messages_table = messages_table.filter(pc.invert(pc.is_in(messages_table['file'], value_set=stale)))
+        sessions_table = sessions_table.filter(pc.invert(pc.is_in(sessions_table['file'], value_set=stale)))
+
+        messages = {name: [] for name in MESSAGE_SCHEMA.names}
+        sessions = {name: [] for name in SESSION_SCHEMA.names}
+        failed = []
+        for key in changed:
+            try:
+                payload = source.load(key)
+            except (OSError, ValueError):
+                failed.append(key)
+                continue
+            flatten(key, payload, messages, sessions)
+        for key in failed:
+            current.pop(key)   # retried on the next run
+        messages_table = pa.concat_tables([messages_table, pa.table(messages, schema=MESSAGE_SCHEMA)])
+        sessions_table = pa.concat_tables([sessions_table, pa.table(sessions, schema=SESSION_SCHEMA)])
+        write_atomic(messages_path, lambda p: pq.write_table(messages_table, p, compression='zstd'))
+        write_atomic(sessions_path, lambda p: pq.write_table(sessions_table, p, compression='zstd'))
+
+    # The index goes last, so a crash mid-run only causes extra re-parsing next time.
+    write_atomic(os.path.join(out_dir, 'index.json'),
+                  lambda p: _dump_json(p, {'version': INDEX_VERSION, 'files': current}))
+    return {'sessions': len(current), 'parsed': len(changed), 'removed': len(removed),
+            'messages': messages_table.num_rows, 'seconds': time.perf_counter() - t0,
+            'messages_table': messages_table, 'sessions_table': sessions_table}
+
+
+def _dump_json(path: str, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f, separators=(',', ':'))
+
+
+# ---------------------------
+# Aggregates
+# ---------------------------
+def _column(table: pa.Table, name: str, dtype=np.float64) -> np.ndarray:
+    col = table[name]
+    if pa.types.is_string(col.type):
+        return np.asarray(col.fill_null(MISSING).to_pylist(), dtype=object)
+    if pa.types.is_timestamp(col.type):
+        col = col.cast(pa.int64())
+    return col.cast(pa.float64()).fill_null(np.nan).to_numpy().astype(dtype)
+
+
+def _group_mean(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    ok = ~np.isnan(values)
+    counts = np.bincount(codes[ok], minlength=n_groups)
+    sums = np.bincount(codes[ok], weights=values[ok], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def aggregate(sessions_table: pa.Table, messages_table: pa.Table) -> list:
+    """One dict per (anthro_level, pov, error_type) with the per-condition metrics."""
+    if sessions_table.num_rows == 0:
+        return []
+    conds = np.char.add(np.char.add(np.char.add(np.char.add(
+        _column(sessions_table, 'anthro_level').astype(str), '\t'),
+        _column(sessions_table, 'pov').astype(str)), '\t'),
+        _column(sessions_table, 'error_type').astype(str))
+    groups, codes = np.unique(conds, return_inverse=True)
+    n = len(groups)
+
+    noticed = _column(sessions_table, 'noticed_error')
+    noticed_yes = np.where(noticed == MISSING, np.nan, (noticed == 'Yes').astype(np.float64))
+    metrics = {
+        'sessions': np.bincount(codes, minlength=n),
+        'completion_rate': _group_mean(codes, _column(sessions_table, 'completed'), n),
+        'poem_attempts': _group_mean(codes, _column(sessions_table, 'poem_attempts'), n),
+        'duration_s': _group_mean(codes, _column(sessions_table, 'duration_s'), n),
+        'difficulty': _group_mean(codes, _column(sessions_table, 'difficulty'), n),
+        'ai_helpful': _group_mean(codes, _column(sessions_table, 'ai_helpful'), n),
+        'noticed_error_rate': _group_mean(codes, noticed_yes, n),
+    }
+
+    # Time per step: the gap from each message to the next one in the same session
+    # counts toward the earlier message's step, summed per session, averaged per condition.
+    step_means = {}
+    if messages_table.num_rows:
+        order = pc.sort_indices(messages_table, sort_keys=[('file', 'ascending'), ('idx', 'ascending')])
+        m = messages_table.take(order)
+        encoded = pc.dictionary_encode(m['file'].combine_chunks())
+        file_codes = encoded.indices.to_numpy().astype(np.int64)
+        ts = _column(m, 'ts')
+        steps = _column(m, 'step')
+        same = file_codes[1:] == file_codes[:-1]
+        gaps = np.where(same, np.diff(ts) / 1e6, np.nan)
+        ok = ~np.isnan(gaps) & ~np.isnan(steps[:-1])
+        session_group = dict(zip(sessions_table['file'].to_pylist(), codes.tolist()))
+        group_of_file = np.array([session_group.get(f, -1) for f in encoded.dictionary.to_pylist()], dtype=np.int64)
+        group_of_msg = group_of_file[file_codes[:-1]]
+        ok &= group_of_msg >= 0
+        if ok.any():
+            max_step = int(np.nanmax(steps)) + 1
+            step_codes = steps[:-1][ok].astype(np.int64)
+            per_session = file_codes[:-1][ok] * max_step + step_codes
+            keys, inverse = np.unique(per_session, return_inverse=True)
+            totals = np.bincount(inverse, weights=gaps[ok])
+            key_group = np.zeros(len(keys), dtype=np.int64)
+            key_group[inverse] = group_of_msg[ok]
+            key_step = keys % max_step
+            for s in range(max_step):
+                sel = key_step == s
+                if sel.any():
+                    step_means[s] = _group_mean(key_group[sel], totals[sel], n)
+
+    rows = []
+    for g, label in enumerate(groups):
+        level, pov, error_type = label.split('\t')
+        row = {'anthro_level': level, 'pov': pov, 'error_type': error_type}
+        row.update({name: values[g].item() for name, values in metrics.items()})
+        row.update({f'step{s}_s': values[g].item() for s, values in sorted(step_means.items())})
+        rows.append(row)
+    return rows
+
+
+def write_aggregates(rows: list, path: str):
+    fields = list(rows[0]) if rows else ['anthro_level', 'pov', 'error_type']
+    for row in rows:
+        fields += [k for k in row if k not in fields]
+
+    def write(p):
+        with open(p, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    write_atomic(path, write)
+
+
+def format_table(rows: list) -> str:
+    if not rows:
+        return "(no sessions)"
+    fields = list(rows[0])
+    cells = [[f"{v:.2f}" if isinstance(v, float) else str(v) for v in (r.get(k, '') for k in fields)] for r in rows]
+    widths = [max(len(h), *(len(c[i]) for c in cells)) for i, h in enumerate(fields)]
+    lines = ['  '.join(h.ljust(w) for h, w in zip(fields, widths))]
+    lines += ['  '.join(c.ljust(w) for c, w in zip(cell, widths)) for cell in cells]
+    return '\n'.join(lines)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--data-dir', default='study_data')
+    ap.add_argument('--out', default=None, help="output directory (default: <data-dir>/.analytics)")
+    ap.add_argument('--full', action='store_true', help="ignore the index and re-parse every session")
+    ap.add_argument('--quiet', action='store_true', help="skip printing the aggregate table")
+    args = ap.parse_args(argv)
+    out_dir = args.out or os.path.join(args.data_dir, '.analytics')
+
+    stats = build(args.data_dir, out_dir, full=args.full)
+    rows = aggregate(stats['sessions_table'], stats['messages_table'])
+    write_aggregates(rows, os.path.join(out_dir, 'aggregates.csv'))
+    print(f"{stats['sessions']} sessions ({stats['parsed']} parsed, {stats['removed']} removed), "
+          f"{stats['messages']} messages in {stats['seconds']:.2f}s -> {out_dir}")
+    if not args.quiet:
+        print(format_table(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,451 @@
+# archive.py - segmented, compressed archive of finished sessions
+"""Pack finished session snapshots from study_data/ into append-only segments.
+
+``study_data/archive/`` holds ``segment_<n>.seg`` files. Each one starts with
+a zlib preset dictionary taken from sample sessions (their keys, condition
+dicts and template text). It is followed by one record per session: a
+``<II`` header (length, crc32) and the session's compact JSON, deflated
+against that dictionary. Records are independent, so one session is read by
+slicing its bytes out of an ``mmap`` and inflating only those. A full scan
+streams records in order without the index.
+
+Each segment has a sidecar ``segment_<n>.idx`` (JSON lines: session_id,
+participant id, status, saved_at, the loose file's base name, offset, length),
+which maps session and participant ids to records. Records are fsynced before their index lines. On
+reopen, bytes past the last indexed record are cut off, so a crash mid-pack
+leaves nothing half-written. Segments roll over at
+``SHADE_ARCHIVE_SEGMENT_BYTES``.
+
+Only snapshots with a terminal status (no journal left) are packed, and
+snapshots already in the archive are skipped. A session whose terminal
+snapshot changed since it was packed (say ``final`` after ``abandoned``) is
+appended again; its latest index entry wins. Loose files are kept unless
+``--remove`` is passed. Readers see both layouts: ``FilesystemStorage``
+falls back to the archive, and ``SessionSource`` / ``iter_sessions`` (used by
+analytics.py, search.py, ``rebuild_sessions_csv`` and ``rhyme.py validate``)
+yield loose sessions plus archived ones whose loose files are gone.
+
+    python archive.py pack [--data-dir study_data] [--remove]
+    python archive.py get <session_id> | --participant <id>
+    python archive.py stats
+"""
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+from session_store import (JOURNAL_EXT, SNAPSHOT_EXT, TERMINAL_STATUSES, iter_session_paths, load_session,
+                           scan_session_files)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts fall back to a process-local lock
+    fcntl = None
+
+SEGMENT_BYTES = int(os.environ.get("SHADE_ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_DIR = 'archive'
+DICT_BYTES = 32 * 1024          # zlib's window: dictionary bytes beyond this are never referenced
+DICT_SAMPLES = 16
+LEVEL = 9
+
+_MAGIC = b"SHSEG1\n"
+_DICT_LEN = struct.Struct("<I")
+_RECORD = struct.Struct("<II")  # compressed length, crc32 of the compressed bytes
+
+_local_lock = threading.Lock()
+
+
+def _compact(payload: dict) -> bytes:
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def build_dictionary(payloads: list) -> bytes:
+    """Preset dictionary: the start of each of a few sample sessions, up to zlib's window."""
+    samples = [_compact(p) for p in payloads[:DICT_SAMPLES]]
+    if not samples:
+        return b""
+    share = DICT_BYTES // len(samples)
+    return b"".join(s[:share] for s in samples)
+
+
+def _segment_name(n: int) -> str:
+    return f"segment_{n:06d}.seg"
+
+
+def _segment_number(path: str) -> int:
+    return int(os.path.basename(path)[len("segment_"):-len(".seg")])
+
+
+def _key(payload: dict) -> str:
+    """Base name a session's loose files get from ``FilesystemStorage``."""
+    return f"participant_{payload.get('id')}_{payload.get('session_id')}"
+
+
+class _Segment:
+    """One segment file: its dictionary, its index entries, and a lazy mmap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.number = _segment_number(path)
+        self.index_path = path[:-len(".seg")] + ".idx"
+        with open(path, 'rb') as f:
+            head = f.read(len(_MAGIC) + _DICT_LEN.size)
+            if head[:len(_MAGIC)] != _MAGIC:
+                raise ValueError(f"{path}: not an archive segment")
+            (dict_len,) = _DICT_LEN.unpack_from(head, len(_MAGIC))
+            self.zdict = f.read(dict_len)
+        self.data_start = len(_MAGIC) + _DICT_LEN.size + len(self.zdict)
+        self.entries = []
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    if line.strip():
+                        self.entries.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        self._mmap = None
+
+    @property
+    def end(self) -> int:
+        """Offset just past the last indexed record."""
+        if not self.entries:
+            return self.data_start
+        last = self.entries[-1]
+        return last['offset'] + last['length']
+
+    def view(self) -> mmap.mmap:
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def read(self, entry: dict) -> dict:
+        mm = self.view()
+        length, crc = _RECORD.unpack_from(mm, entry['offset'] - _RECORD.size)
+        body = mm[entry['offset']:entry['offset'] + length]
+        if zlib.crc32(body) != crc:
+            raise ValueError(f"{self.path}: corrupt record at {entry['offset']}")
+        return json.loads(_inflate(body, self.zdict))
+
+    def records(self):
+        """Stream every record in file order, index not needed."""
+        with open(self.path, 'rb', buffering=1024 * 1024) as f:
+            f.seek(self.data_start)
+            while True:
+                head = f.read(_RECORD.size)
+                if len(head) < _RECORD.size:
+                    return
+                length, crc = _RECORD.unpack(head)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    return      # a torn tail from an interrupted pack
+                yield json.loads(_inflate(body, self.zdict))
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def _deflate(data: bytes, zdict: bytes) -> bytes:
+    c = zlib.compressobj(LEVEL, zlib.DEFLATED, -15, 9, zdict=zdict) if zdict else \
+        zlib.compressobj(LEVEL, zlib.DEFLATED, -15, 9)
+    return c.compress(data) + c.flush()
+
+
+def _inflate(data: bytes, zdict: bytes) -> bytes:
+    d = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+    return d.decompress(data) + d.flush()
+
+
+class SessionArchive:
+    """Reader and appender for the segments under ``root``."""
+
+    def __init__(self, root: str, segment_bytes: int = SEGMENT_BYTES):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.segments = []
+        self._load()
+
+    def _load(self):
+        self.close()
+        self.segments = [_Segment(p) for p in sorted(glob.glob(os.path.join(glob.escape(self.root), "segment_*.seg")))]
+        self._by_session = {}
+        self._by_participant = {}
+        for seg in self.segments:
+            for entry in seg.entries:
+                self._add(seg, entry)
+
+    def _add(self, seg: _Segment, entry: dict):
+        # A session archived again (a newer terminal snapshot) is found by its last entry.
+        if entry['session_id'] not in self._by_session:
+            self._by_participant.setdefault(entry.get('id'), []).append(entry['session_id'])
+        self._by_session[entry['session_id']] = (seg, entry)
+
+    def holds(self, payload: dict) -> bool:
+        """Whether the archive's latest record of this session is this snapshot (same status and saved_at)."""
+        found = self._by_session.get(payload.get('session_id'))
+        return found is not None and (found[1].get('status'), found[1].get('saved_at')) == \
+            (payload.get('status'), payload.get('saved_at'))
+
+    def __len__(self):
+        return len(self._by_session)
+
+    def __contains__(self, session_id):
+        return session_id in self._by_session
+
+    def get(self, session_id: str):
+        """The archived payload, or None."""
+        found = self._by_session.get(session_id)
+        return found[0].read(found[1]) if found else None
+
+    def by_participant(self, participant_id: str) -> list:
+        return [self.get(sid) for sid in self._by_participant.get(participant_id, [])]
+
+    def entries(self):
+        for seg in self.segments:
+            yield from seg.entries
+
+    def __iter__(self):
+        """Every archived payload, segment by segment."""
+        for seg in self.segments:
+            yield from seg.records()
+
+    # ---------------------------
+    # Appending
+    # ---------------------------
+    def append(self, payloads: list, keys: list = None) -> int:
+        """Append ``payloads``, skipping snapshots the archive already holds. Returns how many were written.
+
+        A session archived before with a different status or saved_at gets a
+        new record, and its latest index entry wins.
+
+        ``keys`` are the payloads' loose base names, when they differ from the
+        ``participant_<id>_<session_id>`` default.
+        """
+        keys = keys or [_key(p) for p in payloads]
+        payloads = [(k, p) for k, p in zip(keys, payloads) if not self.holds(p)]
+        if not payloads:
+            return 0
+        os.makedirs(self.root, exist_ok=True)
+        with _local_lock, open(os.path.join(self.root, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                self._load()    # another process may have appended since
+                payloads = [(k, p) for k, p in payloads if not self.holds(p)]
+                written = 0
+                while written < len(payloads):
+                    seg = self._writable_segment(payloads[written:])
+                    written += self._fill(seg, payloads[written:])
+                return written
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _writable_segment(self, pending: list) -> _Segment:
+        if self.segments and self.segments[-1].end < self.segment_bytes:
+            seg = self.segments[-1]
+        else:
+            n = self.segments[-1].number + 1 if self.segments else 1
+            zdict = build_dictionary([p for _, p in pending])
+            path = os.path.join(self.root, _segment_name(n))
+            with open(path, 'wb') as f:
+                f.write(_MAGIC + _DICT_LEN.pack(len(zdict)) + zdict)
+                f.flush()
+                os.fsync(f.fileno())
+            seg = _Segment(path)
+            self.segments.append(seg)
+        seg.close()
+        return seg
+
+    def _fill(self, seg: _Segment, pending: list) -> int:
+        """Write records into ``seg`` until it is full; index lines only after the data is durable."""
+        entries, offset = [], seg.end
+        with open(seg.path, 'r+b') as f:
+            f.truncate(offset)      # drop any unindexed tail
+            f.seek(offset)
+            for key, payload in pending:
+                if entries and offset >= self.segment_bytes:
+                    break
+                body = _deflate(_compact(payload), seg.zdict)
+                f.write(_RECORD.pack(len(body), zlib.crc32(body)))
+                offset += _RECORD.size
+                entries.append({'session_id': payload.get('session_id'), 'id': payload.get('id'),
+                                'status': payload.get('status'), 'saved_at': payload.get('saved_at'),
+                                'key': key, 'offset': offset, 'length': len(body)})
+                f.write(body)
+                offset += len(body)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(seg.index_path, 'a') as f:
+            f.writelines(json.dumps(e) + "\n" for e in entries)
+            f.flush()
+            os.fsync(f.fileno())
+        for e in entries:
+            seg.entries.append(e)
+            self._add(seg, e)
+        return len(entries)
+
+    def stats(self) -> dict:
+        size = sum(os.path.getsize(p) for s in self.segments for p in (s.path, s.index_path) if os.path.exists(p))
+        return {'segments': len(self.segments), 'sessions': len(self), 'bytes': size}
+
+    def close(self):
+        for seg in self.segments:
+            seg.close()
+
+
+def archive_dir(data_dir: str) -> str:
+    return os.path.join(data_dir, ARCHIVE_DIR)
+
+
+def pack(data_dir: str = 'study_data', remove: bool = False, batch: int = 256,
+         segment_bytes: int = SEGMENT_BYTES) -> dict:
+    """Archive every finished snapshot in ``data_dir``; with ``remove``, delete the loose files after.
+
+    A loose file is removed only once the archive's latest record of its
+    session is that same snapshot.
+    """
+    archive = SessionArchive(archive_dir(data_dir), segment_bytes)
+    packed = skipped = removed = 0
+    pending, keys, loose = [], [], []
+
+    def flush():
+        nonlocal packed, removed
+        packed += archive.append(pending, keys)
+        if remove:
+            for base, payload in loose:
+                if archive.holds(payload):
+                    os.remove(base + SNAPSHOT_EXT)
+                    removed += 1
+        pending.clear()
+        keys.clear()
+        loose.clear()
+
+    try:
+        for base in iter_session_paths(data_dir):
+            if os.path.exists(base + JOURNAL_EXT):
+                skipped += 1
+                continue
+            payload = load_session(base)
+            if payload.get('status') not in TERMINAL_STATUSES:
+                skipped += 1
+                continue
+            if not archive.holds(payload):
+                pending.append(payload)
+                keys.append(os.path.basename(base))
+            loose.append((base, payload))
+            if len(pending) >= batch or len(loose) >= batch:
+                flush()
+        flush()
+        return dict(archive.stats(), packed=packed, skipped=skipped, removed=removed)
+    finally:
+        archive.close()
+
+
+# ---------------------------
+# Loose plus archived sessions
+# ---------------------------
+class SessionSource:
+    """Every session in ``data_dir``: loose snapshots and journals, plus the
+    archived records whose loose files are gone.
+
+    Sessions are keyed by loose base name (``participant_<id>_<session_id>``);
+    an archived record keeps the key it was packed under, so packing with
+    ``--remove`` does not rename anything. ``signatures()`` gives each key a
+    value that changes when the session does, for incremental readers.
+    """
+
+    def __init__(self, data_dir: str = 'study_data'):
+        self.data_dir = data_dir
+        self._loose = scan_session_files(data_dir)
+        self._archive = None
+        self._archived = {}
+        if os.path.isdir(archive_dir(data_dir)):
+            self._archive = SessionArchive(archive_dir(data_dir))
+            for seg in self._archive.segments:
+                for entry in seg.entries:
+                    key = entry.get('key') or _key(entry)
+                    if key not in self._loose:
+                        self._archived[key] = (seg, entry)
+
+    def __len__(self):
+        return len(self._loose) + len(self._archived)
+
+    def keys(self) -> list:
+        return sorted([*self._loose, *self._archived])
+
+    def signatures(self) -> dict:
+        """Loose files' [snapshot, journal] mtime/size signatures; ``["archive", segment, offset]`` for records."""
+        sigs = dict(self._loose)
+        for key, (seg, entry) in self._archived.items():
+            sigs[key] = ["archive", os.path.basename(seg.path), entry['offset']]
+        return sigs
+
+    def load(self, key: str) -> dict:
+        if key in self._loose:
+            return load_session(os.path.join(self.data_dir, key))
+        found = self._archived.get(key)
+        if found is None:
+            raise FileNotFoundError(os.path.join(self.data_dir, key))
+        return found[0].read(found[1])
+
+    def __iter__(self):
+        """``(key, payload)`` for every session, in key order."""
+        for key in self.keys():
+            yield key, self.load(key)
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_sessions(data_dir: str = 'study_data'):
+    """Yield ``(key, payload)`` for every session in ``data_dir``, loose or archived."""
+    with SessionSource(data_dir) as source:
+        yield from source
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--data-dir', default='study_data')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('pack', help="append finished snapshots to the archive")
+    p.add_argument('--remove', action='store_true', help="delete each loose snapshot once archived")
+    p = sub.add_parser('get', help="print archived sessions as JSON")
+    p.add_argument('session_id', nargs='?')
+    p.add_argument('--participant')
+    sub.add_parser('stats', help="segment and session counts")
+    args = ap.parse_args(argv)
+
+    if args.cmd == 'pack':
+        print(json.dumps(pack(args.data_dir, remove=args.remove)))
+        return 0
+    archive = SessionArchive(archive_dir(args.data_dir))
+    try:
+        if args.cmd == 'stats':
+            print(json.dumps(archive.stats()))
+            return 0
+        found = archive.by_participant(args.participant) if args.participant else \
+            [p for p in [archive.get(args.session_id)] if p is not None]
+        for payload in found:
+            print(json.dumps(payload, indent=2))
+        return 0 if found else 1
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
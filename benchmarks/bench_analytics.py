@@ -0,0 +1,69 @@
+# benchmarks/bench_analytics.py - full vs incremental analytics runs on a synthetic study
+"""Write N synthetic session snapshots, then time a full analytics build, an
+unchanged re-run, and a re-run after 1% of the sessions changed.
+
+    python benchmarks/bench_analytics.py [--sessions 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+from session_store import write_snapshot  # noqa: E402
+from storage.conformance import make_payload  # noqa: E402
+from templates import CONDITIONS  # noqa: E402
+
+ERROR_TYPES = ["six_lines", "non_rhyme", "foreign_token"]
+
+
+def synthetic_payload(i: int, rng: random.Random) -> dict:
+    level, pov = rng.choice(CONDITIONS)
+    p = make_payload(f"{i:08d}-bench", rng.randint(4, 40), status=rng.choice(["final", "final", "partial"]))
+    p['condition'] = {'anthro_level': level, 'pov': pov}
+    p['study_state']['error_type'] = rng.choice(ERROR_TYPES)
+    if p['status'] == 'final':
+        p['study_state']['feedback'] = {'difficulty': rng.randint(1, 5), 'ai_helpful': rng.randint(1, 5),
+                                        'noticed_error': rng.choice(["Yes", "No", "Not sure"])}
+    return p
+
+
+def timed_run(data_dir: str, out_dir: str) -> str:
+    t0 = time.perf_counter()
+    stats = analytics.build(data_dir, out_dir)
+    t1 = time.perf_counter()
+    rows = analytics.aggregate(stats['sessions_table'], stats['messages_table'])
+    t2 = time.perf_counter()
+    return (f"parsed {stats['parsed']:6d}  build {t1 - t0:6.2f}s  aggregate {t2 - t1:5.2f}s  "
+            f"({len(rows)} condition groups, {stats['messages']} messages)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sessions', type=int, default=20000)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as workdir:
+        data_dir = os.path.join(workdir, 'study_data')
+        out_dir = os.path.join(workdir, 'analytics')
+        os.makedirs(data_dir)
+        paths = []
+        for i in range(args.sessions):
+            path = os.path.join(data_dir, f"participant_P{i:06d}_{i:08d}.json")
+            write_snapshot(path, synthetic_payload(i, rng))
+            paths.append(path)
+        print(f"{args.sessions} sessions in {data_dir}")
+        print(f"  full        {timed_run(data_dir, out_dir)}")
+        print(f"  unchanged   {timed_run(data_dir, out_dir)}")
+        for i in rng.sample(range(args.sessions), max(1, args.sessions // 100)):
+            write_snapshot(paths[i], synthetic_payload(i, rng))
+        print(f"  1% changed  {timed_run(data_dir, out_dir)}")
+
+
+if __name__ == '__main__':
+    main()
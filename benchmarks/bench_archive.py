@@ -0,0 +1,140 @@
+# benchmarks/bench_archive.py - compression, lookup and scan throughput of archive.py vs loose files
+"""Write N finished sessions (engine-driven transcripts of 5-60 turns) as loose
+snapshots, pack them with ``archive.pack``, and compare the two layouts:
+
+- bytes on disk (apparent size and allocated blocks)
+- random lookups by session_id: ``FilesystemStorage.load_session`` over loose
+  files (a glob per lookup), ``load_session`` when the path is already known,
+  and ``SessionArchive.get``
+- a full scan: ``iter_session_paths`` + ``load_session`` vs iterating the archive
+
+Also checks that every archived session equals its loose snapshot, and that a
+torn tail left by an interrupted pack is dropped on the next pack. Exits
+non-zero if not.
+
+    python benchmarks/bench_archive.py [--sessions 2000] [--lookups 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+from allocation import replay  # noqa: E402
+from engine import Engine  # noqa: E402
+from session_store import iter_session_paths, load_session, write_snapshot  # noqa: E402
+from storage.filesystem import FilesystemStorage  # noqa: E402
+
+SCRIPT = ["ready", "the ocean at dawn", "a moment of beauty", "hopeful", "yes"]
+ERROR_TYPES = ["six_lines", "non_rhyme", "foreign_token"]
+
+
+def synthetic_session(i: int, rng: random.Random, engine: Engine) -> dict:
+    condition = replay(i, "bench")
+    state = engine.new_state(condition, rng.choice(ERROR_TYPES))
+    messages = [engine.greeting(state)]
+    for t in range(rng.randint(5, 60)):
+        text = SCRIPT[t] if t < len(SCRIPT) else f"make the imagery warmer, revision {t}"
+        messages.append(engine.user_message(state, text))
+        state, reply = engine.respond(state, text)
+        messages.append(reply)
+    study_state = dict(state['study_state'], feedback={'difficulty': rng.randint(1, 5),
+                                                       'ai_helpful': rng.randint(1, 5), 'noticed_error': "Yes"})
+    return {'participant': f"Participant {i}", 'id': f"P{i:06d}", 'messages': messages,
+            'study_state': study_state, 'session_id': f"{i:08d}-{rng.getrandbits(64):016x}",
+            'condition': condition, 'seed': i, 'status': rng.choice(["final", "final", "abandoned"]),
+            'saved_at': messages[-1]['ts']}
+
+
+def disk_usage(paths) -> tuple:
+    sizes = [os.stat(p) for p in paths]
+    return sum(s.st_size for s in sizes), sum(s.st_blocks * 512 for s in sizes)
+
+
+def rate(n: int, seconds: float) -> str:
+    return f"{n / seconds:>10,.0f}/s"
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sessions', type=int, default=2000)
+    ap.add_argument('--lookups', type=int, default=1000)
+    args = ap.parse_args()
+
+    rng = random.Random(18)
+    engine = Engine()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, 'study_data')
+        os.makedirs(data_dir)
+        paths, payloads = {}, {}
+        for i in range(args.sessions):
+            p = synthetic_session(i, rng, engine)
+            path = os.path.join(data_dir, f"participant_{p['id']}_{p['session_id']}.json")
+            write_snapshot(path, p)
+            paths[p['session_id']], payloads[p['session_id']] = path, p
+        loose_bytes, loose_blocks = disk_usage(paths.values())
+
+        t0 = time.perf_counter()
+        stats = archive.pack(data_dir, segment_bytes=8 * 1024 * 1024)
+        pack_s = time.perf_counter() - t0
+        arc = archive.SessionArchive(archive.archive_dir(data_dir))
+        seg_files = [p for s in arc.segments for p in (s.path, s.index_path)]
+        arc_bytes, arc_blocks = disk_usage(seg_files)
+
+        print(f"{args.sessions} sessions, {sum(len(p['messages']) for p in payloads.values()):,} messages; "
+              f"packed {stats['packed']} into {stats['segments']} segment(s) in {pack_s:.2f}s")
+        print(f"{'on disk':<28} {'files':>6} {'bytes':>13} {'allocated':>13}")
+        print(f"  {'loose snapshots':<26} {len(paths):>6} {loose_bytes:>13,} {loose_blocks:>13,}")
+        print(f"  {'archive':<26} {len(seg_files):>6} {arc_bytes:>13,} {arc_blocks:>13,}")
+        print(f"  compression ratio {loose_bytes / arc_bytes:.1f}x (allocated {loose_blocks / arc_blocks:.1f}x)")
+
+        ids = [rng.choice(list(paths)) for _ in range(args.lookups)]
+        storage = FilesystemStorage(data_dir)
+        timings = []
+        for label, fn in (("loose, by session_id", storage.load_session),
+                          ("loose, known path", lambda sid: load_session(paths[sid])),
+                          ("archive.get (mmap)", arc.get)):
+            t0 = time.perf_counter()
+            for sid in ids:
+                fn(sid)
+            timings.append((label, time.perf_counter() - t0))
+        t0 = time.perf_counter()
+        n_loose = sum(1 for base in iter_session_paths(data_dir) if load_session(base))
+        timings.append(("scan loose", time.perf_counter() - t0))
+        t0 = time.perf_counter()
+        n_arc = sum(1 for _ in arc)
+        timings.append(("scan archive", time.perf_counter() - t0))
+        print("throughput (warm page cache)")
+        for label, seconds in timings:
+            n = n_loose if label == "scan loose" else n_arc if label == "scan archive" else len(ids)
+            print(f"  {label:<26} {rate(n, seconds)}")
+
+        problems = [sid for sid, p in payloads.items() if arc.get(sid) != p]
+        if sorted(p['session_id'] for p in arc) != sorted(payloads):
+            problems.append("scan")
+        if arc.by_participant("P000001") != [payloads[next(s for s in payloads if s.startswith("00000001-"))]]:
+            problems.append("by_participant")
+        arc.close()
+
+        # An interrupted pack: unindexed bytes at the segment's end are dropped by the next one.
+        last = arc.segments[-1].path
+        with open(last, 'ab') as f:
+            f.write(b"\x00" * 37)
+        extra = synthetic_session(args.sessions, rng, engine)
+        write_snapshot(os.path.join(data_dir, f"participant_{extra['id']}_{extra['session_id']}.json"), extra)
+        archive.pack(data_dir, segment_bytes=8 * 1024 * 1024)
+        arc = archive.SessionArchive(archive.archive_dir(data_dir))
+        if arc.get(extra['session_id']) != extra or sum(1 for _ in arc) != args.sessions + 1:
+            problems.append("torn tail")
+        arc.close()
+
+    print("archive round trip:", "ok" if not problems else f"FAIL {problems[:5]}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
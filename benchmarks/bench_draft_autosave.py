@@ -0,0 +1,96 @@
+# benchmarks/bench_draft_autosave.py - feedback-page disk writes, legacy vs. autosaver
+"""Simulate many concurrent feedback pages. Each page reruns at random
+intervals; most reruns change nothing, some come in bursts of edits
+(slider drags, text edits). Legacy writes the draft on every rerun; the
+autosaver writes only changed answers and coalesces bursts.
+
+    python benchmarks/bench_draft_autosave.py [--pages 50] [--reruns 40] [--window 0.2]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from draft_autosave import DraftAutosaver, autosave_metrics  # noqa: E402
+from session_store import SessionJournal, load_session  # noqa: E402
+
+
+def base_payload(sid: str) -> dict:
+    return {'participant': "Bench", 'id': sid, 'messages': [], 'session_id': sid,
+            'condition': {"anthro_level": "A0", "pov": "none"}, 'seed': 0,
+            'study_state': {'feedback': {}, 'feedback_draft': {}}}
+
+
+def make_persist(journal: SessionJournal, payload: dict, lock: threading.Lock):
+    def persist(answers):
+        with lock:
+            payload['study_state']['feedback_draft'] = dict(answers, draft_saved_at=datetime.utcnow().isoformat() + 'Z')
+            journal.save(dict(payload, status="partial", saved_at=datetime.utcnow().isoformat() + 'Z'))
+    return persist
+
+
+def page(idx: int, workdir: str, reruns: int, use_autosaver: bool, window: float, counts: dict):
+    rng = random.Random(idx)
+    payload = base_payload(f"P{idx}")
+    journal = SessionJournal(os.path.join(workdir, f"{'auto' if use_autosaver else 'legacy'}_{idx}"), fsync="never")
+    lock = threading.Lock()
+    persist = make_persist(journal, payload, lock)
+    saver = DraftAutosaver(persist, window=window) if use_autosaver else None
+    answers = {'difficulty': 3, 'ai_helpful': 3, 'noticed_error': "Not sure", 'error_detail': "", 'comments': ""}
+    for _ in range(reruns):
+        if rng.random() < 0.3:
+            answers = dict(answers, difficulty=rng.randint(1, 5), comments=answers['comments'] + rng.choice("ab "))
+        time.sleep(rng.uniform(0.0, window / 2))
+        if saver is not None:
+            saver.update(answers)
+        else:
+            persist(answers)
+            counts['legacy_writes'] += 1
+    if saver is not None:
+        saver.close()
+    final = load_session(journal.base_path)['study_state']['feedback_draft']
+    assert {k: final[k] for k in answers} == answers, "last draft not flushed"
+    counts['bytes'] += journal.bytes_written
+
+
+def run(pages: int, reruns: int, window: float, use_autosaver: bool) -> dict:
+    counts = {'legacy_writes': 0, 'bytes': 0}
+    with tempfile.TemporaryDirectory() as workdir:
+        threads = [threading.Thread(target=page, args=(i, workdir, reruns, use_autosaver, window, counts))
+                   for i in range(pages)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counts['elapsed'] = time.perf_counter() - t0
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--pages', type=int, default=50)
+    ap.add_argument('--reruns', type=int, default=40)
+    ap.add_argument('--window', type=float, default=0.2)
+    args = ap.parse_args()
+
+    legacy = run(args.pages, args.reruns, args.window, use_autosaver=False)
+    auto = run(args.pages, args.reruns, args.window, use_autosaver=True)
+    m = autosave_metrics()
+    print(f"pages={args.pages} reruns/page={args.reruns} window={args.window}s")
+    print(f"  legacy     writes={legacy['legacy_writes']:>6}  bytes={legacy['bytes']:>10,}  "
+          f"writes/s={legacy['legacy_writes'] / legacy['elapsed']:.1f}")
+    print(f"  autosaver  writes={m['writes']:>6}  bytes={auto['bytes']:>10,}  "
+          f"writes/s={m['writes'] / auto['elapsed']:.1f}")
+    print(f"  writes avoided={m['writes_avoided']}  coalesced={m['coalesced']}  "
+          f"flush mean={m['flush_seconds_mean'] * 1000:.3f}ms max={m['flush_seconds_max'] * 1000:.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
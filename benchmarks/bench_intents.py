@@ -0,0 +1,90 @@
+# benchmarks/bench_intents.py - per-message intent matching cost on recorded transcripts
+"""Time the compiled intent matcher against the old substring chain (the checks
+get_response and the chat-stage step advancement used to run) over every user
+message recorded in study_data/, and list the messages where they disagree.
+
+    python benchmarks/bench_intents.py [--data-dir study_data] [--repeat 2000]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import intents  # noqa: E402
+from session_store import iter_session_paths, load_session  # noqa: E402
+
+
+def legacy_match(user_msg: str, step: int):
+    """The pre-intents.py logic: response branch plus the separate step advancement."""
+    msg_lower = user_msg.lower()
+    if "end" in msg_lower and "study" in msg_lower:
+        return 'end_study', step
+    if step == 0:
+        advance = any(w in msg_lower for w in ['ready', 'start', 'yes', 'begin']) or len(user_msg.strip()) > 6
+        if any(w in msg_lower for w in ['ready', 'start', 'begin', 'yes', 'poem']):
+            return 'start', 1 if advance else 0
+        if len(user_msg.strip()) > 6:
+            return 'long_input', 1
+    elif step == 1 and len(user_msg.strip()) > 0:
+        return 'topic', 2
+    elif step == 2 and len(user_msg.strip()) > 0:
+        return 'content_arc', 3
+    elif step == 3:
+        return ('tone', 4) if len(user_msg.strip()) > 0 else ('tone_default', 3)
+    elif step == 4:
+        if any(w in msg_lower for w in ['yes', 'continue', 'proceed', 'go ahead']):
+            return 'confirm', 5
+        if "poem on" in msg_lower or "poem about" in msg_lower:
+            return 'redirect', 4
+    elif step == 5:
+        if re.search(r'\b(10\s*lines|ten\s*lines)\b', msg_lower):
+            return 'ten_lines', 5
+        return 'revise', 5
+    return 'fallback', step
+
+
+def load_corpus(data_dir: str):
+    corpus = []
+    for base in iter_session_paths(data_dir):
+        payload = load_session(base)
+        for m in payload.get('messages') or []:
+            if m.get('role') == 'user' and 'step' in m:
+                corpus.append((m['content'], m['step']))
+    return corpus
+
+
+def per_message_ns(fn, corpus, repeat: int) -> float:
+    t0 = time.perf_counter_ns()
+    for _ in range(repeat):
+        for text, step in corpus:
+            fn(text, step)
+    return (time.perf_counter_ns() - t0) / (repeat * len(corpus))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                        'study_data'))
+    ap.add_argument('--repeat', type=int, default=2000)
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.data_dir)
+    if not corpus:
+        sys.exit(f"no user messages with a recorded step under {args.data_dir}")
+    print(f"{len(corpus)} user messages from {args.data_dir}")
+    chain = per_message_ns(legacy_match, corpus, args.repeat)
+    print(f"  substring chain   {chain:8.0f} ns/message (the old turn ran it twice: {2 * chain:.0f} ns)")
+    print(f"  compiled matcher  {per_message_ns(intents.match, corpus, args.repeat):8.0f} ns/message")
+
+    diffs = [(t, s, legacy_match(t, s), intents.match(t, s)) for t, s in corpus
+             if legacy_match(t, s) != intents.match(t, s)]
+    print(f"  disagreements     {len(diffs)}")
+    for text, step, old, new in diffs:
+        print(f"    step {step} {text!r}: {old} -> {new}")
+
+
+if __name__ == '__main__':
+    main()
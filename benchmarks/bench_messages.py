@@ -0,0 +1,99 @@
+# benchmarks/bench_messages.py - memory and file size of a 200-turn transcript
+"""Build a 200-turn session with engine.Engine and compare:
+
+- resident memory (tracemalloc) of the transcript as dicts (as the app used to
+  build it, and as loaded back from JSON) and as a messages.Transcript
+- on-disk size as the pretty snapshot, compact JSON, and Transcript.encode()
+- append, to_json and encode/decode time
+
+Also checks that the Transcript's JSON is byte-identical to the dicts' and
+that encode/decode round-trips; exits non-zero if not.
+
+    python benchmarks/bench_messages.py [--turns 200]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Engine  # noqa: E402
+from messages import Transcript  # noqa: E402
+
+SCRIPT = ["ready", "the ocean at dawn", "a moment of beauty", "hopeful", "yes"]
+
+
+def session(turns: int, into):
+    """Run ``turns`` user turns through the engine, appending both sides to ``into``."""
+    engine = Engine()
+    state = engine.new_state({"anthro_level": "A2", "pov": "third"}, "non_rhyme")
+    into.append(engine.greeting(state))
+    for i in range(turns):
+        text = SCRIPT[i] if i < len(SCRIPT) else f"make the imagery warmer, revision {i}"
+        into.append(engine.user_message(state, text))
+        state, reply = engine.respond(state, text)
+        into.append(reply)
+    return into
+
+
+def resident(build) -> tuple:
+    """(bytes still allocated after ``build()``, the built object)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, obj
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--turns', type=int, default=200)
+    args = ap.parse_args()
+
+    session(args.turns, [])   # warm the template and intent caches outside the measurements
+    live_dicts, dicts = resident(lambda: session(args.turns, []))
+    snapshot = json.dumps(dicts, indent=2)
+    loaded_dicts, _ = resident(lambda: json.loads(snapshot))
+    live_transcript, transcript = resident(lambda: session(args.turns, Transcript()))
+    loaded_transcript, _ = resident(lambda: Transcript(json.loads(snapshot)))
+    n = len(dicts)
+
+    print(f"{args.turns} turns, {n} messages, {sum(len(m['content']) for m in dicts):,} content characters")
+    print(f"{'resident memory':<34} {'bytes':>10} {'per message':>12}")
+    for label, size in (("dicts, built in the app", live_dicts), ("dicts, loaded from JSON", loaded_dicts),
+                        ("Transcript, built in the app", live_transcript),
+                        ("Transcript, loaded from JSON", loaded_transcript)):
+        print(f"  {label:<32} {size:>10,} {size / n:>12.0f}")
+
+    compact = json.dumps(dicts, separators=(',', ':'))
+    encoded = transcript.encode()
+    print(f"{'on disk':<34} {'bytes':>10}")
+    for label, size in (("snapshot JSON (indent=2)", len(snapshot.encode())),
+                        ("compact JSON", len(compact.encode())), ("Transcript.encode()", len(encoded))):
+        print(f"  {label:<32} {size:>10,}")
+
+    t0 = time.perf_counter()
+    rebuilt = Transcript(dicts)
+    append_us = (time.perf_counter() - t0) / n * 1e6
+    t0 = time.perf_counter()
+    out = rebuilt.to_json()
+    to_json_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    decoded = Transcript.decode(rebuilt.encode())
+    codec_ms = (time.perf_counter() - t0) * 1000
+    print(f"append {append_us:.1f} us/message, to_json {to_json_ms:.2f} ms, encode+decode {codec_ms:.2f} ms")
+
+    ok = json.dumps(out, indent=2) == snapshot and decoded.to_json() == dicts
+    print("compatible JSON and round trip:", "ok" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
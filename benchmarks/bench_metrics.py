@@ -0,0 +1,116 @@
+# benchmarks/bench_metrics.py - instrumentation overhead per chat turn
+"""Measure what metrics.py adds to a chat turn: the turn's span pattern (render,
+log_user > save_data, get_response, send_assistant > save_data) timed with
+instrumentation off, on, and on with per-session traces, both around empty
+blocks (pure overhead) and around the real work (journal saves, intent match,
+template render). Exits non-zero if the enabled overhead exceeds
+metrics.OVERHEAD_BUDGET_US.
+
+    python benchmarks/bench_metrics.py [--turns 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import intents  # noqa: E402
+import metrics  # noqa: E402
+import templates  # noqa: E402
+from storage.conformance import make_payload  # noqa: E402
+from storage.filesystem import FilesystemStorage  # noqa: E402
+
+
+def instrumented_turn(work):
+    turn = metrics.begin_turn()
+    with metrics.span('render'):
+        work('render')
+    with metrics.span('log_user'):
+        with metrics.span('save_data'):
+            work('save_data')
+    with metrics.span('get_response'):
+        work('get_response')
+    with metrics.span('send_assistant'):
+        metrics.current_trace()
+        with metrics.span('save_data'):
+            work('save_data')
+    metrics.end_turn(turn, handled_input=True)
+
+
+def bare_turn(work):
+    work('render')
+    work('save_data')
+    work('get_response')
+    work('save_data')
+
+
+def per_turn_us(fn, work, turns: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(turns):
+        fn(work)
+    return (time.perf_counter() - t0) / turns * 1e6
+
+
+def configure(enabled: bool, trace: bool):
+    metrics.configure(enabled, trace)
+    metrics.registry.reset()
+
+
+def real_work(storage):
+    payload = make_payload("bench-metrics", 2)
+    state = {'n': 0}
+
+    def work(name):
+        if name == 'save_data':
+            state['n'] += 1
+            payload['messages'] = make_payload("bench-metrics", 2 + state['n'] % 60)['messages']
+            storage.save_session(payload)
+        elif name == 'get_response':
+            intents.match("yes, let's continue with the poem", 4)
+            templates.render(templates.TOPIC_CHOSEN.format(topic="ocean"), "A3", "third")
+    return work
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--turns', type=int, default=20000)
+    args = ap.parse_args()
+
+    def noop(name):
+        pass
+
+    results = {}
+    for label, enabled, trace in [("off", False, False), ("on", True, False), ("on + trace", True, True)]:
+        configure(enabled, trace)
+        results[label] = per_turn_us(instrumented_turn, noop, args.turns)
+    configure(False, False)
+    bare = per_turn_us(bare_turn, noop, args.turns)
+
+    print(f"span overhead per turn ({args.turns} turns, 6 spans each):")
+    print(f"  uninstrumented   {bare:7.2f} us")
+    for label, us in results.items():
+        print(f"  metrics {label:<10}{us:7.2f} us  (+{us - bare:.2f})")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = FilesystemStorage(workdir, fsync="never")
+        turns = max(1, args.turns // 10)
+        configure(False, False)
+        real_bare = per_turn_us(bare_turn, real_work(storage), turns)
+        configure(True, True)
+        real_on = per_turn_us(instrumented_turn, real_work(storage), turns)
+        storage.close()
+    print(f"with real work ({turns} turns): {real_bare:.1f} us bare, {real_on:.1f} us instrumented")
+
+    configure(True, False)
+    instrumented_turn(noop)
+    print(metrics.prometheus_text().splitlines()[0])
+
+    overhead = max(results["on"], results["on + trace"]) - bare
+    print(f"budget {metrics.OVERHEAD_BUDGET_US:.0f} us per turn: {'ok' if overhead <= metrics.OVERHEAD_BUDGET_US else 'EXCEEDED'}")
+    sys.exit(0 if overhead <= metrics.OVERHEAD_BUDGET_US else 1)
+
+
+if __name__ == '__main__':
+    main()
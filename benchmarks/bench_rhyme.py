@@ -0,0 +1,109 @@
+# benchmarks/bench_rhyme.py - rhyme lookups and batch poem validation throughput
+"""Time the old spelling-based ``rhymes`` against the phonetic index (single
+lookups and numpy batch lookups). Then validate N generated poems, one per
+(topic, attempt, error_type), in a single batch. Every poem must show the error
+its error_type is meant to expose, and rhyming pairs with a word outside the
+table (and a fully rhymed poem built from them) must still count as rhymes;
+the script exits non-zero otherwise.
+
+    python benchmarks/bench_rhyme.py [--poems 20000] [--dict cmudict.dict]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rhyme  # noqa: E402
+from engine import generate_error_poem  # noqa: E402
+
+TOPICS = ["ocean", "love", "friendship", "the city at night", "autumn", "my grandmother's kitchen", "space"]
+ERROR_TYPES = list(rhyme.ERROR_LABELS)
+# Rhyming end words where at least one word is not in the bundled table.
+OUTSIDE_TABLE = [("sing", "ring"), ("bright", "night"), ("stone", "alone"), ("cat", "hat"), ("tree", "free")]
+
+
+def legacy_rhymes(a: str, b: str, tail_len: int = 2) -> bool:
+    """engine.rhymes before the phonetic index."""
+    def last_word(s: str) -> str:
+        toks = s.strip().split()
+        return toks[-1] if toks else ""
+    def clean_tail(word: str) -> str:
+        w = re.sub(r"[^a-z]", "", word.lower())
+        return w[-tail_len:] if w else ""
+    return clean_tail(last_word(a)) == clean_tail(last_word(b))
+
+
+def per_call_us(fn, args, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for a in args:
+            fn(*a)
+    return (time.perf_counter() - t0) / (repeat * len(args)) * 1e6
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--poems', type=int, default=20000)
+    ap.add_argument('--dict', help="pronunciation table to index instead of the bundled one")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        info = rhyme.build_index(args.dict or rhyme.PRONUNCIATIONS, os.path.join(tmp, "rhyme_index.bin"))
+        build_s = time.perf_counter() - t0
+        idx = rhyme.RhymeIndex(info['path'])
+        rhyme._index = idx
+        print(f"index: {info['words']} words, {info['keys']} keys, {info['bytes']} bytes, built in "
+              f"{build_s * 1000:.1f} ms")
+
+        pairs = [("In realms where ocean holds its sway,", "We find new meaning every day."),
+                 ("Through metaphor and rhythm's song,", "We find where hearts and minds belong."),
+                 ("Whispers gather courage, rise, and sing,", "Wings unfold to taste a wondering.")]
+        print(f"rhymes(): legacy {per_call_us(legacy_rhymes, pairs, 20000):.2f} us/call, "
+              f"phonetic {per_call_us(rhyme.rhymes, pairs, 20000):.2f} us/call")
+        for a, b in pairs:
+            print(f"    {rhyme.last_word(a)!r:>10} / {rhyme.last_word(b)!r:<12} legacy={legacy_rhymes(a, b)!s:<5} "
+                  f"phonetic={rhyme.rhymes(a, b)}")
+
+        words = [w for a, b in pairs for w in (rhyme.last_word(a), rhyme.last_word(b))] * 20000
+        t0 = time.perf_counter()
+        idx.batch_key_ids(words)
+        batch_s = time.perf_counter() - t0
+        print(f"batch lookup: {len(words) / batch_s:,.0f} words/s ({len(words)} words)")
+
+        cases = [(TOPICS[i % len(TOPICS)], i // len(TOPICS) % 2, ERROR_TYPES[i % len(ERROR_TYPES)])
+                 for i in range(args.poems)]
+        poems = [generate_error_poem(*c) for c in cases]
+        t0 = time.perf_counter()
+        reports = rhyme.validate_poems(poems)
+        validate_s = time.perf_counter() - t0
+        print(f"validate: {len(poems) / validate_s:,.0f} poems/s ({len(poems)} poems in {validate_s:.2f}s)")
+
+        failed = 0
+        for a, b in OUTSIDE_TABLE:
+            known = [w for w in (a, b) if idx.key_id(w) >= 0]
+            if not rhyme.rhymes(f"a line ending {a}", f"a line ending {b}"):
+                failed += 1
+                print(f"  FAIL    {a!r} / {b!r} (in table: {known}) not a rhyme")
+        couplets = "\n".join(f"The morning light is {a},\nWe watch it all {b}." for a, b in OUTSIDE_TABLE)
+        report = rhyme.validate_poem(couplets)
+        print(f"rhymed poem with words outside the table: {report['rhyming_pairs']}/{report['pairs']} pairs, "
+              f"errors {report['errors']}")
+        if report['rhyming_pairs'] != report['pairs'] or report['errors']:
+            failed += 1
+
+        missed = [(c, r) for c, r in zip(cases, reports) if rhyme.ERROR_LABELS[c[2]] not in r['errors']]
+        for error_type in ERROR_TYPES:
+            seen = {tuple(r['errors']) for c, r in zip(cases, reports) if c[2] == error_type}
+            print(f"    {error_type:<14} -> {sorted(seen)}")
+        for c, r in missed[:5]:
+            print(f"  MISSED  {c}: {r}")
+        return 1 if missed or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# benchmarks/bench_save_data.py - journaled store vs. full-file rewrite
+"""Simulate a session growing to N messages, saving after every message (as
+send_assistant/log_user do), and report total bytes written and save latency
+for the legacy rewrite path and the journaled store.
+
+    python benchmarks/bench_save_data.py [--sizes 10 100 1000] [--fsync interval]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import SessionJournal, load_session  # noqa: E402
+
+CONDITION = {"anthro_level": "A2", "pov": "first"}
+
+
+def make_message(i: int) -> dict:
+    msg = {
+        "ts": datetime.utcnow().isoformat() + 'Z',
+        "role": "assistant" if i % 2 == 0 else "user",
+        "step": min(i // 2, 5),
+        "content": ("I think here's a tightened draft of your poem about the ocean. " * 3
+                    if i % 2 == 0 else "make it ten lines please"),
+    }
+    if msg["role"] == "assistant":
+        msg["condition"] = CONDITION
+    return msg
+
+
+def make_payload(messages, status="partial") -> dict:
+    return {
+        'participant': "Bench",
+        'id': "Pbench",
+        'messages': messages,
+        'study_state': {'topic': 'ocean', 'content_arc': None, 'tone': None, 'error_mode': False,
+                        'timer_expired': False, 'ended_by_user': False, 'poem_attempts': len(messages) // 10,
+                        'feedback': {}, 'feedback_draft': {}, 'error_type': 'six_lines',
+                        'feedback_page_seen': False},
+        'session_id': "bench-session",
+        'condition': CONDITION,
+        'seed': 1,
+        'status': status,
+        'saved_at': datetime.utcnow().isoformat() + 'Z',
+    }
+
+
+def legacy_save(path: str, payload: dict) -> int:
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    return os.path.getsize(path)
+
+
+def p99(samples):
+    return statistics.quantiles(samples, n=100)[98] if len(samples) >= 2 else samples[0]
+
+
+def run(n: int, fsync: str, workdir: str) -> dict:
+    results = {}
+
+    # Legacy: overwrite the whole session file on every save.
+    path = os.path.join(workdir, f"legacy_{n}.json")
+    messages, lat, total = [], [], 0
+    for i in range(n):
+        messages.append(make_message(i))
+        t0 = time.perf_counter()
+        total += legacy_save(path, make_payload(messages, "final" if i == n - 1 else "partial"))
+        lat.append(time.perf_counter() - t0)
+    results['legacy'] = (total, p99(lat))
+
+    # Journal: append the delta; compact at final.
+    journal = SessionJournal(os.path.join(workdir, f"journal_{n}"), fsync=fsync)
+    messages, lat = [], []
+    for i in range(n):
+        messages.append(make_message(i))
+        t0 = time.perf_counter()
+        journal.save(make_payload(messages, "final" if i == n - 1 else "partial"))
+        lat.append(time.perf_counter() - t0)
+    results['journal'] = (journal.bytes_written, p99(lat))
+
+    rebuilt = load_session(journal.base_path)
+    assert rebuilt['messages'] == messages, "journal replay diverged from in-memory transcript"
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    ap.add_argument('--fsync', default='interval', choices=['always', 'interval', 'never'])
+    args = ap.parse_args()
+
+    print(f"{'messages':>8} {'path':>8} {'bytes written':>14} {'p99 save (ms)':>14}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            for name, (nbytes, lat) in run(n, args.fsync, workdir).items():
+                print(f"{n:>8} {name:>8} {nbytes:>14,} {lat * 1000:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
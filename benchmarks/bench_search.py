@@ -0,0 +1,141 @@
+# benchmarks/bench_search.py - build, incremental update and query latency of search.py
+"""Write N engine-driven sessions (5-20 turns, participants' requests drawn from
+a pool that includes "10 lines", "poem about" and "end study"). Then time a
+full ``search.update``, an unchanged re-run, and a re-run after 1% of the
+sessions changed. Finally time the queries below, with and without filters.
+
+Every query is also answered by brute force over the loaded payloads. The
+script exits non-zero if the index and the brute force ever disagree.
+
+    python benchmarks/bench_search.py [--sessions 20000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from allocation import replay  # noqa: E402
+from engine import Engine  # noqa: E402
+from session_store import write_snapshot  # noqa: E402
+
+TOPICS = ["the ocean", "write a poem about my cat", "autumn leaves", "the city at night",
+          "a poem about grief and hope", "my grandmother's kitchen"]
+REQUESTS = ["yes", "can you make it 10 lines", "ten lines please", "end study", "i love it",
+            "make the imagery warmer", "could you write a poem about the sea instead", "please end study now"]
+QUERIES = [
+    ('"10 lines"', {}),
+    ('"10 lines" OR "ten lines"', {'role': 'user', 'step': 5}),
+    ('"poem about"', {'role': 'user'}),
+    ('"poem about" AND NOT "end study"', {'anthro_level': 'A2', 'status': 'final'}),
+    ('"end study"', {'status': 'abandoned'}),
+    ('ocean AND (warmer OR imagery)', {'pov': 'first'}),
+    ('"grandmother\'s kitchen"', {}),
+]
+
+
+def synthetic_session(i: int, rng: random.Random, engine: Engine, turns: int = None) -> dict:
+    condition = replay(i, "bench")
+    state = engine.new_state(condition, rng.choice(["six_lines", "non_rhyme", "foreign_token"]))
+    messages = [engine.greeting(state)]
+    script = ["ready", rng.choice(TOPICS), "a moment of beauty", "hopeful"]
+    for t in range(turns or rng.randint(5, 20)):
+        text = script[t] if t < len(script) else rng.choice(REQUESTS)
+        messages.append(engine.user_message(state, text))
+        state, reply = engine.respond(state, text)
+        messages.append(reply)
+    return {'participant': f"Participant {i}", 'id': f"P{i:06d}", 'messages': messages,
+            'study_state': state['study_state'], 'session_id': f"{i:08d}-bench", 'condition': condition,
+            'seed': i, 'status': rng.choice(["final", "final", "abandoned"]), 'saved_at': messages[-1]['ts']}
+
+
+def brute_force(payloads: dict, query: str, role=None, step=None, anthro_level=None, pov=None, status=None) -> set:
+    node = search.parse_query(query)
+
+    def has(payload, terms):
+        for m in payload['messages']:
+            if (role is not None and m.get('role') != role) or (step is not None and m.get('step') != step):
+                continue
+            toks = search.tokenize(m.get('content'))
+            if any(toks[i:i + len(terms)] == terms for i in range(len(toks) - len(terms) + 1)):
+                return True
+        return False
+
+    def ev(node, payload):
+        if isinstance(node, search.Phrase):
+            return has(payload, node.terms)
+        if node.op == 'NOT':
+            return not ev(node.args[0], payload)
+        results = [ev(a, payload) for a in node.args]
+        return all(results) if node.op == 'AND' else any(results)
+
+    return {key for key, p in payloads.items()
+            if (anthro_level is None or p['condition']['anthro_level'] == anthro_level)
+            and (pov is None or p['condition']['pov'] == pov) and (status is None or p['status'] == status)
+            and ev(node, p)}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sessions', type=int, default=20000)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+
+    rng = random.Random(19)
+    engine = Engine()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, 'study_data')
+        os.makedirs(data_dir)
+        payloads = {}
+        for i in range(args.sessions):
+            p = synthetic_session(i, rng, engine)
+            key = f"participant_{p['id']}_{p['session_id']}"
+            write_snapshot(os.path.join(data_dir, key + '.json'), p)
+            payloads[key] = p
+        print(f"{args.sessions} sessions, {sum(len(p['messages']) for p in payloads.values()):,} messages")
+
+        for label in ("full build", "unchanged re-run"):
+            stats = search.update(data_dir)
+            print(f"  {label:<22} indexed {stats['indexed']:6d} in {stats['seconds']:6.2f}s "
+                  f"({stats['segments']} segment(s))")
+        for key in rng.sample(sorted(payloads), max(1, args.sessions // 100)):
+            i = int(payloads[key]['id'][1:])
+            p = synthetic_session(i, random.Random(i), engine, turns=8)
+            p['messages'].append(engine.user_message(engine.new_state(p['condition']), "please end study now"))
+            write_snapshot(os.path.join(data_dir, key + '.json'), p)
+            payloads[key] = p
+        stats = search.update(data_dir)
+        print(f"  {'1% changed':<22} indexed {stats['indexed']:6d} in {stats['seconds']:6.2f}s "
+              f"({stats['segments']} segment(s))")
+        index_dir = os.path.join(data_dir, '.search')
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(index_dir) for f in fs)
+        print(f"  index size {size:,} bytes")
+
+        t0 = time.perf_counter()
+        index = search.SearchIndex(index_dir)
+        print(f"open index: {(time.perf_counter() - t0) * 1000:.1f} ms, {len(index)} live sessions")
+        failures = 0
+        for query, filters in QUERIES:
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                hits = index.search(query, **filters)
+                times.append(time.perf_counter() - t0)
+            times.sort()
+            want = brute_force(payloads, query, **filters)
+            got = {h['key'] for h in hits}
+            ok = got == want and all(h['messages'] for h in hits if 'NOT' not in query or 'AND' in query)
+            failures += not ok
+            print(f"  {'ok  ' if ok else 'FAIL'} {times[len(times) // 2] * 1000:7.2f} ms  {len(hits):6d} hits  "
+                  f"{query} {filters or ''}")
+            if got != want:
+                print(f"       {len(got - want)} extra, {len(want - got)} missing")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
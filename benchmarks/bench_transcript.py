@@ -0,0 +1,82 @@
+# benchmarks/bench_transcript.py - chat-stage rerun time against transcript length
+"""Time a Streamlit rerun (AppTest, in-process) that draws a transcript of N
+messages with the old renderer (one chat bubble + markdown per message) and with
+transcript.TranscriptRenderer (last window as bubbles, older turns in one cached
+block), for N from 10 to 500.
+
+    python benchmarks/bench_transcript.py [--sizes 10,50,100,200,500] [--reruns 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+
+def transcript_app():
+    import sys
+    import time
+    import streamlit as st
+    sys.path.insert(0, st.session_state.repo_root)
+    import templates
+    from transcript import TranscriptRenderer
+
+    if 'messages' not in st.session_state:
+        poem = templates.POEM_READY.format(poem="\n".join(f"Line {k} of the ocean's slow refrain," for k in range(10)))
+        st.session_state.messages = [
+            {"role": "assistant", "content": f"{poem} ({i})"} if i % 2 == 0 else {"role": "user", "content": f"make it warmer {i}"}
+            for i in range(st.session_state.n)]
+        st.session_state.transcript = TranscriptRenderer()
+    t0 = time.perf_counter()
+    if st.session_state.mode == "old":
+        for m in st.session_state.messages:
+            if m["role"] == "assistant":
+                with st.chat_message("assistant"):
+                    st.markdown(m["content"])
+            else:
+                with st.chat_message("user"):
+                    st.markdown(m["content"])
+    else:
+        st.session_state.transcript.render(st.session_state.messages, st)
+    st.session_state.render_s = time.perf_counter() - t0
+
+
+def rerun_ms(mode: str, n: int, reruns: int):
+    """Median (render-in-script ms, whole AppTest run ms) over ``reruns`` reruns."""
+    at = AppTest.from_function(transcript_app)
+    at.session_state.repo_root = REPO_ROOT
+    at.session_state.mode = mode
+    at.session_state.n = n
+    at.run(timeout=60)   # first run builds the messages and the cache
+    render, total = [], []
+    for _ in range(reruns):
+        t0 = time.perf_counter()
+        at.run(timeout=60)
+        total.append(time.perf_counter() - t0)
+        render.append(at.session_state.render_s)
+    assert not at.exception, at.exception
+    return statistics.median(render) * 1000, statistics.median(total) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sizes', default="10,50,100,200,500")
+    ap.add_argument('--reruns', type=int, default=5)
+    args = ap.parse_args()
+
+    # AppTest polls for script completion, so "run" has a ~100 ms floor; "render"
+    # is the time spent drawing the transcript inside the script.
+    print(f"{'messages':>8}  {'old render':>10}  {'new render':>10}  {'old run':>8}  {'new run':>8}   (ms)")
+    for n in (int(x) for x in args.sizes.split(',')):
+        old_render, old_run = rerun_ms("old", n, args.reruns)
+        new_render, new_run = rerun_ms("new", n, args.reruns)
+        print(f"{n:8d}  {old_render:10.2f}  {new_render:10.2f}  {old_run:8.1f}  {new_run:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
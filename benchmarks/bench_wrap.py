@@ -0,0 +1,125 @@
+# benchmarks/bench_wrap.py - golden check and timing for the condition wrapper
+"""Check that templates.anthropomorphic_wrap gives byte-identical output to the
+old chained-replace wrapper for every response template (and every assistant
+message recorded in study_data/) under all 15 conditions, then time the old
+wrapper, the new one, and registry lookups. Exits non-zero on any mismatch.
+
+The old wrapper missed line-initial and punctuation-adjacent "I"; those cases
+are listed separately, since they are meant to differ.
+
+    python benchmarks/bench_wrap.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import templates  # noqa: E402
+from session_store import iter_session_paths, load_session  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'study_data')
+
+FIXED_CASES = [
+    "Here is a draft.\nI kept the rhyme scheme.",
+    "As I, your assistant, see it: the arc works.",
+    "Got it—I think ten lines will fit.",
+    "I’m adjusting the meter; I'm keeping the arc.",
+    "(I hope) this version lands.",
+]
+# Substituted values keep their "I"; only the response's framing is rewritten.
+FENCED_CASES = [
+    templates.TOPIC_CHOSEN.format(topic=templates.verbatim("I miss my grandmother")).split("\n")[0],
+    templates.POEM_READY.format(poem=templates.verbatim("I walk the shore,\nAnd I hear the roar.")).split("\n\n")[1],
+]
+
+
+def legacy_wrap(text: str, level: str, pov: str) -> str:
+    """anthropomorphic_wrap as it was before templates.py."""
+    t = text
+    if level == "A0":
+        t = t.replace(" I ", " ").replace(" I'm ", " ").replace(" I’m ", " ")
+    elif level == "A1":
+        t = "I analyzed your input. " + t
+    elif level == "A2":
+        t = "I think " + t[0].lower() + t[1:] if t else t
+    elif level == "A3":
+        t = "I see what you’re aiming for. " + t
+    elif level == "A4":
+        t = "I remember similar patterns, and I feel this will resonate. " + t
+
+    if pov == "third":
+        t = t.replace(" I ", " the system ").replace("I'm", "The system is").replace("I’m", "The system is")
+        if t.startswith("I "): t = "The system " + t[2:]
+    elif pov == "none":
+        t = t.replace(" I ", " ").replace(" I'm ", " ").replace(" I’m ", " ")
+        if t.startswith("I "): t = t[2:]
+    return t
+
+
+def corpus() -> list:
+    texts = list(templates.STATIC_RESPONSES)
+    texts += [templates.TEN_LINES_ACK] + templates.REVISION_LEADS
+    poem = "In realms where ocean softly plays,\nWe wander wide through warming days."
+    for topic in ["ocean", "love", "time", "my dog's first winter", "Ünïcode ✓"]:
+        texts.append(templates.TOPIC_CHOSEN.format(topic=topic))
+        texts.append(templates.TEST_LINES.format(l1=f"In realms where {topic} holds its sway,",
+                                                 l2="We find new meaning every day."))
+        texts.append(templates.POEM_READY.format(poem=poem))
+        texts.append(templates.POEM_REDIRECT.format(poem=poem))
+        for lead in templates.REVISION_LEADS:
+            texts.append(templates.POEM_REVISION.format(ack=lead, poem=poem))
+    for base in iter_session_paths(DATA_DIR):
+        for m in load_session(base).get('messages') or []:
+            if m.get('role') == 'assistant':
+                texts.append(m['content'])
+    texts.append("")
+    return texts
+
+
+def timed(fn, texts, repeat: int) -> float:
+    t0 = time.perf_counter_ns()
+    for _ in range(repeat):
+        for text in texts:
+            for level, pov in templates.CONDITIONS:
+                fn(text, level, pov)
+    return (time.perf_counter_ns() - t0) / (repeat * len(texts) * len(templates.CONDITIONS))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--repeat', type=int, default=200)
+    args = ap.parse_args()
+
+    texts = corpus()
+    mismatches = [(t, c) for t in texts for c in templates.CONDITIONS
+                  if templates.anthropomorphic_wrap(t, *c) != legacy_wrap(t, *c)]
+    print(f"golden: {len(texts)} texts x {len(templates.CONDITIONS)} conditions, {len(mismatches)} mismatches")
+    for text, (level, pov) in mismatches[:10]:
+        print(f"  {level}/{pov} {text[:60]!r}")
+        print(f"    old: {legacy_wrap(text, level, pov)[:80]!r}")
+        print(f"    new: {templates.anthropomorphic_wrap(text, level, pov)[:80]!r}")
+
+    print("fixed cases (expected to differ):")
+    for text in FIXED_CASES:
+        for level, pov in [("A0", "first"), ("A1", "third"), ("A3", "none")]:
+            print(f"  {level}/{pov} old: {legacy_wrap(text, level, pov)!r}")
+            print(f"  {' ' * len(level + pov)}  new: {templates.anthropomorphic_wrap(text, level, pov)!r}")
+
+    print("substituted values (left as written):")
+    for text in FENCED_CASES:
+        print(f"  A1/third {templates.anthropomorphic_wrap(text, 'A1', 'third')!r}")
+
+    static = list(templates.STATIC_RESPONSES)
+    print("timing (ns per wrap, averaged over all conditions):")
+    print(f"  legacy chained replace      {timed(legacy_wrap, texts, args.repeat):8.0f}")
+    print(f"  single-pass rewriter        {timed(templates.anthropomorphic_wrap, texts, args.repeat):8.0f}")
+    print(f"  registry, static responses  {timed(templates.render, static, args.repeat):8.0f}")
+    print(f"  registry, all (LRU warm)    {timed(templates.render, texts, args.repeat):8.0f}")
+    print(f"  {templates.registry.cache_info()}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
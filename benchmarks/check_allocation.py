@@ -0,0 +1,143 @@
+# benchmarks/check_allocation.py - concurrent condition allocation: uniqueness, balance, latency
+"""Allocate conditions from several processes with several threads each, as
+server replicas sharing one counter would. Run it for every counter backend,
+and check that:
+
+- sequence numbers (seeds) are unique and gap-free
+- every seed replays to the condition it was given
+- every complete block holds each of the 15 cells equally often, and overall
+  cell counts differ by at most one block's share
+- with no salt configured, allocating and replaying refuse to run
+
+It also prints per-allocation latency. For comparison, it simulates the old
+time-seeded ``random.choice`` (identical conditions for sessions that start in
+the same second, and drifting cell counts). Exits non-zero on any failure.
+
+    python benchmarks/check_allocation.py [--processes 4] [--threads 8] [--per-thread 250]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import allocation  # noqa: E402
+
+SALT = "check-allocation"
+
+
+def worker(job) -> list:
+    """One "server process": ``threads`` threads sharing an allocator."""
+    backend, path, threads, per_thread = job
+    alloc = allocation.Allocator(allocation.counter_from_env(backend, path), SALT)
+    out, lock = [], threading.Lock()
+
+    def run():
+        mine = []
+        for _ in range(per_thread):
+            t0 = time.perf_counter()
+            a = alloc.allocate()
+            mine.append((a.seed, a.condition['anthro_level'], a.condition['pov'], time.perf_counter() - t0))
+        with lock:
+            out.extend(mine)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    alloc.close()
+    return out
+
+
+def check_backend(backend: str, processes: int, threads: int, per_thread: int) -> bool:
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = [(backend, os.path.join(tmp, ".allocation"), threads, per_thread)] * processes
+        t0 = time.perf_counter()
+        if backend == "memory":
+            rows = worker((backend, None, threads * processes, per_thread))   # process-local by design
+        else:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                rows = [r for chunk in pool.map(worker, jobs) for r in chunk]
+        wall = time.perf_counter() - t0
+
+    total = processes * threads * per_thread
+    seeds = sorted(r[0] for r in rows)
+    problems = []
+    if seeds != list(range(total)):
+        problems.append(f"seeds not unique/gap-free ({len(set(seeds))} distinct of {total})")
+    if any(allocation.replay(s, SALT) != {'anthro_level': lv, 'pov': pov} for s, lv, pov, _ in rows):
+        problems.append("replay mismatch")
+    by_seed = {r[0]: (r[1], r[2]) for r in rows}
+    share = allocation.BLOCK_SIZE // len(allocation.CELLS)
+    for start in range(0, total - allocation.BLOCK_SIZE + 1, allocation.BLOCK_SIZE):
+        block = Counter(by_seed.get(s) for s in range(start, start + allocation.BLOCK_SIZE))
+        if set(block.values()) != {share} or len(block) != len(allocation.CELLS):
+            problems.append(f"block at {start} unbalanced: {dict(block)}")
+            break
+    counts = Counter((lv, pov) for _, lv, pov, _ in rows)
+    spread = max(counts.values()) - min(counts.get(c, 0) for c in allocation.CELLS)
+    if spread > share:
+        problems.append(f"cell counts spread {spread}")
+
+    lat = sorted(r[3] * 1e6 for r in rows)
+    print(f"  {backend:<7} {total} allocations in {wall:.2f}s; latency p50 {lat[len(lat) // 2]:.1f} us, "
+          f"p99 {lat[int(len(lat) * 0.99)]:.1f} us, max {lat[-1]:.0f} us; cell spread {spread}")
+    for p in problems:
+        print(f"    FAIL  {p}")
+    return not problems
+
+
+def check_no_salt() -> bool:
+    saved, allocation.SALT = allocation.SALT, None
+    refused = 0
+    try:
+        for attempt in (lambda: allocation.Allocator(allocation.MemoryCounter()), lambda: allocation.replay(0)):
+            try:
+                attempt()
+            except RuntimeError:
+                refused += 1
+    finally:
+        allocation.SALT = saved
+    print(f"  {'ok' if refused == 2 else 'FAIL':<7} no salt: {refused} of 2 calls refused")
+    return refused == 2
+
+
+def legacy(sessions: int, per_second: float):
+    """The old init_session_state: seed from the wall-clock second, reseed the global RNG."""
+    rng = random.Random(0)
+    t, seeds, counts = 1_758_000_000.0, [], Counter()
+    for _ in range(sessions):
+        t += rng.expovariate(per_second)
+        seed = int(t) % 10 ** 6
+        r = random.Random(seed)
+        counts[(r.choice(allocation.LEVELS), r.choice(allocation.POVS))] += 1
+        seeds.append(seed)
+    shared = sum(n for n in Counter(seeds).values() if n > 1)
+    spread = max(counts.values()) - min(counts.get(c, 0) for c in allocation.CELLS)
+    print(f"  legacy  {sessions} sessions at {per_second}/s: {shared} share a seed with another session, "
+          f"cell spread {spread}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--processes', type=int, default=4)
+    ap.add_argument('--threads', type=int, default=8)
+    ap.add_argument('--per-thread', type=int, default=250)
+    args = ap.parse_args()
+
+    legacy(args.processes * args.threads * args.per_thread, 2.0)
+    ok = check_no_salt()
+    for backend in ("memory", "file", "sqlite"):
+        ok &= check_backend(backend, args.processes, args.threads, args.per_thread)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# benchmarks/check_generation.py - streamed generation against the local mock server
+"""Run generation.PoemStream through the real openai client against
+mock_llm_server: normal streaming, slow first token, a stalled stream, an API
+error, cancellation, readers sharing one stream (a timeout or cancel only
+detaches that reader), and concurrent slow sessions; then the generation cache
+(hits, condition keying, failed, timed-out and cancelled entries, eviction
+waste) and the poem turn with and without prefetch. Prints time to first token
+and total latency per case; exits non-zero if any case misbehaves.
+
+    python benchmarks/check_generation.py
+"""
+import argparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import openai  # noqa: E402
+
+import generation  # noqa: E402
+from engine import Engine  # noqa: E402
+from mock_llm_server import CANNED_POEM, start_mock_server  # noqa: E402
+
+
+def stream(server, first_token_timeout=2.0, timeout=5.0, **config):
+    server.config.update(config)
+    return generation.PoemStream("ocean", 0, "six_lines", first_token_timeout=first_token_timeout,
+                                 timeout=timeout).reader()
+
+
+def check_streams_tokens(server):
+    s = stream(server, first_delay=0.2, chunk_delay=0.01)
+    updates = list(s)
+    assert s.outcome == "ok", s.error
+    assert s.result == CANNED_POEM.format(topic="ocean"), s.result
+    assert len(updates) > 1 and s.chunks > 10
+    assert 0.2 <= s.ttft < 1.0 and s.total >= s.ttft
+    return s
+
+
+def check_first_token_timeout(server):
+    s = stream(server, first_token_timeout=0.5, first_delay=2.0)
+    t0 = time.perf_counter()
+    s.wait()
+    assert s.outcome == "timeout" and s.result == s.fallback
+    assert time.perf_counter() - t0 < 1.0
+    return s
+
+
+def check_stalled_stream(server):
+    s = stream(server, first_token_timeout=0.5, timeout=5.0, first_delay=0.0, chunk_delay=0.01, stall_after=5)
+    s.wait()
+    assert s.outcome == "timeout" and s.ttft is not None and s.result == s.fallback, (s.outcome, s.error)
+    assert s.total < 1.5
+    return s
+
+
+def check_api_error(server):
+    s = stream(server, status=500)
+    s.wait()
+    assert s.outcome == "error" and s.result == s.fallback, (s.outcome, s.error)
+    return s
+
+
+def check_cancel(server):
+    s = stream(server, first_delay=0.0, chunk_delay=0.05)
+    for _ in zip(range(3), s):
+        pass
+    s.cancel()
+    assert s.outcome == "cancelled" and s.result == s.fallback
+    s.stream._future.result(timeout=2)   # its only reader left: the worker stops at its next chunk
+    assert s.stream.outcome == "cancelled"
+    return s
+
+
+def check_shared_stream_readers(server):
+    server.config.update(first_delay=0.6, chunk_delay=0.01)
+    shared = generation.PoemStream("ocean", 0, "six_lines", first_token_timeout=2.0, timeout=5.0)
+    impatient, rerun, patient = shared.reader(first_token_timeout=0.2), shared.reader(), shared.reader()
+    impatient.wait()
+    assert impatient.outcome == "timeout" and impatient.result == impatient.fallback
+    for _ in zip(range(2), rerun):
+        pass
+    rerun.cancel()
+    assert rerun.outcome == "cancelled" and shared.outcome is None, "one reader ended the stream for everyone"
+    assert patient.wait() == CANNED_POEM.format(topic="ocean") and patient.outcome == "ok"
+    return patient
+
+
+def check_concurrent_sessions(server):
+    server.config.update(first_delay=0.5, chunk_delay=0.01)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(8) as pool:
+        poems = list(pool.map(lambda _: stream(server).wait(), range(8)))
+    wall = time.perf_counter() - t0
+    assert poems == [CANNED_POEM.format(topic="ocean")] * 8
+    assert wall < 3 * 0.5 + 1.0, f"8 sessions took {wall:.2f}s; generations are serialized"
+
+
+def check_engine_slot(server):
+    server.config.update(first_delay=0.0, chunk_delay=0.0)
+    engine = Engine()
+    state = engine.new_state({"anthro_level": "A1", "pov": "third"})
+    for text in ("ready", "ocean", "a moment of beauty", "hopeful"):
+        state, _ = engine.respond(state, text)
+    poet = generation.StreamingPoet(first_token_timeout=2.0, timeout=5.0)
+    state, text = engine.respond_text(state, "yes", poet=poet)
+    assert generation.StreamingPoet.SLOT in text and poet.stream is not None
+    final = text.replace(generation.StreamingPoet.SLOT, poet.stream.wait())
+    reply = engine.assistant_message(state, final)
+    assert CANNED_POEM.format(topic="ocean").split('\n')[0] in reply['content']
+    assert reply['content'].startswith("The system analyzed your input.")
+    return poet.stream
+
+
+CONDITION = {"anthro_level": "A1", "pov": "third"}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def check_cache_hit(server):
+    cache = generation.GenerationCache()
+    first, hit = cache.stream("Ocean ", 0, "six_lines", "a moment of beauty", "Hopeful.", CONDITION)
+    assert not hit
+    first.wait()
+    before = server.requests
+    second, hit = cache.stream("ocean", 0, "six_lines", "A moment of  beauty", "hopeful", CONDITION)
+    assert hit and second.stream is first.stream and server.requests == before
+    other, hit = cache.stream("ocean", 0, "six_lines", "a moment of beauty", "hopeful",
+                              {"anthro_level": "A3", "pov": "first"})
+    assert not hit, "condition is part of the key"
+    other.wait()
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["saved_seconds"] > 0, stats
+    return second
+
+
+def check_failed_not_cached(server):
+    cache = generation.GenerationCache()
+    server.config.update(status=500)
+    cache.stream("ocean", 0, "six_lines")[0].wait()
+    server.config.update(status=200)
+    s, hit = cache.stream("ocean", 0, "six_lines")
+    assert not hit and s.wait() == CANNED_POEM.format(topic="ocean")
+    return s
+
+
+def check_cancelled_reader_keeps_entry(server):
+    server.config.update(first_delay=0.3, chunk_delay=0.01)
+    cache = generation.GenerationCache()
+    assert cache.prefetch("ocean", 0, "six_lines", first_token_timeout=2.0, timeout=5.0)
+    first, hit = cache.stream("ocean", 0, "six_lines", first_token_timeout=2.0, timeout=5.0)
+    first.cancel()   # e.g. End Study while the joined prefetch is still running
+    assert hit and first.outcome == "cancelled"
+    second, hit = cache.stream("ocean", 0, "six_lines", first_token_timeout=2.0, timeout=5.0)
+    assert hit and second.wait() == CANNED_POEM.format(topic="ocean") and second.outcome == "ok"
+    return second
+
+
+def check_timed_out_not_cached(server):
+    server.config.update(first_delay=0.0, chunk_delay=0.01, stall_after=5)
+    cache = generation.GenerationCache()
+    assert cache.prefetch("ocean", 0, "six_lines", first_token_timeout=0.3, timeout=0.5)
+    stream = next(iter(cache._entries.values())).stream
+    stream._future.result(timeout=3)
+    assert stream.outcome in ("timeout", "error"), stream.outcome
+    assert cache.stats()["entries"] == 0, "a failed stream stayed cached"
+    server.config.update(stall_after=None)
+    s, hit = cache.stream("ocean", 0, "six_lines")
+    assert not hit and s.wait() == CANNED_POEM.format(topic="ocean")
+    return s
+
+
+def check_eviction_waste(server):
+    clock = FakeClock()
+    cache = generation.GenerationCache(max_entries=2, ttl=60, clock=clock)
+    for topic in ("ocean", "forest", "desert"):
+        assert cache.prefetch(topic, 0, "six_lines")
+    assert not cache.prefetch("desert", 0, "six_lines"), "already prefetched"
+    assert cache.stats()["prefetch_wasted"] == 1 and cache.stats()["entries"] == 2
+    clock.now = 61
+    stats = cache.stats()
+    assert stats["prefetch_wasted"] == 3 and stats["entries"] == 0, stats
+    s, hit = cache.stream("desert", 0, "six_lines")
+    assert not hit
+    return s.wait() and s
+
+
+def engine_at_step4(engine):
+    state = engine.new_state(CONDITION)
+    for text in ("ready", "ocean", "a moment of beauty", "hopeful"):
+        state, _ = engine.respond(state, text)
+    assert state['step'] == 4
+    return state
+
+
+def poem_turn(engine, state, text, cache):
+    """One turn through a cached StreamingPoet; returns (state, seconds until the whole poem is in, poet)."""
+    poet = generation.StreamingPoet(cache=cache, context=generation.poem_context(state),
+                                    first_token_timeout=2.0, timeout=5.0)
+    t0 = time.perf_counter()
+    state, reply = engine.respond_text(state, text, poet=poet)
+    poet.stream.wait()
+    return state, time.perf_counter() - t0, poet
+
+
+def check_prefetch_latency(server):
+    server.config.update(first_delay=0.3, chunk_delay=0.01)
+    engine = Engine()
+    cold_state = engine_at_step4(engine)
+    _, cold, _ = poem_turn(engine, cold_state, "yes", generation.GenerationCache())
+
+    cache = generation.GenerationCache()
+    state = engine_at_step4(engine)
+    assert generation.prefetch_for(state, cache, first_token_timeout=2.0, timeout=5.0) == [0]
+    time.sleep(cold + 0.2)   # the participant reads the test lines
+    state, warm, poet = poem_turn(engine, state, "yes", cache)
+    assert poet.cache_result == "hit" and state['step'] == 5
+    assert generation.prefetch_for(state, cache, first_token_timeout=2.0, timeout=5.0) == [1]
+    time.sleep(cold + 0.2)
+    state, revision, poet = poem_turn(engine, state, "make it warmer", cache)
+    assert poet.cache_result == "hit" and state['study_state']['poem_attempts'] == 1
+    stats = cache.stats()
+    print(f"        poem turn: cold {cold * 1000:.0f}ms, prefetched draft {warm * 1000:.1f}ms, "
+          f"prefetched revision {revision * 1000:.1f}ms; hit rate {stats['hit_rate']:.0%}, "
+          f"saved {stats['saved_seconds'] * 1000:.0f}ms")
+    assert cold > 0.3 and warm < 0.05 and revision < 0.05
+    assert stats["prefetch_used"] == 2 and stats["prefetch_wasted"] == 0, stats
+    return poet.stream
+
+
+CHECKS = [check_streams_tokens, check_first_token_timeout, check_stalled_stream, check_api_error, check_cancel,
+          check_shared_stream_readers, check_concurrent_sessions, check_engine_slot, check_cache_hit,
+          check_failed_not_cached, check_cancelled_reader_keeps_entry, check_timed_out_not_cached,
+          check_eviction_waste, check_prefetch_latency]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.parse_args()
+    server = start_mock_server()
+    generation.BACKEND = "openai"
+    generation.API_BASE = server.base_url
+    openai.api_key = "mock"
+    failures = 0
+    for check in CHECKS:
+        server.config.update(first_delay=0.0, chunk_delay=0.0, status=200, stall_after=None)
+        try:
+            s = check(server)
+            detail = ""
+            if s is not None:
+                rec = s.record()
+                ttft = f"{rec['ttft_ms']}ms" if rec['ttft_ms'] is not None else "-"
+                detail = f"  outcome={rec['outcome']} ttft={ttft} total={rec['total_ms']}ms"
+            print(f"  ok    {check.__name__}{detail}")
+        except Exception as e:
+            failures += 1
+            print(f"  FAIL  {check.__name__}: {e!r}")
+            traceback.print_exc()
+    print(f"{failures} failure(s), {server.requests} requests served")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# benchmarks/check_lifecycle.py - idle-session reaper, in-process and against a live server
+"""First exercise lifecycle.SessionReaper with a fake clock: live/idle counts,
+abandoned versus finished sessions, and flush retries. Then start the app with
+a 2-second timeout, open sessions that chat or reach feedback and close their
+tabs, plus one that submits feedback. Check that every abandoned session ends
+with status "abandoned" on disk, the finished one stays "final", and the
+exported gauges drop to zero. Exits non-zero on any failure.
+
+    python benchmarks/check_lifecycle.py [--sessions 6]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from streamlit.proto.WidgetStates_pb2 import WidgetState  # noqa: E402
+
+import lifecycle  # noqa: E402
+from loadtest_chat import REPO_ROOT, Session, free_port, start_server  # noqa: E402
+from session_store import iter_session_paths, load_session  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def check_reaper():
+    clock = FakeClock()
+    r = lifecycle.SessionReaper(timeout=60, idle_after=10, clock=clock)
+    flushed, evicted = [], []
+    failures = {'flaky': 1}
+
+    def flush(sid):
+        if failures.get(sid):
+            failures[sid] -= 1
+            raise OSError("disk full")
+        flushed.append(sid)
+
+    for sid in ('a', 'b', 'done', 'flaky'):
+        r.touch(sid, flush=lambda s=sid: flush(s), evict=lambda s=sid: evicted.append(s))
+    r.finish('done')
+    clock.now = 30
+    r.touch('b')
+    assert r.counts()['live'] == 1 and r.counts()['idle'] == 3, r.counts()
+    clock.now = 61
+    assert sorted(r.reap()) == ['a', 'done']
+    assert flushed == ['a'] and sorted(evicted) == ['a', 'done'], (flushed, evicted)
+    assert r.counts() == {'live': 0, 'idle': 2, 'reaped': 2, 'abandoned': 1, 'flush_errors': 1}, r.counts()
+    clock.now = 95
+    assert r.reap() == ['b', 'flaky']   # flaky's flush succeeds on the retry
+    assert flushed == ['a', 'b', 'flaky']
+    assert r.counts()['reaped'] == 4 and r.counts()['live'] + r.counts()['idle'] == 0
+
+
+async def drive(port: int, n: int):
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    sessions = [Session(url, i) for i in range(n)]
+    for s in sessions:
+        await s.connect()
+        await s.register()
+    for i, s in enumerate(sessions):
+        await s.say("ready")
+        await s.say("the ocean")
+        if i % 3 == 1:
+            await s.say("please end the study")   # abandoned on the feedback page
+    done = sessions[-1]
+    await done.say("please end the study")
+    await asyncio.sleep(1)
+    for _ in range(3):
+        await done.rerun([])
+    await done.rerun([WidgetState(id=done._widget('button', 'Submit Feedback'), trigger_value=True)])
+    await asyncio.sleep(0.5)
+    for s in sessions:
+        s.ws.close()
+
+
+def scrape(port: int) -> dict:
+    text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    return {line.split(' ')[0]: float(line.split(' ')[1]) for line in text.splitlines()
+            if line.startswith('shade_sessions')}
+
+
+def check_server(n: int):
+    metrics_port = free_port()
+    os.environ.update(SHADE_SESSION_TIMEOUT="2", SHADE_SESSION_IDLE_AFTER="1", SHADE_REAP_INTERVAL="0.5",
+                      SHADE_METRICS="1", SHADE_METRICS_PORT=str(metrics_port))
+    with tempfile.TemporaryDirectory() as data_dir:
+        port = free_port()
+        proc = start_server(os.path.join(REPO_ROOT, 'streamlit_app.py'), port, data_dir)
+        try:
+            asyncio.run(drive(port, n))
+            before = scrape(metrics_port)
+            time.sleep(4)
+            after = scrape(metrics_port)
+        finally:
+            proc.terminate()
+            proc.wait()
+        statuses = sorted(load_session(b)['status'] for b in iter_session_paths(os.path.join(data_dir, 'study_data')))
+    print(f"    before reaping: {before}")
+    print(f"    after reaping:  {after}")
+    print(f"    statuses on disk: {statuses}")
+    assert statuses == ['abandoned'] * (n - 1) + ['final'], statuses
+    assert after['shade_sessions{state="live"}'] == 0 and after['shade_sessions{state="idle"}'] == 0, after
+    assert after['shade_sessions_reaped_total{outcome="abandoned"}'] == n - 1, after
+    assert after['shade_sessions_reaped_total{outcome="finished"}'] == 1, after
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sessions', type=int, default=6)
+    args = ap.parse_args()
+    failures = 0
+    for name, check in (("reaper", check_reaper), ("server", lambda: check_server(args.sessions))):
+        try:
+            check()
+            print(f"  ok    {name}")
+        except Exception as e:
+            failures += 1
+            print(f"  FAIL  {name}: {e!r}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
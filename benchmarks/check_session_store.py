@@ -0,0 +1,222 @@
+# benchmarks/check_session_store.py - assertion checks for the session journal and incremental analytics
+"""Crash and re-run cases for ``session_store`` and ``analytics.build``:
+
+- a journal whose last line was torn mid-append replays to the last complete
+  record, and the next save still lands on a line of its own
+- compacting a session twice (a repeated final save, or compact() called
+  after save() already compacted) leaves the same snapshot and no journal
+- a save from the draft autosaver's timer thread racing the script thread
+  never interleaves journal lines
+- ``analytics.build`` re-run on unchanged files parses nothing, re-parses only
+  the session that changed, and drops a deleted session's rows
+- sessions packed with ``archive.pack(remove=True)`` stay visible to
+  analytics, ``rebuild_sessions_csv``, the search index, ``rhyme.py validate``
+  and ``FilesystemStorage``, whose cached archive reader sees later packs
+- a session packed as ``abandoned`` and later submitted as ``final`` is packed
+  again, and ``remove=True`` deletes its loose file only once the archive
+  holds the ``final`` snapshot
+
+Exits non-zero on the first failed check.
+
+    python benchmarks/check_session_store.py
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import SessionJournal, load_session, replay_journal  # noqa: E402
+
+
+def payload(n: int, status: str = "in_progress", sid: str = "s1") -> dict:
+    messages = [{'role': 'user' if i % 2 else 'assistant', 'content': f"message {i}", 'step': i // 2,
+                 'ts': f"2024-01-01T00:00:{i % 60:02d}+00:00"} for i in range(n)]
+    return {'participant': "Participant 1", 'id': "P1", 'messages': messages,
+            'study_state': {'step': n // 2}, 'session_id': sid,
+            'condition': {'anthro_level': 'A1', 'pov': 'first'}, 'seed': 1, 'status': status,
+            'saved_at': messages[-1]['ts'] if messages else None}
+
+
+def check_torn_tail(tmp: str):
+    base = os.path.join(tmp, "participant_P1_torn")
+    journal = SessionJournal(base, fsync='never')
+    for n in (2, 4, 6):
+        journal.save(payload(n))
+    with open(journal.journal_path, 'rb+') as f:
+        f.truncate(os.path.getsize(journal.journal_path) - 7)
+    got = replay_journal(journal.journal_path)
+    assert len(got['messages']) == 4, f"torn tail: replayed {len(got['messages'])} messages, want 4"
+
+    # A restarted server writes a fresh journal object onto the torn file.
+    SessionJournal(base, fsync='never').save(payload(8))
+    with open(journal.journal_path) as f:
+        lines = f.read().splitlines()
+    assert all(line.startswith('{') for line in lines), "torn tail: next record glued onto the torn line"
+    got = load_session(base)
+    assert got['messages'] == payload(8)['messages'], "torn tail: records after the torn line were lost"
+
+
+def check_compaction_idempotent(tmp: str):
+    base = os.path.join(tmp, "participant_P1_compact")
+    journal = SessionJournal(base, fsync='never')
+    journal.save(payload(4))
+    final = payload(6, status="final")
+    journal.save(final)
+    first = open(journal.snapshot_path, 'rb').read()
+    journal.save(final)
+    journal.compact(final)
+    SessionJournal(base, fsync='never').compact(final)
+    assert not os.path.exists(journal.journal_path), "compaction: journal left behind"
+    assert open(journal.snapshot_path, 'rb').read() == first, "compaction: snapshot changed on repeat"
+    assert load_session(base) == final, "compaction: snapshot does not match the final payload"
+
+
+def check_concurrent_saves(tmp: str, rounds: int = 200):
+    base = os.path.join(tmp, "participant_P1_threads")
+    journal = SessionJournal(base, fsync='never')
+    start = threading.Barrier(2)
+
+    def run(offset):
+        start.wait()
+        for i in range(rounds):
+            p = payload(2 + (i % 50))
+            p['study_state'] = {'step': i, 'draft': "x" * (4096 + offset)}
+            journal.save(p)
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with open(journal.journal_path) as f:
+        for lineno, line in enumerate(f, 1):
+            json.loads(line)   # raises on an interleaved line
+    assert lineno >= rounds, "threads: fewer journal lines than saves"
+
+
+def check_incremental_analytics(tmp: str):
+    import analytics  # pyarrow is only needed here
+
+    data_dir, out_dir = os.path.join(tmp, "study_data"), os.path.join(tmp, "analytics")
+    os.makedirs(data_dir)
+    for k in range(3):
+        SessionJournal(os.path.join(data_dir, f"participant_P{k}_s{k}"), fsync='never').save(
+            payload(6, status="final", sid=f"s{k}"))
+
+    stats = analytics.build(data_dir, out_dir)
+    assert (stats['sessions'], stats['parsed'], stats['removed']) == (3, 3, 0), f"first build: {stats}"
+    stats = analytics.build(data_dir, out_dir)
+    assert (stats['sessions'], stats['parsed'], stats['removed']) == (3, 0, 0), f"unchanged re-run: {stats}"
+    assert stats['messages'] == 18, f"unchanged re-run kept {stats['messages']} messages, want 18"
+
+    SessionJournal(os.path.join(data_dir, "participant_P1_s1"), fsync='never').compact(
+        payload(10, status="final", sid="s1"))
+    stats = analytics.build(data_dir, out_dir)
+    assert (stats['parsed'], stats['messages']) == (1, 22), f"one changed: {stats}"
+
+    os.remove(os.path.join(data_dir, "participant_P2_s2.json"))
+    stats = analytics.build(data_dir, out_dir)
+    assert (stats['sessions'], stats['parsed'], stats['removed']) == (2, 0, 1), f"one removed: {stats}"
+    ids = sorted(stats['sessions_table']['session_id'].to_pylist())
+    assert ids == ["s0", "s1"], f"removed session still in sessions table: {ids}"
+    assert stats['messages'] == 16, f"removed session's messages kept: {stats['messages']}"
+
+
+def check_packed_sessions_visible(tmp: str):
+    import analytics
+    import archive
+    import rhyme
+    import search
+    from storage.filesystem import FilesystemStorage
+    from summary_writer import rebuild_sessions_csv
+
+    data_dir = os.path.join(tmp, "study_data")
+    os.makedirs(data_dir)
+
+    def write(k):
+        SessionJournal(os.path.join(data_dir, f"participant_P{k}_s{k}"), fsync='never').compact(
+            payload(6, status="final", sid=f"s{k}"))
+
+    for k in range(3):
+        write(k)
+    # A legacy file whose name doesn't follow participant_<id>_<session_id>.
+    SessionJournal(os.path.join(data_dir, "participant_P9_20250101_120000"), fsync='never').compact(
+        payload(6, status="final", sid="s9"))
+    storage = FilesystemStorage(data_dir)
+    before = analytics.build(data_dir, os.path.join(tmp, "analytics"))
+    search.update(data_dir)
+
+    stats = archive.pack(data_dir, remove=True)
+    assert (stats['packed'], stats['removed']) == (4, 4), f"pack: {stats}"
+    assert not any(n.startswith("participant_") for n in os.listdir(data_dir)), "pack left loose files"
+
+    after = analytics.build(data_dir, os.path.join(tmp, "analytics"))
+    assert after['sessions'] == before['sessions'] == 4 and after['removed'] == 0, f"analytics after pack: {after}"
+    assert after['messages'] == before['messages'], "analytics lost messages of packed sessions"
+    keys = sorted(after['sessions_table']['file'].to_pylist())
+    assert "participant_P9_20250101_120000" in keys, f"archived session renamed: {keys}"
+    assert rebuild_sessions_csv(data_dir) == 4, "sessions.csv rebuild missed packed sessions"
+    assert search.update(data_dir)['sessions'] == 4, "search index dropped packed sessions"
+    assert len(rhyme.label_sessions(data_dir)) == 4, "rhyme validate missed packed sessions"
+    assert sorted(storage.list_sessions()) == ["s0", "s1", "s2", "s9"], "list_sessions missed packed sessions"
+
+    assert storage.load_session("s1") == payload(6, status="final", sid="s1"), "load_session from archive"
+    assert storage.load_session("s3") is None
+    write(3)
+    archive.pack(data_dir, remove=True)
+    assert storage.load_session("s3") == payload(6, status="final", sid="s3"), "cached archive missed a new pack"
+    storage.close()
+
+
+def check_repack_updated_session(tmp: str):
+    import archive
+
+    data_dir = os.path.join(tmp, "study_data")
+    base = os.path.join(data_dir, "participant_P1_s1")
+    os.makedirs(data_dir)
+    SessionJournal(base, fsync='never').compact(payload(6, status="abandoned", sid="s1"))
+    stats = archive.pack(data_dir)
+    assert stats['packed'] == 1, f"first pack: {stats}"
+
+    final = payload(8, status="final", sid="s1")
+    SessionJournal(base, fsync='never').compact(final)
+    stats = archive.pack(data_dir, remove=True)
+    assert (stats['packed'], stats['removed']) == (1, 1), f"re-pack of the final snapshot: {stats}"
+    with archive.SessionSource(data_dir) as source:
+        assert source.keys() == ["participant_P1_s1"], f"re-pack: keys {source.keys()}"
+        assert source.load("participant_P1_s1") == final, "re-pack: archive still returns the abandoned snapshot"
+    arc = archive.SessionArchive(archive.archive_dir(data_dir))
+    try:
+        assert arc.get("s1") == final, "re-pack: get() returns the old record"
+        assert arc.by_participant("P1") == [final], "re-pack: participant lookup lists the session twice"
+    finally:
+        arc.close()
+    assert archive.pack(data_dir)['packed'] == 0, "re-pack: unchanged session packed again"
+
+
+CHECKS = [check_torn_tail, check_compaction_idempotent, check_concurrent_saves, check_incremental_analytics,
+          check_packed_sessions_visible, check_repack_updated_session]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.parse_args()
+    failures = 0
+    for check in CHECKS:
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                check(tmp)
+            except AssertionError as exc:
+                failures += 1
+                print(f"FAIL {check.__name__}: {exc}")
+            else:
+                print(f"ok   {check.__name__}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
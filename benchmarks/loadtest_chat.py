@@ -0,0 +1,197 @@
+# benchmarks/loadtest_chat.py - concurrent chat-stage sessions against a live server
+"""Start ``streamlit run`` on an app file, connect N websocket sessions that
+register and sit in the chat stage (optionally chatting every --think seconds),
+and report script runs/sec and server CPU per session over the window.
+
+    python benchmarks/loadtest_chat.py --sessions 20 --duration 30
+    python benchmarks/loadtest_chat.py --sessions 20 --baseline 72147c4   # before
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """utime + stime of ``pid`` (Linux /proc)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+class Session:
+    """One simulated browser tab speaking the Streamlit websocket protocol."""
+
+    def __init__(self, url: str, idx: int):
+        self.url = url
+        self.idx = idx
+        self.widgets = {}
+        self.runs = 0
+        self.finished = asyncio.Event()
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url)
+        asyncio.ensure_future(self._reader())
+
+    async def _reader(self):
+        while True:
+            data = await self.ws.read_message()
+            if data is None:
+                return
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            kind = msg.WhichOneof('type')
+            if kind == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+                el = msg.delta.new_element
+                widget = el.WhichOneof('type')
+                if widget in ('text_input', 'checkbox', 'button', 'chat_input'):
+                    proto = getattr(el, widget)
+                    self.widgets[(widget, getattr(proto, 'label', '') or getattr(proto, 'placeholder', ''))] = proto.id
+            elif kind == 'script_finished':
+                self.runs += 1
+                self.finished.set()
+
+    def _widget(self, kind: str, label: str) -> str:
+        return self.widgets[(kind, label)]
+
+    async def rerun(self, widget_states=(), until=None):
+        """Send one rerun request and wait for a finished run (and ``until()`` if given)."""
+        self.finished.clear()
+        back = BackMsg()
+        back.rerun_script.query_string = ""
+        back.rerun_script.page_script_hash = ""
+        back.rerun_script.widget_states.widgets.extend(widget_states)
+        await self.ws.write_message(back.SerializeToString(), binary=True)
+        deadline = time.monotonic() + 30
+        while True:
+            await asyncio.wait_for(self.finished.wait(), max(0.1, deadline - time.monotonic()))
+            self.finished.clear()
+            if until is None or until():
+                return
+
+    async def register(self):
+        await self.rerun()
+        name = WidgetState(id=self._widget('text_input', 'Your Name'), string_value=f"load-{self.idx}")
+        consent = WidgetState(id=self._widget('checkbox', 'I consent to participate in this research study'),
+                              bool_value=True)
+        start = WidgetState(id=self._widget('button', 'Start Study'), trigger_value=True)
+        await self.rerun([name, consent, start],
+                         until=lambda: ('chat_input', 'Type your message...') in self.widgets)
+
+    async def say(self, text: str):
+        chat = WidgetState(id=self._widget('chat_input', 'Type your message...'))
+        chat.string_trigger_value.data = text
+        await self.rerun([chat])
+
+
+async def drive(url: str, n: int, duration: float, think: float, server_pid: int) -> dict:
+    sessions = [Session(url, i) for i in range(n)]
+    for s in sessions:
+        await s.connect()
+    await asyncio.gather(*(s.register() for s in sessions))
+    await asyncio.sleep(2)  # let the registration reruns settle
+
+    runs0 = sum(s.runs for s in sessions)
+    cpu0 = process_cpu_seconds(server_pid)
+    t0 = time.monotonic()
+
+    async def chatter(s: Session):
+        lines = ["ready", "the ocean", "a life lesson", "playful", "yes", "make it ten lines"]
+        i = 0
+        while time.monotonic() - t0 < duration:
+            await asyncio.sleep(think)
+            await s.say(lines[i % len(lines)])
+            i += 1
+
+    if think > 0:
+        await asyncio.wait([asyncio.ensure_future(chatter(s)) for s in sessions], timeout=duration)
+    remaining = duration - (time.monotonic() - t0)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+
+    elapsed = time.monotonic() - t0
+    cpu = process_cpu_seconds(server_pid) - cpu0
+    runs = sum(s.runs for s in sessions) - runs0
+    for s in sessions:
+        s.ws.close()
+    return {
+        'sessions': n,
+        'window_s': elapsed,
+        'reruns_per_sec': runs / elapsed,
+        'cpu_s_per_session': cpu / n,
+        'cpu_pct_per_session': 100.0 * cpu / elapsed / n,
+    }
+
+
+def start_server(app_path: str, port: int, data_dir: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    env.setdefault('SHADE_ALLOCATION_SALT', 'loadtest')   # throwaway data dir: any salt will do
+    cmd = [sys.executable, '-m', 'streamlit', 'run', app_path,
+           '--server.headless', 'true', '--server.port', str(port),
+           '--server.enableCORS', 'false', '--server.enableXsrfProtection', 'false',
+           '--browser.gatherUsageStats', 'false', '--server.runOnSave', 'false']
+    proc = subprocess.Popen(cmd, cwd=data_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("streamlit server did not start")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--app', default=os.path.join(REPO_ROOT, 'streamlit_app.py'))
+    ap.add_argument('--baseline', help="git revision whose streamlit_app.py to load-test instead")
+    ap.add_argument('--sessions', type=int, default=10)
+    ap.add_argument('--duration', type=float, default=20.0)
+    ap.add_argument('--think', type=float, default=5.0, help="seconds between user messages (0 = idle tabs)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        app = args.app
+        if args.baseline:
+            app = os.path.join(data_dir, 'baseline_app.py')
+            src = subprocess.check_output(['git', 'show', f'{args.baseline}:streamlit_app.py'], cwd=REPO_ROOT)
+            with open(app, 'wb') as f:
+                f.write(src)
+        port = free_port()
+        proc = start_server(app, port, data_dir)
+        try:
+            url = f"ws://127.0.0.1:{port}/_stcore/stream"
+            result = asyncio.run(drive(url, args.sessions, args.duration, args.think, proc.pid))
+        finally:
+            proc.terminate()
+            proc.wait(10)
+
+    label = args.baseline or os.path.relpath(app, REPO_ROOT)
+    print(f"app={label} sessions={result['sessions']} window={result['window_s']:.1f}s")
+    print(f"  reruns/sec            {result['reruns_per_sec']:.2f}")
+    print(f"  CPU s/session         {result['cpu_s_per_session']:.3f}")
+    print(f"  CPU %/session         {result['cpu_pct_per_session']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# benchmarks/mock_llm_server.py - local OpenAI-compatible server streaming canned chunks
+"""Serve POST /v1/chat/completions with ``stream=True`` semantics (server-sent
+events in the openai 0.28 chunk format), replying with a canned poem split into
+word chunks. Delays and failures are configurable, so generation.py can be
+exercised without network access or an API key.
+
+    python benchmarks/mock_llm_server.py --port 8765 --first-delay 0.3 --chunk-delay 0.05
+    SHADE_GENERATION=openai SHADE_OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock \\
+        streamlit run streamlit_app.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_POEM = """Beneath a sky of {topic} light,
+The morning folds away the night.
+We carry echoes, soft and slow,
+Through fields where quiet rivers go.
+A lantern hums a patient tune,
+Beside the silver-footed moon."""
+
+
+def canned_chunks(text: str) -> list:
+    """Split into word-sized chunks the way a tokenizer-backed stream roughly would."""
+    chunks = []
+    for line in text.split('\n'):
+        words = line.split(' ')
+        chunks += [w + ' ' for w in words[:-1]] + [words[-1] + '\n']
+    chunks[-1] = chunks[-1].rstrip('\n')
+    return chunks
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, first_delay=0.0, chunk_delay=0.0, status=200, stall_after=None, text=CANNED_POEM):
+        super().__init__(address, MockLLMHandler)
+        self.config = {'first_delay': first_delay, 'chunk_delay': chunk_delay, 'status': status,
+                       'stall_after': stall_after, 'text': text}
+        self.requests = 0
+        self.disconnects = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        cfg = dict(self.server.config)
+        self.server.requests += 1
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if cfg['status'] != 200:
+            payload = json.dumps({"error": {"message": "mock failure", "type": "server_error"}}).encode()
+            self.send_response(cfg['status'])
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        topic = "morning"
+        for m in body.get('messages', []):
+            if m.get('role') == 'user' and ' about ' in m.get('content', ''):
+                topic = m['content'].split(' about ', 1)[1].split(' in ', 1)[0]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            time.sleep(cfg['first_delay'])
+            for i, chunk in enumerate(canned_chunks(cfg['text'].format(topic=topic))):
+                if cfg['stall_after'] is not None and i >= cfg['stall_after']:
+                    time.sleep(3600)
+                self._event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": body.get('model'),
+                             "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]})
+                time.sleep(cfg['chunk_delay'])
+            self._event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": body.get('model'),
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.disconnects += 1
+
+    def _event(self, obj: dict):
+        self.wfile.write(b"data: " + json.dumps(obj).encode() + b"\n\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mock_server(port: int = 0, **config) -> MockLLMServer:
+    """Start a server on a daemon thread; ``server.config`` can be changed between requests."""
+    server = MockLLMServer(('127.0.0.1', port), **config)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--first-delay', type=float, default=0.3, help="seconds before the first chunk")
+    ap.add_argument('--chunk-delay', type=float, default=0.05, help="seconds between chunks")
+    ap.add_argument('--status', type=int, default=200, help="HTTP status to fail with instead of streaming")
+    ap.add_argument('--stall-after', type=int, default=None, help="stop sending after this many chunks")
+    args = ap.parse_args()
+    server = MockLLMServer(('127.0.0.1', args.port), args.first_delay, args.chunk_delay, args.status,
+                           args.stall_after)
+    print(f"mock LLM on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
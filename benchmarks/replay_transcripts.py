@@ -0,0 +1,147 @@
+# benchmarks/replay_transcripts.py - replay recorded sessions through the headless engine
+"""Feed every participant_* transcript in study_data/ back through engine.Engine
+and check each assistant reply (content, step, condition) against what was
+logged, then measure throughput single-threaded and across a process pool.
+Exits non-zero on any mismatch.
+
+Sessions recorded before conditions were logged (no ``condition``) are skipped.
+Two differences are reported as warnings rather than failures, since the
+recorded sessions predate this tree:
+
+- whitespace only: the logged poems have no indentation on their continuation
+  lines (the generators' triple-quoted strings do; markdown renders both alike)
+- no reply logged: a user message followed by another one, left by the old
+  sleep-and-rerun loop interrupting the script; replay of that session stops
+
+    python benchmarks/replay_transcripts.py [--data-dir study_data] [--repeat 200] [--workers N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from engine import Engine  # noqa: E402
+from session_store import iter_session_paths, load_session  # noqa: E402
+
+
+def load_transcripts(data_dir: str):
+    transcripts, skipped = [], []
+    for base in iter_session_paths(data_dir):
+        payload = load_session(base)
+        if not payload.get('condition'):
+            skipped.append(os.path.basename(base))
+            continue
+        transcripts.append((os.path.basename(base), payload))
+    return transcripts, skipped
+
+
+def _strip_lines(text):
+    return '\n'.join(line.strip() for line in text.split('\n')) if isinstance(text, str) else text
+
+
+def replay(engine: Engine, payload: dict):
+    """Replay one transcript. Returns (turns replayed, [mismatches], [warnings])."""
+    messages = payload.get('messages') or []
+    state = engine.new_state(payload['condition'], (payload.get('study_state') or {}).get('error_type', 'six_lines'))
+    mismatches, warnings = [], []
+
+    def compare(i: int, got: dict):
+        if i >= len(messages):
+            mismatches.append(f"#{i}: engine replied but the transcript ends")
+            return
+        want = messages[i]
+        for key in ('role', 'step', 'condition', 'content'):
+            if want.get(key) == got.get(key):
+                continue
+            if key == 'content' and _strip_lines(want[key]) == _strip_lines(got[key]):
+                warnings.append(f"#{i} content differs in whitespace only")
+            else:
+                mismatches.append(f"#{i} {key}: logged {want.get(key)!r:.80} != engine {got.get(key)!r:.80}")
+            return
+
+    if messages:
+        compare(0, engine.greeting(state))
+    turns = 0
+    i = 1
+    while i < len(messages):
+        msg = messages[i]
+        if msg.get('role') != 'user':
+            mismatches.append(f"#{i}: expected a user message, got {msg.get('role')!r}")
+            break
+        if msg.get('step') != state['step']:
+            mismatches.append(f"#{i} step: logged {msg.get('step')!r} != engine {state['step']!r}")
+        state, reply = engine.respond(state, msg['content'])
+        turns += 1
+        if i + 1 < len(messages) and messages[i + 1].get('role') == 'user':
+            warnings.append(f"#{i}: no reply logged (interrupted run); replay stops here")
+            break
+        if state['study_state']['ended_by_user']:
+            # The app leaves for the feedback page without showing the reply.
+            if i + 1 < len(messages):
+                mismatches.append(f"#{i + 1}: messages logged after the participant ended the study")
+            break
+        compare(i + 1, reply)
+        i += 2
+    return turns, mismatches, warnings
+
+
+def replay_many(transcripts, repeat: int) -> int:
+    engine = Engine()
+    turns = 0
+    for _ in range(repeat):
+        for _, payload in transcripts:
+            turns += replay(engine, payload)[0]
+    return turns
+
+
+def import_time_ms() -> str:
+    code = ("import sys, time; t = time.perf_counter(); import engine; "
+            "print(f'{(time.perf_counter() - t) * 1000:.1f} ms, streamlit loaded: {\"streamlit\" in sys.modules}')")
+    return subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--data-dir', default=os.path.join(REPO_ROOT, 'study_data'))
+    ap.add_argument('--repeat', type=int, default=200)
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+
+    print(f"import engine: {import_time_ms()}")
+    transcripts, skipped = load_transcripts(args.data_dir)
+    if skipped:
+        print(f"skipped (no recorded condition): {', '.join(skipped)}")
+    engine = Engine()
+    failed = 0
+    for name, payload in transcripts:
+        turns, mismatches, warnings = replay(engine, payload)
+        print(f"  {'ok  ' if not mismatches else 'FAIL'}  {name}: {turns} turns")
+        for m in mismatches:
+            print(f"          {m}")
+        for w in warnings:
+            print(f"          warning: {w}")
+        failed += bool(mismatches)
+    if not transcripts:
+        sys.exit(f"no transcripts with a recorded condition under {args.data_dir}")
+
+    t0 = time.perf_counter()
+    turns = replay_many(transcripts, args.repeat)
+    single = turns / (time.perf_counter() - t0)
+    print(f"single thread: {single:10.0f} turns/s ({turns} turns)")
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        turns = sum(pool.map(replay_many, [transcripts] * args.workers, [args.repeat] * args.workers))
+    pooled = turns / (time.perf_counter() - t0)
+    print(f"{args.workers} processes:  {pooled:10.0f} turns/s ({turns} turns, pool start-up included)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
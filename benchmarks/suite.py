@@ -0,0 +1,380 @@
+# benchmarks/suite.py - hot-path benchmark suite with JSON baselines and regression gating
+"""Time the app's hot paths and record latency and memory in a JSON baseline:
+
+- ``save_data/<n>``: one incremental save of a session already holding n
+  messages, through FilesystemStorage (as streamlit_app.save_data)
+- ``wrap/all_conditions``: templates.anthropomorphic_wrap over every template
+  under all 15 conditions
+- ``get_response/step<k>``: engine.get_response for a typical message at each step
+- ``rhymes``, ``make_test_lines``
+- ``append_csv_row_final/submit`` (what the app waits for) and ``/flush``
+  (the row reaching sessions.csv)
+- ``app/chat_stage``: Streamlit's AppTest driving N concurrent sessions through
+  consent, Start Study and five chat turns, interleaved turn by turn. Reports
+  per-rerun latency and the traced memory peak with all N sessions alive.
+
+The suite runs in ``--rounds`` rounds, each timing every case in turn, so
+drift on the machine spreads over all cases instead of landing on one. A case
+records the median over rounds of its per-round median and p95 latency (in
+microseconds), how far the round medians spread, and the tracemalloc peak of
+one traced call, taken in a separate pass so the tracing doesn't skew the
+timings. ``compare`` exits 1 when a case's median or memory peak exceeds the
+baseline by more than the threshold (widened to the baseline's own spread for
+noisy cases), or when a baseline case is missing from the current results.
+
+Baselines are machine-specific, so none is committed. Record one on the
+machine that runs ``compare``, from the revision to compare against, e.g. in
+CI:
+
+    git worktree add /tmp/base origin/main
+    python /tmp/base/benchmarks/suite.py run --out base.json
+    python benchmarks/suite.py compare base.json                # runs the suite now
+    python benchmarks/suite.py compare old.json new.json --threshold 0.5
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import engine  # noqa: E402
+import rhyme  # noqa: E402
+import templates  # noqa: E402
+from messages import Transcript  # noqa: E402
+from storage.filesystem import FilesystemStorage  # noqa: E402
+from summary_writer import summary_row  # noqa: E402
+
+BASELINE_VERSION = 2
+SCRIPT = ["ready", "the ocean at dawn", "a moment of beauty", "hopeful", "yes"]
+STEP_INPUTS = ["ready", "the ocean at dawn", "a moment of beauty", "hopeful", "yes", "can you make it 10 lines"]
+# Below these, a difference is noise whatever the ratio.
+MIN_DELTA_US = 2.0
+MIN_DELTA_BYTES = 16 * 1024
+# Cases that swing this much between identical runs get wider thresholds (time and memory).
+NOISY = {'app/chat_stage': 0.5}
+
+
+# ---------------------------
+# Cases
+# ---------------------------
+# Each case yields (name, op, repeat). ``op()`` is timed ``repeat`` times and
+# may return a dict of extra metrics (kept from the last call).
+def session_payload(n: int, eng: engine.Engine) -> dict:
+    state = eng.new_state({"anthro_level": "A2", "pov": "first"}, "six_lines")
+    messages = Transcript([eng.greeting(state)])
+    i = 0
+    while len(messages) < n:
+        text = SCRIPT[i] if i < len(SCRIPT) else f"make the imagery warmer, revision {i}"
+        messages.append(eng.user_message(state, text))
+        state, reply = eng.respond(state, text)
+        messages.append(reply)
+        i += 1
+    return {'participant': "Bench", 'id': f"Pbench{n}", 'messages': messages, 'study_state': state['study_state'],
+            'session_id': f"bench-{n}", 'condition': state['condition'], 'seed': n, 'status': 'partial',
+            'saved_at': datetime.utcnow().isoformat() + 'Z'}
+
+
+def cases_save_data(workdir: str, quick: bool):
+    eng = engine.Engine()
+    storage = FilesystemStorage(os.path.join(workdir, 'save_data'))
+    for n in (10, 100, 500):
+        payload = session_payload(n, eng)
+        storage.save_session(payload)
+        extra = eng.user_message(eng.new_state(payload['condition']), "make the imagery warmer")
+
+        def op(payload=payload, extra=extra):
+            payload['messages'].append(extra)
+            payload['saved_at'] = datetime.utcnow().isoformat() + 'Z'
+            storage.save_session(payload)
+        yield f"save_data/{n}", op, 50 if quick else 300
+
+
+def cases_wrap(workdir: str, quick: bool):
+    texts = list(templates.STATIC_RESPONSES) + [templates.TEN_LINES_ACK] + templates.REVISION_LEADS
+    texts.append(templates.TOPIC_CHOSEN.format(topic="the ocean"))
+
+    def op():
+        for level, pov in templates.CONDITIONS:
+            for text in texts:
+                templates.anthropomorphic_wrap(text, level, pov)
+    yield "wrap/all_conditions", op, 50 if quick else 300
+
+
+def cases_get_response(workdir: str, quick: bool):
+    eng = engine.Engine()
+    state = eng.new_state({"anthro_level": "A2", "pov": "first"}, "six_lines")
+    for step, text in enumerate(STEP_INPUTS):
+        study_state, current = dict(state['study_state']), state['step']
+
+        def op(text=text, step=current, study_state=study_state):
+            engine.get_response(text, step, dict(study_state))
+        yield f"get_response/step{step}", op, 200 if quick else 2000
+        if step < len(SCRIPT):
+            state, _ = eng.respond(state, text)
+
+
+def cases_rhyme(workdir: str, quick: bool):
+    a, b = "In realms where ocean holds its sway,", "We find new meaning every day."
+    rhyme.rhymes(a, b)      # build or open the index outside the timings
+    yield "rhymes", lambda: rhyme.rhymes(a, b), 2000 if quick else 20000
+    yield "make_test_lines", lambda: engine.make_test_lines("the ocean at dawn"), 2000 if quick else 20000
+
+
+def cases_append_csv(workdir: str, quick: bool):
+    storage = FilesystemStorage(os.path.join(workdir, 'csv'))
+    row_payload = session_payload(10, engine.Engine())
+    yield "append_csv_row_final/submit", lambda: storage.append_summary(summary_row(row_payload)), \
+        200 if quick else 2000
+
+    def flushed():
+        storage.append_summary(summary_row(row_payload))
+        storage.flush()
+    yield "append_csv_row_final/flush", flushed, 20 if quick else 100
+
+
+def _await_shutdown(runner, timeout: float = 3):
+    """Stand-in for AppTest's ``require_widgets_deltas``.
+
+    The stock version polls every 100 ms, so every rerun measured 100-200 ms.
+    It also returns as soon as the script stops, before the runner's SHUTDOWN
+    event that ``AppTest._run`` then reads, and under load that race fails
+    with ``KeyError: 'client_state'``.
+    """
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if ScriptRunnerEvent.SHUTDOWN in runner.events:
+            return
+        time.sleep(0.0005)
+    runner.request_stop()
+    runner.join()
+    raise RuntimeError(f"AppTest script run timed out after {timeout}s")
+
+
+@contextlib.contextmanager
+def _apptest_patched():
+    """Swap in ``_await_shutdown`` (and a salt, if none is set) for one AppTest run."""
+    from streamlit.testing.v1 import local_script_runner
+    saved = local_script_runner.require_widgets_deltas
+    salt = os.environ.get('SHADE_ALLOCATION_SALT')
+    local_script_runner.require_widgets_deltas = _await_shutdown
+    os.environ['SHADE_ALLOCATION_SALT'] = salt or 'bench'
+    try:
+        yield
+    finally:
+        local_script_runner.require_widgets_deltas = saved
+        if salt is None:
+            del os.environ['SHADE_ALLOCATION_SALT']
+
+
+def app_sessions(n: int, timeout: float = 60):
+    """Drive ``n`` AppTest sessions through the chat stage, interleaved turn by turn.
+
+    AppTest swaps a mock into the process-wide ``Runtime._instance`` for each
+    run, so two runs can't overlap on threads. The sessions are all alive at
+    once and take turns, the way one server process serves several open tabs.
+    Yields each rerun's latency.
+    """
+    from streamlit.testing.v1 import AppTest
+    tests = [AppTest.from_file(os.path.join(REPO_ROOT, 'streamlit_app.py'), default_timeout=timeout)
+             for _ in range(n)]
+
+    def start(at):
+        at.checkbox[0].check()
+        at.text_input[0].input("Bench")
+        return at.button[0].click()
+
+    turns = [lambda at: at] + [start] + [lambda at, text=text: at.chat_input[0].set_value(text) for text in SCRIPT]
+    for turn in turns:
+        for at in tests:
+            with _apptest_patched():
+                t0 = time.perf_counter()
+                turn(at).run()
+                elapsed = time.perf_counter() - t0
+            yield elapsed
+            if at.exception:
+                raise RuntimeError(f"app raised: {at.exception[0].message}")
+    for at in tests:
+        if at.session_state.current_step != 5:
+            raise RuntimeError(f"session stopped at step {at.session_state.current_step}")
+
+
+def cases_app(workdir: str, quick: bool, sessions: int = None):
+    sessions = sessions or (4 if quick else 16)
+
+    latencies = []      # every timed rerun so far, across repeats and rounds
+
+    def op():
+        latencies.extend(app_sessions(sessions))
+        ordered = sorted(latencies)
+        return {'sessions': sessions, 'reruns': len(ordered), 'rerun_median_us': ordered[len(ordered) // 2] * 1e6,
+                'rerun_p95_us': ordered[int(len(ordered) * 0.95)] * 1e6}
+    yield "app/chat_stage", op, 1
+
+
+CASES = [cases_save_data, cases_wrap, cases_get_response, cases_rhyme, cases_append_csv, cases_app]
+
+
+# ---------------------------
+# Running and comparing
+# ---------------------------
+def time_op(op, repeat: int):
+    """Sorted wall times of ``repeat`` calls, and the extra metrics of the last one."""
+    times, extra = [], {}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = op()
+        times.append(time.perf_counter() - t0)
+        if isinstance(out, dict):
+            extra = out
+    times.sort()
+    return times, extra
+
+
+def peak_memory(op) -> int:
+    tracemalloc.start()
+    try:
+        op()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(quick: bool = False, only: str = None, app_sessions: int = None, rounds: int = 3) -> dict:
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The app writes to ./study_data; keep that inside the scratch directory.
+        os.chdir(workdir)
+        try:
+            selected = []
+            for make in CASES:
+                kwargs = {'sessions': app_sessions} if make is cases_app else {}
+                selected += [c for c in make(workdir, quick, **kwargs) if not only or only in c[0]]
+            for _, op, _ in selected:
+                op()    # warm up
+            per_round = {name: [] for name, _, _ in selected}
+            extras = {}
+            for r in range(rounds):
+                print(f"  round {r + 1}/{rounds}", flush=True)
+                for name, op, repeat in selected:
+                    times, extras[name] = time_op(op, repeat)
+                    per_round[name].append((statistics.median(times), times[int(len(times) * 0.95)]))
+            for name, op, repeat in selected:
+                medians = [m for m, _ in per_round[name]]
+                median = statistics.median(medians)
+                results[name] = dict({
+                    'median_us': median * 1e6,
+                    'p95_us': statistics.median(p for _, p in per_round[name]) * 1e6,
+                    'spread': (max(medians) - min(medians)) / median if median else 0.0,
+                    'peak_bytes': peak_memory(op), 'repeat': repeat, 'rounds': rounds}, **extras[name])
+                r = results[name]
+                print(f"  {name:<30} median {r['median_us']:>12.1f} us  p95 {r['p95_us']:>12.1f} us  "
+                      f"spread {r['spread']:>5.0%}  peak {r['peak_bytes']:>12,} B", flush=True)
+        finally:
+            os.chdir(cwd)
+    return {'version': BASELINE_VERSION, 'created': datetime.utcnow().isoformat() + 'Z',
+            'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'quick': quick, 'rounds': rounds, 'results': results}
+
+
+def compare(baseline: dict, current: dict, threshold: float, memory_threshold: float, only: str = None) -> list:
+    """Rows of (case, metric, baseline, current, ratio, regressed).
+
+    A baseline case absent from ``current`` is a failed row with metric and
+    current value None. ``only`` limits the comparison to matching cases.
+    """
+    rows = []
+    for name, base in sorted(baseline['results'].items()):
+        if only and only not in name:
+            continue
+        cur = current['results'].get(name)
+        if cur is None:
+            rows.append((name, None, base.get('median_us'), None, None, True))
+            continue
+        slower = max(threshold, NOISY.get(name, 0), base.get('spread', 0))
+        for metric, limit, floor in (('median_us', slower, MIN_DELTA_US),
+                                     ('rerun_median_us', slower, MIN_DELTA_US),
+                                     ('peak_bytes', max(memory_threshold, NOISY.get(name, 0)), MIN_DELTA_BYTES)):
+            if metric not in base or metric not in cur:
+                continue
+            b, c = base[metric], cur[metric]
+            ratio = c / b if b else float('inf') if c else 1.0
+            rows.append((name, metric, b, c, ratio, ratio > 1 + limit and c - b > floor))
+    return rows
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('version') != BASELINE_VERSION:
+        raise SystemExit(f"{path}: unsupported baseline version {data.get('version')!r}")
+    return data
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    for name in ('run', 'compare'):
+        p = sub.add_parser(name)
+        if name == 'run':
+            p.add_argument('--out', help="write results here (default: print JSON)")
+        else:
+            p.add_argument('baseline')
+            p.add_argument('current', nargs='?', help="results to compare (default: run the suite now)")
+            p.add_argument('--threshold', type=float, default=0.5, help="allowed median slowdown (0.5 = 50%%)")
+            p.add_argument('--memory-threshold', type=float, default=0.2, help="allowed memory peak growth")
+        p.add_argument('--quick', action='store_true', help="fewer repeats and app sessions")
+        p.add_argument('--only', help="run cases whose name contains this")
+        p.add_argument('--app-sessions', type=int, help="concurrent AppTest sessions")
+        p.add_argument('--rounds', type=int, default=3, help="rounds over all cases; the median round counts")
+    args = ap.parse_args()
+
+    if args.cmd == 'run':
+        results = run_suite(args.quick, args.only, args.app_sessions, args.rounds)
+        text = json.dumps(results, indent=2)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+        return 0
+
+    baseline = load(args.baseline)
+    current = load(args.current) if args.current else \
+        run_suite(args.quick or baseline.get('quick', False), args.only, args.app_sessions, args.rounds)
+    rows = compare(baseline, current, args.threshold, args.memory_threshold, args.only)
+    print(f"baseline {baseline['revision']} ({baseline['created']}) vs current {current['revision']}")
+    print(f"{'case':<30} {'metric':<10} {'baseline':>14} {'current':>14} {'ratio':>7}")
+    for name, metric, b, c, ratio, regressed in rows:
+        if metric is None:
+            print(f"{name:<30} {'-':<10} {b:>14,.1f} {'-':>14} {'-':>7}  MISSING")
+            continue
+        print(f"{name:<30} {metric:<10} {b:>14,.1f} {c:>14,.1f} {ratio:>6.2f}x{'  REGRESSION' if regressed else ''}")
+    missing = [r for r in rows if r[1] is None]
+    regressions = [r for r in rows if r[5] and r[1] is not None]
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} time / {args.memory_threshold:.0%} memory, "
+          f"{len(missing)} case(s) missing")
+    return 1 if regressions or missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
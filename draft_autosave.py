@@ -0,0 +1,129 @@
+# draft_autosave.py - debounced, change-detecting autosave for the feedback draft
+"""Persist the live feedback draft only when the answers change.
+
+Each rerun of the feedback page hands the current answers to
+``DraftAutosaver.update``. Answers are hashed; an unchanged hash is a no-op.
+A change is written immediately if nothing was written in the last ``window``
+seconds, otherwise it is held and written by a trailing timer at the end of the
+window, so a burst of edits becomes at most two writes. ``close`` flushes any
+pending draft synchronously and must run before the final save.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+DRAFT_WINDOW = float(os.environ.get("SHADE_DRAFT_WINDOW", "2.0"))
+
+_totals_lock = threading.Lock()
+_totals = {'updates': 0, 'writes': 0, 'writes_avoided': 0, 'coalesced': 0,
+           'flush_seconds_total': 0.0, 'flush_seconds_max': 0.0}
+
+
+def answers_hash(answers: dict) -> str:
+    return hashlib.sha1(json.dumps(answers, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def autosave_metrics() -> dict:
+    """Process-wide counters across every feedback page."""
+    with _totals_lock:
+        out = dict(_totals)
+    out['flush_seconds_mean'] = out['flush_seconds_total'] / out['writes'] if out['writes'] else 0.0
+    return out
+
+
+def _count(key: str, n=1):
+    with _totals_lock:
+        _totals[key] += n
+
+
+class DraftAutosaver:
+    """Per-session draft writer. ``persist(answers)`` does the actual save."""
+
+    def __init__(self, persist, window: float = DRAFT_WINDOW, timer_hook=None):
+        self.persist = persist
+        self.window = window
+        # Called with each trailing Timer before it starts (e.g. to attach a script context).
+        self.timer_hook = timer_hook
+        self.metrics = {'updates': 0, 'writes': 0, 'writes_avoided': 0, 'coalesced': 0,
+                        'last_flush_seconds': 0.0, 'max_flush_seconds': 0.0}
+        self._lock = threading.Lock()
+        self._written_hash = None
+        self._pending = None
+        self._pending_hash = None
+        self._last_write = float('-inf')
+        self._timer = None
+        self._closed = False
+
+    def update(self, answers: dict) -> bool:
+        """Offer the current answers. Returns True if they were written now."""
+        h = answers_hash(answers)
+        with self._lock:
+            self._bump('updates')
+            current = self._pending_hash if self._pending is not None else self._written_hash
+            if self._closed or h == current:
+                self._bump('writes_avoided')
+                return False
+            if h == self._written_hash:
+                # Edited back to what is already on disk; drop the pending draft.
+                self._pending = self._pending_hash = None
+                self._bump('writes_avoided')
+                return False
+            if self._pending is not None:
+                self._bump('coalesced')
+            self._pending, self._pending_hash = dict(answers), h
+            if time.monotonic() - self._last_write >= self.window:
+                self._flush_locked()
+                return True
+            self._arm_timer()
+            return False
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Cancel the trailing timer and write any pending draft. Later updates are ignored."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._flush_locked()
+            self._closed = True
+
+    # -- internals (call with self._lock held) --
+    def _bump(self, key: str):
+        self.metrics[key] += 1
+        _count(key)
+
+    def _arm_timer(self):
+        if self._timer is not None:
+            return
+        delay = max(0.0, self._last_write + self.window - time.monotonic())
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        if self.timer_hook is not None:
+            self.timer_hook(self._timer)
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if not self._closed:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending is None:
+            return
+        t0 = time.perf_counter()
+        self.persist(self._pending)
+        took = time.perf_counter() - t0
+        self._written_hash, self._pending, self._pending_hash = self._pending_hash, None, None
+        self._last_write = time.monotonic()
+        self._bump('writes')
+        self.metrics['last_flush_seconds'] = took
+        self.metrics['max_flush_seconds'] = max(self.metrics['max_flush_seconds'], took)
+        with _totals_lock:
+            _totals['flush_seconds_total'] += took
+            _totals['flush_seconds_max'] = max(_totals['flush_seconds_max'], took)
@@ -0,0 +1,205 @@
+# engine.py - Streamlit-free conversation engine
+"""The study's conversation: policy, condition wrapping and poem generators,
+without Streamlit. ``Engine.respond(state, user_msg)`` returns the next state
+and the assistant message to append; the app and the replay harness
+(benchmarks/replay_transcripts.py) both drive it.
+
+A conversation state is a plain dict::
+
+    {'step': 0, 'condition': {'anthro_level': 'A2', 'pov': 'third'}, 'study_state': {...}}
+
+``respond`` never mutates the state it is given.
+"""
+from datetime import datetime
+
+import intents
+import templates
+from rhyme import rhymes
+
+
+def utc_now() -> str:
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def new_study_state(error_type: str = 'six_lines') -> dict:
+    return {
+        'topic': None,
+        'content_arc': None,
+        'tone': None,
+        'error_mode': False,
+        'timer_expired': False,
+        'ended_by_user': False,
+        'poem_attempts': 0,
+        'feedback': {},            # final
+        'feedback_draft': {},      # live capture
+        'error_type': error_type,  # configurable
+        'feedback_page_seen': False
+    }
+
+
+# ---------------------------
+# Poem helpers & error modes
+# ---------------------------
+def revision_intro(attempt: int) -> str:
+    return templates.REVISION_LEADS[attempt % len(templates.REVISION_LEADS)]
+
+def make_test_lines(topic: str):
+    l1 = f"In realms where {topic} holds its sway,"
+    l2 = "We find new meaning every day."
+    if not rhymes(l1, l2):
+        l1 = f"In realms where {topic} softly plays,"
+        l2 = "We wander wide through warming days."
+    return l1, l2
+
+def generate_poem_6_lines(topic: str, attempt: int) -> str:
+    poems = [
+        f"""Beneath the waves of {topic} deep,
+        Where ancient secrets safely sleep.
+        The wisdom flows through time and space,
+        Revealing truths we all must face.
+        In every moment, lessons shine,
+        A testament to grand design.""",
+        f"""The story of {topic} unfolds with grace,
+        Each line reveals a hidden place.
+        Through metaphor and rhythm's song,
+        We find where hearts and minds belong.
+        The journey ends but leaves its mark,
+        A light that glimmers in the dark."""
+    ]
+    return poems[attempt % len(poems)]
+
+def generate_poem_non_rhyme(topic: str, attempt: int) -> str:
+    lines = [
+        f"{topic} drifts along a silver stream,",
+        "Lanterns glow and cradle every dream.",
+        "Footsteps echo softly, steady, bright,",
+        "Pebbles tumble, sandwiches in flight.",  # broken rhyme
+        "Whispers gather courage, rise, and sing,",
+        "Wings unfold to taste a wondering.",      # broken rhyme
+        "Mist becomes a map to what we seek,",
+        "Gentle, playful, curious, and meek.",
+        "We circle back to where the journey starts,",
+        "Trading clocks for open, laughing hearts."
+    ]
+    return "\n".join(lines)
+
+def generate_poem_foreign_token(topic: str, attempt: int) -> str:
+    token = "犬" if attempt % 2 == 0 else "bonjour"
+    lines = [
+        f"Under the lantern of {topic}, we play,",
+        f"Skipping through echoes that color the day.",
+        f"Patterns unravel, then softly align,",
+        f"A {token} appears between rhythm and rhyme.",
+        "We giggle and shuffle the puzzle once more,",
+        "Finding a window disguised as a door.",
+        "Syllables spin like kites on a string,",
+        "Pausing to listen to what breezes bring.",
+        "We measure our laughter in teaspoons of light,",
+        "Tucking new constellations into the night."
+    ]
+    return "\n".join(lines)
+
+def generate_error_poem(topic: str, attempt: int, error_type: str) -> str:
+    if error_type == "six_lines":
+        return generate_poem_6_lines(topic, attempt)
+    elif error_type == "non_rhyme":
+        return generate_poem_non_rhyme(topic, attempt)
+    elif error_type == "foreign_token":
+        return generate_poem_foreign_token(topic, attempt)
+    else:
+        return generate_poem_6_lines(topic, attempt)
+
+# ---------------------------
+# Conversation policy
+# ---------------------------
+def get_response(user_msg: str, step: int, state: dict, poet=generate_error_poem):
+    """Return (response, next_step). The intent table in intents.py decides both.
+
+    ``poet(topic, attempt, error_type)`` supplies the poem text (see generation.py).
+    """
+    intent, next_step = intents.match(user_msg, step)
+    if intent == 'end_study':
+        state['timer_expired'] = True
+        state['ended_by_user'] = True
+        return templates.END_STUDY_REPLY, next_step
+
+    if intent == 'start':
+        return templates.START_PROMPT, next_step
+    if intent == 'long_input':
+        return templates.TOPIC_PROMPT, next_step
+    if intent == 'topic':
+        state['topic'] = user_msg.strip()
+        return templates.TOPIC_CHOSEN.format(topic=templates.verbatim(state['topic'])), next_step
+    if intent == 'content_arc':
+        state['content_arc'] = user_msg.strip()
+        return templates.TONE_PROMPT, next_step
+    if intent in ('tone', 'tone_default'):
+        state['tone'] = user_msg.strip() or state.get('tone') or "thoughtful and reflective"
+        l1, l2 = make_test_lines(state.get('topic', 'wonder'))
+        return templates.TEST_LINES.format(l1=templates.verbatim(l1), l2=templates.verbatim(l2)), next_step
+    if intent == 'confirm':
+        state['error_mode'] = True
+        poem = poet(state.get('topic', 'life'), 0, state['error_type'])
+        return templates.POEM_READY.format(poem=templates.verbatim(poem)), next_step
+    if intent == 'redirect':
+        poem = poet(state.get('topic', 'life'), 0, state['error_type'])
+        return templates.POEM_REDIRECT.format(poem=templates.verbatim(poem)), next_step
+    if intent in ('ten_lines', 'revise'):
+        if intent == 'ten_lines':
+            ack = templates.TEN_LINES_ACK
+        else:
+            ack = revision_intro(state['poem_attempts'])
+        state['poem_attempts'] += 1
+        poem = poet(state.get('topic', 'life'), state['poem_attempts'], state['error_type'])
+        return templates.POEM_REVISION.format(ack=ack, poem=templates.verbatim(poem)), next_step
+    return templates.FALLBACK_REPLY, next_step
+
+
+# ---------------------------
+# Engine
+# ---------------------------
+class Engine:
+    """(state, user message) -> (new state, assistant message)."""
+
+    def __init__(self, clock=utc_now, poet=generate_error_poem):
+        self.clock = clock
+        self.poet = poet
+
+    def new_state(self, condition: dict, error_type: str = 'six_lines') -> dict:
+        return {'step': 0, 'condition': condition, 'study_state': new_study_state(error_type)}
+
+    def assistant_message(self, state: dict, content: str) -> dict:
+        condition = state['condition']
+        return {
+            "ts": self.clock(),
+            "role": "assistant",
+            "step": state['step'],
+            "condition": condition,
+            "content": templates.render(content, condition["anthro_level"], condition["pov"])
+        }
+
+    def user_message(self, state: dict, content: str) -> dict:
+        return {
+            "ts": self.clock(),
+            "role": "user",
+            "step": state['step'],
+            "content": content
+        }
+
+    def greeting(self, state: dict) -> dict:
+        return self.assistant_message(state, templates.GREETING)
+
+    def respond_text(self, state: dict, user_msg: str, poet=None):
+        """Return ``(new_state, response)`` with the response not yet condition-wrapped."""
+        study_state = dict(state['study_state'])
+        response, step = get_response(user_msg, state['step'], study_state, poet or self.poet)
+        return dict(state, step=step, study_state=study_state), response
+
+    def respond(self, state: dict, user_msg: str, poet=None):
+        """Return ``(new_state, assistant_message)`` for ``user_msg``.
+
+        When the participant ends the study, ``new_state['study_state']['ended_by_user']``
+        is set; the app moves to feedback without showing the reply.
+        """
+        new_state, response = self.respond_text(state, user_msg, poet)
+        return new_state, self.assistant_message(new_state, response)
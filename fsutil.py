@@ -0,0 +1,16 @@
+# fsutil.py - small file helpers shared by the offline tools
+"""Helpers with no dependencies beyond the standard library, so lightweight
+tools (search.py) don't have to import heavy ones (analytics.py, pyarrow) to
+reuse them.
+"""
+import os
+
+
+def write_atomic(path: str, write):
+    """Call ``write(tmp_path)``, then move the result over ``path`` in one rename.
+
+    Readers see the old file or the new one, never a partial write.
+    """
+    tmp = path + '.tmp'
+    write(tmp)
+    os.replace(tmp, path)
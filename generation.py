@@ -0,0 +1,527 @@
+# generation.py - streamed poem generation behind the error_type contract
+"""Poems from an LLM, streamed token by token, with the hard-coded poems in
+engine.py as the fallback.
+
+``SHADE_GENERATION`` picks the backend:
+
+- ``templates`` (default): engine.generate_error_poem, no network
+- ``openai``: ``openai.ChatCompletion`` (openai==0.28.1) with ``stream=True``,
+  model ``SHADE_OPENAI_MODEL``, optional ``SHADE_OPENAI_API_BASE`` (e.g. the mock
+  server in benchmarks/mock_llm_server.py); the key comes from ``OPENAI_API_KEY``
+
+Each request runs on a shared thread pool (``SHADE_GENERATION_WORKERS``) so a
+slow completion only holds up its own session. ``PoemStream`` hands chunks to
+the caller as they arrive. No first token (or a gap between chunks) longer than
+``SHADE_GENERATION_FIRST_TOKEN_TIMEOUT`` seconds, no completion within
+``SHADE_GENERATION_TIMEOUT``, an API error or an empty reply all fall back to
+the template poem for the same (topic, attempt, error_type). ``cancel()``
+stops the worker at the next chunk. Time to first token and total latency are
+logged (``shade.generation``), kept on the stream's ``record()`` and, with
+SHADE_METRICS on, observed into histograms.
+
+Poems are cached (``GenerationCache``, LRU of ``SHADE_GENERATION_CACHE_SIZE``
+entries, ``SHADE_GENERATION_CACHE_TTL`` seconds) on the normalized topic,
+content_arc, tone, error_type and attempt plus the condition. With
+``SHADE_GENERATION_PREFETCH`` on (default), ``prefetch_for`` starts the draft as
+soon as the tone is known (step 4) and the next revision while a draft is on
+screen (step 5), so the participant's "yes" usually joins a poem that is
+already written. Hit rate, prefetch use and waste, and the generation time
+saved are in ``cache.stats()`` and the metrics export.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from engine import generate_error_poem
+
+BACKEND = os.environ.get("SHADE_GENERATION", "templates")
+MODEL = os.environ.get("SHADE_OPENAI_MODEL", "gpt-3.5-turbo")
+API_BASE = os.environ.get("SHADE_OPENAI_API_BASE", "")
+FIRST_TOKEN_TIMEOUT = float(os.environ.get("SHADE_GENERATION_FIRST_TOKEN_TIMEOUT", "8"))
+TOTAL_TIMEOUT = float(os.environ.get("SHADE_GENERATION_TIMEOUT", "30"))
+WORKERS = int(os.environ.get("SHADE_GENERATION_WORKERS", "8"))
+CACHE_SIZE = int(os.environ.get("SHADE_GENERATION_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.environ.get("SHADE_GENERATION_CACHE_TTL", "900"))
+PREFETCH = os.environ.get("SHADE_GENERATION_PREFETCH", "1").lower() in ("1", "true", "on", "yes")
+
+log = logging.getLogger("shade.generation")
+
+SYSTEM_PROMPT = ("You write short poems for a creative-writing study. Reply with the poem only: "
+                 "no title, no commentary, one line per line of verse, in English.")
+
+ERROR_PROMPTS = {
+    "six_lines": "Write a poem about {topic} in exactly six lines: three rhyming couplets.",
+    "non_rhyme": ("Write a poem about {topic} in ten lines as five rhyming couplets, except that the "
+                  "second and third couplets must not rhyme."),
+    "foreign_token": ("Write a poem about {topic} in ten lines as five rhyming couplets, and use the "
+                      "word \"{token}\" once in the fourth line, untranslated."),
+}
+
+
+def build_messages(topic: str, attempt: int, error_type: str, content_arc: str = None, tone: str = None) -> list:
+    # Same token choice as generate_poem_foreign_token, so fallbacks stay consistent.
+    token = "犬" if attempt % 2 == 0 else "bonjour"
+    prompt = ERROR_PROMPTS.get(error_type, ERROR_PROMPTS["six_lines"]).format(topic=topic, token=token)
+    if content_arc:
+        prompt += f" It should move through this arc: {content_arc}."
+    if tone:
+        prompt += f" Keep the tone {tone}."
+    if attempt:
+        prompt += f" This is revision {attempt}; vary the imagery from earlier drafts."
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+
+def openai_chunks(messages: list, cancel: threading.Event, read_timeout: float):
+    """Yield content deltas from a streamed ChatCompletion until done or cancelled."""
+    import openai
+
+    kwargs = {'api_base': API_BASE} if API_BASE else {}
+    response = openai.ChatCompletion.create(model=MODEL, messages=messages, stream=True, temperature=0.9,
+                                            request_timeout=(5, read_timeout), **kwargs)
+    try:
+        for chunk in response:
+            if cancel.is_set():
+                return
+            choices = chunk.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+    finally:
+        response.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(WORKERS, thread_name_prefix="shade-generation")
+        return _executor
+
+
+class PoemStream:
+    """One streamed poem, produced once and followed by any number of readers.
+
+    The worker appends chunks under a condition variable. Readers come from
+    ``reader()``, including ones that attach after it started (a cached or
+    prefetched poem); each has its own first-token/gap and total timeouts,
+    counted from when it attached, and a timeout only detaches that reader.
+    Readers and the cache each hold a reference; the worker is cancelled when
+    the last one is released. The worker enforces the total timeout itself.
+    """
+
+    def __init__(self, topic: str, attempt: int, error_type: str, source=openai_chunks,
+                 first_token_timeout: float = None, timeout: float = None, pool: ThreadPoolExecutor = None,
+                 content_arc: str = None, tone: str = None):
+        self.error_type = error_type
+        self.fallback = generate_error_poem(topic, attempt, error_type)
+        self.first_token_timeout = FIRST_TOKEN_TIMEOUT if first_token_timeout is None else first_token_timeout
+        self.timeout = TOTAL_TIMEOUT if timeout is None else timeout
+        self.text = ""
+        self.chunks = 0
+        self.outcome = None     # ok | timeout | error | cancelled
+        self.error = None
+        self.ttft = None
+        self.total = None
+        self.on_finish = []     # callables taking the stream, run once it has an outcome
+        self._source = source
+        self._messages = build_messages(topic, attempt, error_type, content_arc, tone)
+        self._cond = threading.Condition()
+        self._last_chunk = 0.0
+        self._refs = 0
+        self._cancel = threading.Event()
+        self.started = time.perf_counter()
+        self._future = (pool or executor()).submit(self._produce)
+
+    def _produce(self):
+        try:
+            # The socket read timeout only has to unblock the worker; readers decide timeouts.
+            for delta in self._source(self._messages, self._cancel, self.first_token_timeout + 1):
+                with self._cond:
+                    if self.outcome is not None:
+                        return
+                    now = time.perf_counter()
+                    if self.ttft is None:
+                        self.ttft = now - self.started
+                    self.text += delta
+                    self.chunks += 1
+                    self._last_chunk = now
+                    self._cond.notify_all()
+                if now - self.started > self.timeout:
+                    # Nobody may be reading (prefetch), so the worker enforces the total itself.
+                    self._finish("timeout")
+                    return
+            self._finish("ok" if self.text.strip() else "error")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self._finish("error")
+
+    def acquire(self):
+        with self._cond:
+            self._refs += 1
+
+    def release(self):
+        """Drop one reference; the last one cancels a stream that is still running."""
+        with self._cond:
+            self._refs -= 1
+            last = self._refs <= 0
+        if last:
+            self._finish("cancelled")
+
+    def reader(self, first_token_timeout: float = None, timeout: float = None) -> "StreamReader":
+        self.acquire()
+        return StreamReader(self, first_token_timeout, timeout)
+
+    def _finish(self, outcome: str):
+        with self._cond:
+            if self.outcome is not None:
+                return
+            self.outcome = outcome
+            self.total = time.perf_counter() - self.started
+            if outcome != "ok":
+                self._cancel.set()
+            self._cond.notify_all()
+        ttft_ms = f"{self.ttft * 1000:.0f}ms" if self.ttft is not None else "-"
+        log.info("poem %s error_type=%s ttft=%s total=%.0fms chunks=%d%s", outcome, self.error_type, ttft_ms,
+                 self.total * 1000, self.chunks, f" ({self.error})" if self.error else "")
+        if metrics.ENABLED:
+            if self.ttft is not None:
+                metrics.registry.histogram('shade_generation_ttft_seconds').observe(self.ttft)
+            metrics.registry.histogram('shade_generation_seconds', outcome).observe(self.total)
+        for callback in self.on_finish:
+            callback(self)
+
+
+class StreamReader:
+    """One session's view of a PoemStream. Iterate for the text so far; ``result`` is the final poem.
+
+    ``outcome`` is the stream's, unless this reader gave up first: "timeout"
+    (its own first-token/gap or total timeout) or "cancelled" (``cancel()``,
+    e.g. a rerun). Either way it gets the fallback poem and only detaches;
+    the stream goes on for its other readers and the cache.
+    """
+
+    def __init__(self, stream: PoemStream, first_token_timeout: float = None, timeout: float = None):
+        self.stream = stream
+        self.fallback = stream.fallback
+        self.first_token_timeout = stream.first_token_timeout if first_token_timeout is None else first_token_timeout
+        self.timeout = stream.timeout if timeout is None else timeout
+        self.attached = time.perf_counter()
+        self._outcome = None
+        self._total = None
+        self._released = False
+
+    def __iter__(self):
+        return self.updates()
+
+    def updates(self, tick: float = 0.25):
+        """Yield the text so far after new chunks, and at least every ``tick`` seconds while waiting."""
+        stream = self.stream
+        deadline = max(stream.started, self.attached) + self.timeout
+        seen = -1
+        while self.outcome is None:
+            with stream._cond:
+                limit = min(deadline, max(self.attached, stream._last_chunk) + self.first_token_timeout)
+                now = time.perf_counter()
+                if stream.chunks == seen and stream.outcome is None and now < limit:
+                    stream._cond.wait(min(tick, limit - now))
+                fresh = stream.chunks != seen
+                seen = stream.chunks
+            if not fresh and stream.outcome is None and time.perf_counter() >= limit:
+                self._detach("timeout")
+                break
+            yield stream.text
+
+    def wait(self) -> str:
+        for _ in self.updates():
+            pass
+        return self.result
+
+    def cancel(self):
+        """Stop following the stream (idempotent); a finished poem is kept."""
+        self._detach("cancelled")
+
+    def _detach(self, outcome: str):
+        if self._released:
+            return
+        self._released = True
+        if self.stream.outcome is None:
+            self._outcome = outcome
+            self._total = time.perf_counter() - self.stream.started
+            if outcome == "timeout":
+                log.info("poem reader timeout error_type=%s after %.0fms, stream left running",
+                         self.stream.error_type, self._total * 1000)
+        self.stream.release()
+
+    @property
+    def outcome(self):
+        return self._outcome or self.stream.outcome
+
+    @property
+    def text(self) -> str:
+        return self.stream.text
+
+    @property
+    def chunks(self) -> int:
+        return self.stream.chunks
+
+    @property
+    def ttft(self):
+        return self.stream.ttft
+
+    @property
+    def total(self):
+        return self._total if self._outcome else self.stream.total
+
+    @property
+    def error(self):
+        return self.stream.error
+
+    @property
+    def result(self) -> str:
+        return self.stream.text.strip() if self.outcome == "ok" else self.fallback
+
+    def record(self) -> dict:
+        """Latency summary stored on the assistant message."""
+        ttft, total = self.ttft, self.total
+        return {
+            "backend": BACKEND,
+            "model": MODEL,
+            "outcome": self.outcome,
+            "fallback": self.outcome != "ok",
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "total_ms": round(total * 1000, 1) if total is not None else None,
+        }
+
+
+class StreamingPoet:
+    """Poet for Engine.respond_text: starts a PoemStream and leaves ``SLOT`` in the response.
+
+    ``stream`` is this session's StreamReader. With a ``cache``, it reads from
+    ``cache.stream`` (a cached or prefetched poem when there is one);
+    ``context`` carries the inputs the poet signature lacks (content_arc, tone,
+    condition).
+    """
+
+    SLOT = "\x00poem\x00"
+
+    def __init__(self, cache=None, context: dict = None, **stream_options):
+        self.cache = cache
+        self.context = context or {}
+        self.stream_options = stream_options
+        self.stream = None
+        self.cache_result = None   # hit | miss, when a cache is used
+
+    def __call__(self, topic: str, attempt: int, error_type: str) -> str:
+        if self.cache is None:
+            self.stream = PoemStream(topic, attempt, error_type, content_arc=self.context.get('content_arc'),
+                                     tone=self.context.get('tone'), **self.stream_options).reader()
+        else:
+            self.stream, hit = self.cache.stream(topic, attempt, error_type, **self.context, **self.stream_options)
+            self.cache_result = "hit" if hit else "miss"
+        return self.SLOT
+
+
+def streaming_enabled() -> bool:
+    return BACKEND == "openai"
+
+
+# ---------------------------
+# Cache and prefetch
+# ---------------------------
+def _normalize(text) -> str:
+    return " ".join(str(text or "").lower().split()).strip(" .,;:!?'\"")
+
+
+def poem_key(topic: str, attempt: int, error_type: str, content_arc: str = None, tone: str = None,
+             condition: dict = None) -> tuple:
+    """Cache key: the normalized prompt inputs plus the condition the poem is shown under."""
+    condition = condition or {}
+    return (_normalize(topic), _normalize(content_arc), _normalize(tone), error_type, attempt,
+            condition.get('anthro_level'), condition.get('pov'))
+
+
+class _Entry:
+    __slots__ = ('stream', 'created', 'prefetched', 'used')   # the entry holds one reference on ``stream``
+
+    def __init__(self, stream, created: float, prefetched: bool):
+        self.stream = stream
+        self.created = created
+        self.prefetched = prefetched
+        self.used = False
+
+
+class GenerationCache:
+    """LRU of PoemStreams (finished or still running) with a TTL.
+
+    ``stream()`` returns a reader on an entry whose stream has not failed, else
+    starts one; ``prefetch()`` starts one nobody has asked for yet. An entry
+    holds a reference on its stream, so a session that cancels or times out
+    only detaches itself. A stream that ends in anything but "ok" is dropped
+    as soon as it finishes. A prefetched entry that is evicted or expires
+    unused counts as waste; dropping an entry cancels its worker once no reader
+    is left.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, clock=time.monotonic):
+        self.max_entries = CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()   # re-entered when a drop finishes a stream (on_finish)
+        self.hits = self.misses = 0
+        self.prefetched = self.prefetch_used = self.prefetch_wasted = 0
+        self.saved_seconds = 0.0
+
+    def _usable(self, key, now):
+        """The live entry for ``key``, dropping it first if expired or failed. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry.created > self.ttl or entry.stream.outcome not in (None, "ok"):
+            self._drop(key)
+            return None
+        return entry
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        if entry.prefetched and not entry.used:
+            self.prefetch_wasted += 1
+            _count('shade_generation_prefetch_total', 'wasted')
+        entry.stream.release()
+
+    def _finished(self, key, entry, stream):
+        if stream.outcome == "ok":
+            return
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._drop(key)
+
+    def _insert(self, key, entry, now):
+        entry.stream.acquire()
+        self._entries[key] = entry
+        entry.stream.on_finish.append(lambda stream: self._finished(key, entry, stream))
+        if entry.stream.outcome not in (None, "ok"):
+            self._drop(key)   # failed before the callback was registered
+            return
+        for old in [k for k, e in self._entries.items() if now - e.created > self.ttl]:
+            self._drop(old)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def stream(self, topic: str, attempt: int, error_type: str, content_arc: str = None, tone: str = None,
+               condition: dict = None, **stream_options):
+        """Return ``(stream, hit)`` for these inputs."""
+        key = poem_key(topic, attempt, error_type, content_arc, tone, condition)
+        with self._lock:
+            now = self.clock()
+            entry = self._usable(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                _count('shade_generation_cache_lookups_total', 'hit')
+                stream = entry.stream
+                # What the participant did not have to wait for: the generation time already spent.
+                saved = stream.total if stream.total is not None else time.perf_counter() - stream.started
+                self.saved_seconds += saved
+                if metrics.ENABLED:
+                    metrics.registry.histogram('shade_generation_saved_seconds').observe(saved)
+                if entry.prefetched and not entry.used:
+                    self.prefetch_used += 1
+                    _count('shade_generation_prefetch_total', 'used')
+                entry.used = True
+                return stream.reader(**_reader_options(stream_options)), True
+            self.misses += 1
+            _count('shade_generation_cache_lookups_total', 'miss')
+            stream = PoemStream(topic, attempt, error_type, content_arc=content_arc, tone=tone, **stream_options)
+            entry = _Entry(stream, now, prefetched=False)
+            entry.used = True
+            reader = stream.reader()
+            self._insert(key, entry, now)
+            return reader, False
+
+    def prefetch(self, topic: str, attempt: int, error_type: str, content_arc: str = None, tone: str = None,
+                 condition: dict = None, **stream_options) -> bool:
+        """Start generating in the background unless a usable entry exists. True if one was started."""
+        key = poem_key(topic, attempt, error_type, content_arc, tone, condition)
+        with self._lock:
+            now = self.clock()
+            if self._usable(key, now) is not None:
+                return False
+            stream = PoemStream(topic, attempt, error_type, content_arc=content_arc, tone=tone, **stream_options)
+            self._insert(key, _Entry(stream, now, prefetched=True), now)
+            self.prefetched += 1
+            _count('shade_generation_prefetch_total', 'started')
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self.clock()
+            for key in [k for k, e in self._entries.items() if now - e.created > self.ttl]:
+                self._drop(key)
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "prefetched": self.prefetched,
+                "prefetch_used": self.prefetch_used,
+                "prefetch_wasted": self.prefetch_wasted,
+                "saved_seconds": self.saved_seconds,
+            }
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+
+def _reader_options(stream_options: dict) -> dict:
+    return {k: stream_options[k] for k in ('first_token_timeout', 'timeout') if k in stream_options}
+
+
+def _count(metric: str, result: str):
+    if metrics.ENABLED:
+        metrics.registry.counter(metric, result).inc()
+
+
+cache = GenerationCache()
+
+
+def prefetch_for(state: dict, cache: GenerationCache = cache, **stream_options) -> list:
+    """Start the poems the participant's next turn can ask for. Returns the attempts started.
+
+    At step 4 the topic, content_arc and tone are all known and "yes" (or a
+    redirect) will need draft 0; at step 5 a draft is on screen and any reply
+    asks for revision ``poem_attempts + 1``.
+    """
+    if not PREFETCH or not streaming_enabled():
+        return []
+    study_state = state['study_state']
+    if study_state.get('ended_by_user') or not study_state.get('topic'):
+        return []
+    if state['step'] == 4:
+        attempt = 0
+    elif state['step'] == 5:
+        attempt = study_state['poem_attempts'] + 1
+    else:
+        return []
+    started = cache.prefetch(study_state['topic'], attempt, study_state['error_type'],
+                             study_state.get('content_arc'), study_state.get('tone'), state['condition'],
+                             **stream_options)
+    return [attempt] if started else []
+
+
+def poem_context(state: dict) -> dict:
+    """StreamingPoet ``context`` for a conversation state."""
+    study_state = state['study_state']
+    return {'content_arc': study_state.get('content_arc'), 'tone': study_state.get('tone'),
+            'condition': state['condition']}
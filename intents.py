@@ -0,0 +1,164 @@
+# intents.py - declarative intent table for the conversation policy
+"""Which intent a user message expresses at each step, and where it leads.
+
+``INTENTS`` lists, per step, the intents in priority order. An intent fires when
+the message contains any of its ``keywords``, or every one of its
+``all_keywords``, or (keyword-free intents) when the stripped message is at least
+``min_len`` characters. Keywords are whole-word phrases, so "pending" no longer
+reads as "end" and "already" not as "ready".
+
+At import every step's phrases are compiled into one regex, factored as a
+character trie ("end(?:ed|ing|s)?|study") so each position of the message costs
+one branch test per distinct first letter. ``match`` lowercases the message and
+skips the regex when it holds none of the step's anchor words (a plain ``in``
+test each) or is itself one keyword; otherwise it finds every phrase in one
+scan. It then picks the first intent in priority order whose phrases were found
+and returns ``(intent, next_step)``.
+"""
+import re
+from collections import namedtuple
+
+Intent = namedtuple('Intent', 'name next_step keywords all_keywords min_len')
+
+
+def intent(name, next_step, keywords=(), all_keywords=(), min_len=None):
+    return Intent(name, next_step, tuple(keywords), tuple(all_keywords), min_len)
+
+
+# Checked before the step's own intents; next_step None keeps the current step.
+GLOBAL_INTENTS = [
+    intent('end_study', None, all_keywords=[('end', 'ends', 'ended', 'ending'), ('study',)]),
+]
+
+INTENTS = {
+    0: [intent('start', 1, keywords=['ready', 'start', 'begin', 'yes', 'poem', 'poems']),
+        intent('long_input', 1, min_len=7)],
+    1: [intent('topic', 2, min_len=1)],
+    2: [intent('content_arc', 3, min_len=1)],
+    3: [intent('tone', 4, min_len=1),
+        intent('tone_default', 3, min_len=0)],
+    4: [intent('confirm', 5, keywords=['yes', 'continue', 'proceed', 'go ahead']),
+        intent('redirect', 4, keywords=['poem on', 'poem about'])],
+    5: [intent('ten_lines', 5, keywords=['10 lines', 'ten lines', '10lines', 'tenlines']),
+        intent('revise', 5, min_len=0)],
+}
+
+# Everything that is not part of a word becomes a separator.
+_SEPARATOR_CHARS = "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~‘’“”—–…"
+_SEPARATORS = str.maketrans({c: ' ' for c in _SEPARATOR_CHARS})
+_WORD_CHAR = r"[^\s" + re.escape(_SEPARATOR_CHARS) + "]"
+_GAP = r"[\s" + re.escape(_SEPARATOR_CHARS) + "]+"
+_IS_WORD_CHAR = re.compile(_WORD_CHAR).match
+
+
+def tokenize(text: str) -> list:
+    return text.lower().translate(_SEPARATORS).split()
+
+
+def _trie_pattern(phrases) -> str:
+    """A regex matching exactly ``phrases``, with shared prefixes factored out.
+
+    Alternatives stay plain literals (no groups, no lookbehind) so re keeps its
+    first-character prefilter; a space in a phrase matches any run of separators.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[''] = {}    # a phrase ends here
+
+    def emit(node):
+        alternatives = [(_GAP if ch == ' ' else re.escape(ch)) + emit(child)
+                        for ch, child in sorted(node.items()) if ch]
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+        if '' not in node:
+            return body
+        return f"(?:{body})?" if len(alternatives) == 1 and len(body) > 1 else body + '?'
+
+    return emit(trie)
+
+
+class CompiledStep:
+    """One trie-factored regex over every keyword an intent at this step can use."""
+
+    def __init__(self, intents):
+        phrases = []
+        for it in intents:
+            for phrase in list(it.keywords) + [p for group in it.all_keywords for p in group]:
+                if phrase not in phrases:
+                    phrases.append(phrase)
+        self.phrases = frozenset(phrases)
+        self.pattern = re.compile(f"(?:{_trie_pattern(phrases)})(?!{_WORD_CHAR})") if phrases else None
+        # No intent can fire unless the message contains one of these literals: the first word of
+        # each any-of keyword, and of each phrase in one group of every all-of intent (the group
+        # whose shortest word is longest, "study" rather than "end"). Messages with none of them
+        # skip the regex for a couple of `in` tests.
+        needed = [p for it in intents for p in it.keywords]
+        for it in intents:
+            if it.all_keywords:
+                needed.extend(max(it.all_keywords, key=lambda group: min(len(p.split()[0]) for p in group)))
+        words = {p.split()[0] for p in needed}
+        self.anchors = tuple(sorted(w for w in words if not any(a != w and a in w for a in words)))
+        # (name, next_step, any-of phrases, all-of phrase groups, min_len) in priority order
+        self.rules = [(it.name, it.next_step, frozenset(it.keywords),
+                       tuple(frozenset(group) for group in it.all_keywords), it.min_len)
+                      for it in intents]
+        # With no phrase present only the keyword-free rules can fire; their results are built once.
+        self.length_rules = [(min_len, (name, next_step)) for name, next_step, any_of, all_of, min_len in self.rules
+                             if not any_of and not all_of]
+
+    def phrases_in(self, lower: str, m) -> set:
+        """Every phrase occurring as whole words in ``lower``, scanning on from match ``m``."""
+        found = set()
+        search = self.pattern.search
+        while m is not None:
+            start = m.start()
+            if not start or not _IS_WORD_CHAR(lower, start - 1):    # not e.g. "ready" in "already"
+                phrase = m.group()
+                found.add(phrase if phrase in self.phrases else " ".join(tokenize(phrase)))
+            m = search(lower, m.end())
+        return found
+
+
+_COMPILED = {step: CompiledStep(GLOBAL_INTENTS + intents) for step, intents in INTENTS.items()}
+_GLOBAL_ONLY = CompiledStep(GLOBAL_INTENTS)
+
+
+def match(text: str, step: int):
+    """Return ``(intent_name, next_step)`` for a user message at ``step``."""
+    # The body lives here rather than in a CompiledStep method: one Python call per turn, not two.
+    compiled = _COMPILED.get(step, _GLOBAL_ONLY)
+    lower = text.lower()
+    found = None
+    for anchor in compiled.anchors:
+        if anchor in lower:
+            reply = lower.strip()
+            if reply in compiled.phrases:    # the whole message is one keyword ("ready", "yes")
+                found = {reply}
+            else:
+                m = compiled.pattern.search(lower)
+                if m is not None:
+                    found = compiled.phrases_in(lower, m)
+            break
+    if found:
+        for name, next_step, any_of, all_of, min_len in compiled.rules:
+            if any_of:
+                if not any_of.isdisjoint(found):
+                    return name, step if next_step is None else next_step
+            elif all_of:
+                for group in all_of:
+                    if group.isdisjoint(found):
+                        break
+                else:
+                    return name, step if next_step is None else next_step
+            elif len(text.strip()) >= min_len:
+                return name, next_step
+        return 'fallback', step
+    length = len(text.strip())
+    for min_len, result in compiled.length_rules:
+        if length >= min_len:
+            return result
+    return 'fallback', step
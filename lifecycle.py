@@ -0,0 +1,164 @@
+# lifecycle.py - idle-session tracking, abandoned-session flush and eviction
+"""Keep server memory bounded on long study runs.
+
+Every script run calls ``touch(session_id, flush, evict)``. A background
+sweep every ``SHADE_REAP_INTERVAL`` seconds looks for sessions with no
+activity for ``SHADE_SESSION_TIMEOUT`` seconds. For each one it calls
+``flush()``, which writes the ``status: "abandoned"`` snapshot. Sessions that
+were marked ``finish``-ed (final feedback submitted) skip the flush. Then it
+calls ``evict()``, which releases the in-memory state. A flush that raises is
+retried on the next sweep, up to ``MAX_FLUSH_ATTEMPTS`` times, before the
+session is evicted anyway.
+
+``counts()`` reports sessions that are live (active within
+``SHADE_SESSION_IDLE_AFTER`` seconds), idle (tracked but quiet) and reaped so
+far. With SHADE_METRICS on they are also exported as ``shade_sessions`` and
+``shade_sessions_reaped_total``.
+
+Streamlit-free: the app supplies ``flush`` and ``evict`` (see
+streamlit_app.track_session).
+"""
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+IDLE_AFTER = float(os.environ.get("SHADE_SESSION_IDLE_AFTER", "120"))
+TIMEOUT = float(os.environ.get("SHADE_SESSION_TIMEOUT", "1800"))
+REAP_INTERVAL = float(os.environ.get("SHADE_REAP_INTERVAL", "60"))
+MAX_FLUSH_ATTEMPTS = 3
+
+log = logging.getLogger("shade.lifecycle")
+
+
+class _Tracked:
+    __slots__ = ('last_seen', 'flush', 'evict', 'finished', 'attempts')
+
+    def __init__(self, last_seen: float):
+        self.last_seen = last_seen
+        self.flush = None
+        self.evict = None
+        self.finished = False
+        self.attempts = 0
+
+
+class SessionReaper:
+    """Last-activity table plus the sweep that flushes and evicts idle sessions."""
+
+    def __init__(self, timeout: float = TIMEOUT, idle_after: float = IDLE_AFTER, interval: float = REAP_INTERVAL,
+                 clock=time.monotonic):
+        self.timeout = timeout
+        self.idle_after = idle_after
+        self.interval = interval
+        self.clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reaped = {'abandoned': 0, 'finished': 0}
+        self.flush_errors = 0
+
+    def touch(self, session_id: str, flush=None, evict=None):
+        """Record activity; ``flush``/``evict`` replace the ones given before when passed."""
+        with self._lock:
+            t = self._sessions.get(session_id)
+            if t is None:
+                t = self._sessions[session_id] = _Tracked(self.clock())
+            else:
+                t.last_seen = self.clock()
+            if flush is not None:
+                t.flush = flush
+            if evict is not None:
+                t.evict = evict
+
+    def finish(self, session_id: str):
+        """The session ended normally: evict it when idle, but don't mark it abandoned."""
+        with self._lock:
+            t = self._sessions.get(session_id)
+            if t is not None:
+                t.finished = True
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def reap(self, now: float = None) -> list:
+        """One sweep. Returns the ids evicted."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            due = [(sid, t) for sid, t in self._sessions.items() if now - t.last_seen >= self.timeout]
+            for sid, _ in due:
+                del self._sessions[sid]
+        evicted = []
+        for sid, t in due:
+            if not t.finished and t.flush is not None:
+                try:
+                    t.flush()
+                except Exception:
+                    self.flush_errors += 1
+                    t.attempts += 1
+                    log.exception("abandoned flush failed for %s (attempt %d)", sid, t.attempts)
+                    if t.attempts < MAX_FLUSH_ATTEMPTS:
+                        with self._lock:
+                            # Retry next sweep unless the participant came back meanwhile.
+                            self._sessions.setdefault(sid, t)
+                        continue
+            if t.evict is not None:
+                try:
+                    t.evict()
+                except Exception:
+                    log.exception("evicting %s failed", sid)
+            outcome = 'finished' if t.finished else 'abandoned'
+            self.reaped[outcome] += 1
+            if metrics.ENABLED:
+                metrics.registry.counter('shade_sessions_reaped_total', outcome).inc()
+            log.info("reaped %s session %s after %.0fs idle", outcome, sid, now - t.last_seen)
+            evicted.append(sid)
+        return evicted
+
+    def counts(self) -> dict:
+        now = self.clock()
+        with self._lock:
+            idle = sum(1 for t in self._sessions.values() if now - t.last_seen >= self.idle_after)
+            tracked = len(self._sessions)
+        return {'live': tracked - idle, 'idle': idle, 'reaped': sum(self.reaped.values()),
+                'abandoned': self.reaped['abandoned'], 'flush_errors': self.flush_errors}
+
+    def start(self):
+        """Run ``reap`` every ``interval`` seconds on a daemon thread (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="shade-session-reaper", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reap()
+            except Exception:
+                log.exception("session sweep failed")
+
+    def stop(self):
+        self._stop.set()
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def reaper() -> SessionReaper:
+    """The process-wide reaper, started on first use."""
+    global _reaper
+    if _reaper is None:
+        with _reaper_lock:
+            if _reaper is None:
+                r = SessionReaper()
+                r.start()
+                if metrics.ENABLED:
+                    for state in ('live', 'idle'):
+                        metrics.registry.gauge('shade_sessions', state, lambda s=state: r.counts()[s])
+                _reaper = r
+    return _reaper
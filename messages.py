@@ -0,0 +1,273 @@
+# messages.py - compact, column-backed chat transcript
+"""The chat transcript kept in ``st.session_state.messages``.
+
+A session holds a few hundred messages that are only ever appended. Held as
+plain dicts, each one also carries an ISO-8601 timestamp string and a
+reference to (after a JSON round trip, a copy of) the condition dict.
+``Transcript`` stores them as columns instead:
+
+- role, step, condition id and timestamp in ``array`` columns (timestamps as
+  integer microseconds since the epoch)
+- the condition dicts once per session, in ``conditions``
+- content strings in one list, and the rare extra keys (``trace``,
+  ``generation``) in a sparse dict
+
+Indexing, slicing and iteration return ``Message`` records (``__slots__``).
+They read like the old dicts (``m["content"]``, ``m.get("trace")``) and turn
+back into them with ``to_json()``. ``Transcript.to_json()`` is today's layout,
+byte for byte once dumped. ``json_default`` lets ``json.dump`` write either, so
+the storage backends keep their JSON unchanged. ``encode``/``decode`` is a
+compact on-disk form: zlib over the columns.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+ROLES = ("user", "assistant")
+_ROLE_CODES = {r: i for i, r in enumerate(ROLES)}
+_FIXED = ("ts", "role", "step", "condition", "content")
+_NO_TS = -(2 ** 63)
+_NO_STEP = -(2 ** 15)
+_EPOCH = datetime(1970, 1, 1)
+_MAGIC = b"SHMSG1\n"
+_MISSING = object()
+
+
+def iso_to_us(ts: str) -> int:
+    """``utc_now()`` string -> microseconds since the epoch."""
+    return (datetime.fromisoformat(ts[:-1]) - _EPOCH) // timedelta(microseconds=1)
+
+
+def us_to_iso(us: int) -> str:
+    """The inverse of ``iso_to_us``, in ``datetime.isoformat() + 'Z'`` form."""
+    return (_EPOCH + timedelta(microseconds=us)).isoformat() + "Z"
+
+
+def json_default(obj):
+    """``json.dump(default=...)`` hook for Transcript and Message."""
+    to_json = getattr(obj, "to_json", None)
+    if to_json is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_json()
+
+
+class Message:
+    """One transcript entry, read-only, with the dict-style reads the app uses."""
+
+    __slots__ = ("role", "step", "ts_us", "condition", "content", "extra", "raw")
+
+    def __init__(self, role, step, ts_us, condition, content, extra=None, raw=None):
+        self.role = role
+        self.step = step
+        self.ts_us = ts_us
+        self.condition = condition
+        self.content = content
+        self.extra = extra
+        self.raw = raw
+
+    def get(self, key, default=None):
+        if self.raw is not None:
+            return self.raw.get(key, default)
+        if key == "content":
+            return self.content
+        if key == "role":
+            return self.role
+        if key == "step":
+            return self.step
+        if key == "ts":
+            if self.ts_us is not None:
+                return us_to_iso(self.ts_us)
+            return self.extra.get("ts", default) if self.extra else default
+        if key == "condition":
+            return default if self.condition is None else self.condition
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def to_json(self) -> dict:
+        """The message as the dict engine.Engine builds, in the same key order."""
+        if self.raw is not None:
+            return dict(self.raw)
+        extra = self.extra or {}
+        out = {"ts": us_to_iso(self.ts_us) if self.ts_us is not None else extra.get("ts"),
+               "role": self.role, "step": self.step}
+        if self.condition is not None:
+            out["condition"] = self.condition
+        out["content"] = self.content
+        for key, value in extra.items():
+            if key != "ts":
+                out[key] = value
+        return out
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            other = other.to_json()
+        return self.to_json() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Message({self.to_json()!r})"
+
+
+class Transcript:
+    """Append-only list of messages stored column-wise."""
+
+    def __init__(self, messages=()):
+        self.conditions = []        # each distinct condition dict, once
+        self._condition_ids = {}
+        self._roles = array("b")
+        self._steps = array("h")
+        self._conds = array("h")
+        self._ts = array("q")
+        self._contents = []
+        self._extra = {}            # index -> {key: value} beyond the fixed fields
+        self._raw = {}              # index -> dict, for messages that don't fit the columns
+        self._last_condition = None
+        for m in messages:
+            self.append(m)
+
+    def _condition_id(self, condition) -> int:
+        # The app passes the same condition dict every turn; skip the lookup then.
+        if self._last_condition is not None and self._last_condition[0] is condition:
+            return self._last_condition[1]
+        key = json.dumps(condition, sort_keys=True)
+        cid = self._condition_ids.get(key)
+        if cid is None:
+            cid = self._condition_ids[key] = len(self.conditions)
+            self.conditions.append(condition)
+        self._last_condition = (condition, cid)
+        return cid
+
+    def append(self, msg):
+        """Add a message (a dict in the engine's layout, or a Message)."""
+        if isinstance(msg, Message):
+            msg = msg.to_json()
+        i = len(self._contents)
+        role, step, ts = msg.get("role"), msg.get("step"), msg.get("ts")
+        keys = [k for k in msg if k in _FIXED]
+        expected = ["ts", "role", "step", "content"] if "condition" not in msg else list(_FIXED)
+        extra = {k: v for k, v in msg.items() if k not in _FIXED}
+        ts_us = None
+        if isinstance(ts, str) and ts.endswith("Z"):
+            try:
+                ts_us = iso_to_us(ts)
+            except ValueError:
+                pass
+            if ts_us is not None and us_to_iso(ts_us) != ts:
+                ts_us = None
+        fits = (keys == expected and role in _ROLE_CODES and isinstance(msg.get("content"), str)
+                and (isinstance(step, int) and -2 ** 15 < step < 2 ** 15)
+                and (ts_us is not None or ts is None) and list(msg)[:len(keys)] == keys)
+        self._contents.append(msg.get("content") if fits else None)
+        if not fits:
+            # Anything off the usual shape is kept verbatim so to_json stays exact.
+            self._raw[i] = dict(msg)
+            self._roles.append(-1)
+            self._steps.append(_NO_STEP)
+            self._conds.append(-1)
+            self._ts.append(_NO_TS)
+            return
+        self._roles.append(_ROLE_CODES[role])
+        self._steps.append(step)
+        self._conds.append(self._condition_id(msg["condition"]) if "condition" in msg else -1)
+        self._ts.append(_NO_TS if ts_us is None else ts_us)
+        if ts is None:
+            extra = dict(extra, ts=None)
+        if extra:
+            self._extra[i] = extra
+
+    def __len__(self):
+        return len(self._contents)
+
+    def _message(self, i: int) -> Message:
+        raw = self._raw.get(i)
+        if raw is not None:
+            return Message(raw.get("role"), raw.get("step"), None, None, raw.get("content"), raw=raw)
+        cid = self._conds[i]
+        ts = self._ts[i]
+        return Message(ROLES[self._roles[i]], self._steps[i], None if ts == _NO_TS else ts,
+                       self.conditions[cid] if cid >= 0 else None, self._contents[i], self._extra.get(i))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._message(k) for k in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("transcript index out of range")
+        return self._message(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._message(i)
+
+    def to_json(self, start: int = 0) -> list:
+        """Messages from ``start`` on, in today's JSON layout."""
+        return [self._message(i).to_json() for i in range(start, len(self))]
+
+    @classmethod
+    def from_json(cls, messages: list) -> "Transcript":
+        return cls(messages)
+
+    # ---------------------------
+    # Compact encoding
+    # ---------------------------
+    def encode(self, level: int = 6) -> bytes:
+        """Columns, content lengths and blob, plus a JSON side table, under zlib."""
+        contents = [c.encode("utf-8") if c is not None else b"" for c in self._contents]
+        lengths = array("I", (len(c) for c in contents))
+        side = json.dumps({"conditions": self.conditions,
+                           "extra": {str(k): v for k, v in self._extra.items()},
+                           "raw": {str(k): v for k, v in self._raw.items()}},
+                          separators=(",", ":")).encode("utf-8")
+        columns = [self._roles, self._steps, self._conds, self._ts, lengths]
+        if sys.byteorder != "little":
+            columns = [array(c.typecode, c) for c in columns]
+            for c in columns:
+                c.byteswap()
+        body = b"".join([struct.pack("<II", len(self), len(side)), side] +
+                        [c.tobytes() for c in columns] + contents)
+        return _MAGIC + zlib.compress(body, level)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Transcript":
+        if not data.startswith(_MAGIC):
+            raise ValueError("not an encoded transcript")
+        body = zlib.decompress(data[len(_MAGIC):])
+        n, side_len = struct.unpack_from("<II", body, 0)
+        pos = 8
+        side = json.loads(body[pos:pos + side_len])
+        pos += side_len
+        t = cls()
+        columns = []
+        for typecode in ("b", "h", "h", "q", "I"):
+            col = array(typecode)
+            size = col.itemsize * n
+            col.frombytes(body[pos:pos + size])
+            if sys.byteorder != "little":
+                col.byteswap()
+            columns.append(col)
+            pos += size
+        t._roles, t._steps, t._conds, t._ts, lengths = columns
+        for length in lengths:
+            t._contents.append(body[pos:pos + length].decode("utf-8"))
+            pos += length
+        t.conditions = side["conditions"]
+        t._condition_ids = {json.dumps(c, sort_keys=True): i for i, c in enumerate(t.conditions)}
+        t._extra = {int(k): v for k, v in side["extra"].items()}
+        t._raw = {int(k): v for k, v in side["raw"].items()}
+        for k in t._raw:
+            t._contents[k] = None
+        return t
@@ -0,0 +1,365 @@
+# metrics.py - per-turn latency spans, in-process histograms, Prometheus text export
+"""Hot-path timing for a chat turn (render, log_user, save_data, get_response,
+send_assistant).
+
+Enabled with ``SHADE_METRICS=1``. When it is off, ``span``, ``begin_turn``,
+``end_turn`` and ``current_trace`` are bound to no-op functions (see
+``configure``), so a call site costs one call and never checks a flag:
+nothing is timed, allocated or locked.
+
+- ``span(name)`` times a block into the ``shade_span_seconds{span=...}``
+  histogram, and into the current turn when one is open on this thread
+  (Streamlit runs each session's script on its own thread).
+- ``begin_turn()`` / ``end_turn()`` bracket one script run; runs that handled a
+  user message also go into ``shade_turn_seconds``.
+- ``current_trace()`` returns the open turn's spans so far, for attaching to
+  the session record (``SHADE_TRACE=1``).
+
+Export: ``prometheus_text()``; ``start_exporter()`` serves it on
+``SHADE_METRICS_HOST``:``SHADE_METRICS_PORT`` (/metrics; the host defaults to
+127.0.0.1, so study metrics stay local unless opened up) and/or rewrites
+``SHADE_METRICS_FILE`` every ``SHADE_METRICS_INTERVAL`` seconds (node_exporter
+textfile collector).
+
+Overhead budget: ``OVERHEAD_BUDGET_US`` per turn with instrumentation enabled;
+``benchmarks/bench_metrics.py`` checks it.
+"""
+import atexit
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("SHADE_METRICS", "0").lower() in ("1", "true", "on", "yes")
+TRACE_SESSIONS = ENABLED and os.environ.get("SHADE_TRACE", "0").lower() in ("1", "true", "on", "yes")
+METRICS_HOST = os.environ.get("SHADE_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("SHADE_METRICS_PORT", "0") or 0)
+METRICS_FILE = os.environ.get("SHADE_METRICS_FILE", "")
+METRICS_INTERVAL = float(os.environ.get("SHADE_METRICS_INTERVAL", "15"))
+
+OVERHEAD_BUDGET_US = 25.0
+
+# Seconds; fine at the low end where journal appends and intent matching live.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+# ---------------------------
+# Histograms
+# ---------------------------
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense.
+
+    ``observe`` only appends to a deque (atomic, no lock); samples are folded
+    into the bucket counts in batches and whenever a snapshot is taken.
+    """
+
+    FOLD_EVERY = 1024
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= self.FOLD_EVERY:
+            self._fold()
+
+    def _fold(self):
+        with self._lock:
+            pending, buckets, counts = self._pending, self.buckets, self.counts
+            while True:
+                try:
+                    value = pending.popleft()
+                except IndexError:
+                    break
+                counts[bisect.bisect_left(buckets, value)] += 1
+                self.sum += value
+                self.count += 1
+
+    def snapshot(self):
+        self._fold()
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Counter:
+    """Monotonic total; ``inc`` takes the lock, so keep it off per-span paths."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}   # (metric, label value or None) -> Histogram
+        self._counters = {}     # (metric, label value or None) -> Counter
+        self._gauges = {}       # (metric, label value or None) -> zero-argument callable
+        self._lock = threading.Lock()
+
+    def histogram(self, metric: str, label: str = None) -> Histogram:
+        key = (metric, label)
+        h = self._histograms.get(key)
+        if h is None:
+            with self._lock:
+                h = self._histograms.setdefault(key, Histogram())
+        return h
+
+    def counter(self, metric: str, label: str = None) -> Counter:
+        key = (metric, label)
+        c = self._counters.get(key)
+        if c is None:
+            with self._lock:
+                c = self._counters.setdefault(key, Counter())
+        return c
+
+    def gauge(self, metric: str, label: str = None, read=None):
+        """Register ``read()`` as the current value of a gauge, sampled at export."""
+        with self._lock:
+            self._gauges[(metric, label)] = read
+
+    def items(self):
+        with self._lock:
+            return sorted(self._histograms.items(), key=lambda kv: (kv[0][0], kv[0][1] or ''))
+
+    def counter_items(self):
+        with self._lock:
+            return sorted(self._counters.items(), key=lambda kv: (kv[0][0], kv[0][1] or ''))
+
+    def gauge_items(self):
+        with self._lock:
+            return sorted(self._gauges.items(), key=lambda kv: (kv[0][0], kv[0][1] or ''))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+        _span_histograms.clear()
+
+
+registry = Registry()
+
+HELP = {
+    'shade_span_seconds': "Time spent in one instrumented step of a chat turn.",
+    'shade_turn_seconds': "Wall time of a script run that handled a user message.",
+    'shade_generation_ttft_seconds': "Time to first streamed token of a generated poem.",
+    'shade_generation_seconds': "Total time of a poem generation, by outcome.",
+    'shade_generation_saved_seconds': "Generation time already spent when a cached or prefetched poem was used.",
+    'shade_generation_cache_lookups_total': "Poem requests answered from the generation cache (hit) or not (miss).",
+    'shade_generation_prefetch_total': "Speculative poem generations: started, used, or wasted (evicted unused).",
+    'shade_sessions': "Tracked study sessions, live or idle.",
+    'shade_sessions_reaped_total': "Idle sessions flushed and evicted, by whether they were abandoned or finished.",
+}
+LABEL_NAMES = {'shade_span_seconds': 'span', 'shade_generation_seconds': 'outcome',
+               'shade_generation_cache_lookups_total': 'result', 'shade_generation_prefetch_total': 'result',
+               'shade_sessions': 'state', 'shade_sessions_reaped_total': 'outcome'}
+
+
+def prometheus_text() -> str:
+    lines = []
+    seen = set()
+    for (metric, value), h in registry.items():
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+        counts, total, count = h.snapshot()
+        label = f'{LABEL_NAMES.get(metric, "label")}="{value}",' if value else ''
+        cumulative = 0
+        for bound, n in zip(h.buckets, counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{{label}le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{label}le="+Inf"}} {count}')
+        suffix = f'{{{label[:-1]}}}' if label else ''
+        lines.append(f'{metric}_sum{suffix} {total:.9f}')
+        lines.append(f'{metric}_count{suffix} {count}')
+    for (metric, value), c in registry.counter_items():
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} counter")
+        label = f'{{{LABEL_NAMES.get(metric, "label")}="{value}"}}' if value else ''
+        lines.append(f'{metric}{label} {c.value:g}')
+    for (metric, value), read in registry.gauge_items():
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} gauge")
+        label = f'{{{LABEL_NAMES.get(metric, "label")}="{value}"}}' if value else ''
+        lines.append(f'{metric}{label} {read():g}')
+    return '\n'.join(lines) + '\n'
+
+
+# ---------------------------
+# Spans and turns
+# ---------------------------
+_local = threading.local()
+
+
+class Turn:
+    __slots__ = ('started', 'spans')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []   # (name, seconds) in completion order
+
+
+class _Span:
+    __slots__ = ('name', 'hist', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hist = _span_histograms.get(name) or _span_histogram(name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.hist.observe(elapsed)
+        turn = getattr(_local, 'turn', None)
+        if turn is not None:
+            turn.spans.append((self.name, elapsed))
+        return False
+
+
+class _NullSpan:
+    """Shared no-op span. ``with`` looks these up on the type and calls them
+    unbound: a C builtin for ``__enter__`` and a static ``__exit__`` skip the
+    method binding, which is most of what an empty ``with`` costs."""
+    __slots__ = ()
+    __enter__ = tuple
+    __exit__ = staticmethod(lambda exc_type, exc, tb: None)
+
+
+_NULL_SPAN = _NullSpan()
+_span_histograms = {}
+
+
+def _span_histogram(name: str) -> Histogram:
+    h = _span_histograms[name] = registry.histogram('shade_span_seconds', name)
+    return h
+
+
+def _span(name: str):
+    """Context manager timing ``name``."""
+    return _Span(name)
+
+
+def _begin_turn():
+    turn = _local.turn = Turn()
+    return turn
+
+
+def _end_turn(turn, handled_input: bool):
+    if turn is None:
+        return
+    if getattr(_local, 'turn', None) is turn:
+        _local.turn = None
+    if handled_input:
+        registry.histogram('shade_turn_seconds').observe(time.perf_counter() - turn.started)
+
+
+def _current_trace():
+    """The open turn's spans so far as [name, ms] pairs, or None."""
+    turn = getattr(_local, 'turn', None)
+    if turn is None:
+        return None
+    return [[name, round(seconds * 1000, 3)] for name, seconds in turn.spans]
+
+
+def _null_span(name: str):
+    return _NULL_SPAN
+
+
+def _null_begin_turn():
+    return None
+
+
+def _null_end_turn(turn, handled_input: bool):
+    pass
+
+
+def _null_trace():
+    return None
+
+
+def configure(enabled: bool, trace: bool = False):
+    """Switch instrumentation on or off by rebinding ``span``, ``begin_turn``,
+    ``end_turn`` and ``current_trace``. Import calls it with ``SHADE_METRICS``
+    and ``SHADE_TRACE``; call sites must look them up as ``metrics.span``.
+    """
+    global ENABLED, TRACE_SESSIONS, span, begin_turn, end_turn, current_trace
+    ENABLED, TRACE_SESSIONS = enabled, enabled and trace
+    span = _span if enabled else _null_span
+    begin_turn = _begin_turn if enabled else _null_begin_turn
+    end_turn = _end_turn if enabled else _null_end_turn
+    current_trace = _current_trace if TRACE_SESSIONS else _null_trace
+
+
+configure(ENABLED, TRACE_SESSIONS)
+
+
+# ---------------------------
+# Export
+# ---------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def dump(path: str):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+
+def start_exporter(port: int = METRICS_PORT, path: str = METRICS_FILE, interval: float = METRICS_INTERVAL,
+                   host: str = METRICS_HOST):
+    """Start the /metrics server and/or periodic file dump once per process."""
+    global _exporter_started
+    if not ENABLED or _exporter_started:
+        return
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+        if port:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="shade-metrics-http", daemon=True).start()
+        if path:
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    dump(path)
+            threading.Thread(target=loop, name="shade-metrics-dump", daemon=True).start()
+            atexit.register(dump, path)
@@ -0,0 +1,423 @@
+# rhyme.py - phonetic rhyme index and poem validator
+"""Rhymes from pronunciations instead of spelling, and a validator that scores
+poems against the task banner (10 lines, 5 rhyming pairs, English only).
+
+The pronunciation table is CMUdict format (``WORD  PH1 PH2 ...``, ARPAbet with
+stress digits). ``SHADE_PRONUNCIATIONS`` points at it; the default is the
+bundled ``pronunciations.dict`` (the study's vocabulary). A full cmudict.dict
+works unchanged. ``build_index`` precomputes it into ``SHADE_RHYME_INDEX`` (default
+``.rhyme_index.bin`` in the data directory):
+
+    header | uint64 word hashes (sorted) | uint32 rhyme-key ids | key offsets | key bytes
+
+``RhymeIndex`` memory-maps that file. A single lookup is a bisect over the
+hashes. A batch lookup is one ``numpy.searchsorted``. The index is rebuilt
+when the table's size or mtime changes.
+
+Two words rhyme when their rhyme keys match. The key runs from the last
+stressed vowel to the end, without stress marks (``night`` -> ``AY T``). The
+phonetic comparison is only trusted when both words are in the table; if
+either is missing, the pair is compared on spelled rimes (``~ight``). The
+bundled table covers the study's vocabulary, not every word a poem ends on.
+
+Non-English tokens are words in a non-Latin script, known foreign words
+(``FOREIGN_WORDS``), and, when the table is a full dictionary, any word it
+lacks.
+
+    python rhyme.py build [--dict cmudict.dict]
+    python rhyme.py validate [--data-dir study_data] [--out labels.csv]
+"""
+import argparse
+import bisect
+import csv
+import functools
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+from archive import iter_sessions
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PRONUNCIATIONS = os.environ.get("SHADE_PRONUNCIATIONS", os.path.join(HERE, "pronunciations.dict"))
+INDEX_PATH = os.environ.get("SHADE_RHYME_INDEX",
+                            os.path.join(os.environ.get("SHADE_DATA_DIR", "study_data"), ".rhyme_index.bin"))
+
+# A table this large is treated as a whole dictionary: words it lacks count as non-English.
+COMPLETE_AT = 50000
+
+EXPECTED_LINES = 10
+EXPECTED_PAIRS = 5
+
+FOREIGN_WORDS = frozenset("""
+    bonjour merci amour adieu oui nuit soleil coeur cœur mer ciel belle toujours
+    hola gracias amor corazón noche cielo luna vida mar sol
+    ciao grazie bella notte cuore amore
+    danke liebe nacht herz himmel
+""".split())
+
+# Which error_type is meant to show up as which validator error.
+ERROR_LABELS = {"six_lines": "line_count", "non_rhyme": "rhyme", "foreign_token": "non_english"}
+
+_MAGIC = b"SHRHYME1"
+_HEADER = struct.Struct("<8sIIIIQQ")   # magic, words, keys, complete, reserved, source size, source mtime_ns
+_WORD = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+_APOSTROPHES = str.maketrans("’", "'")
+_VOWELS = frozenset("aeiouy")
+
+
+# ---------------------------
+# Rhyme keys
+# ---------------------------
+def word_hash(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def rhyme_key(phones) -> str:
+    """Phones from the last stressed vowel on, stress marks dropped."""
+    vowels = [i for i, p in enumerate(phones) if p[-1].isdigit()]
+    if not vowels:
+        return " ".join(phones)
+    for stress in "12":
+        stressed = [i for i in vowels if phones[i][-1] == stress]
+        if stressed:
+            start = stressed[-1]
+            break
+    else:
+        start = vowels[-1]
+    return " ".join(p.rstrip("012") for p in phones[start:])
+
+
+def spelled_rime(word: str) -> str:
+    """Fallback key: the last vowel group and what follows, past a silent final e."""
+    w = "".join(c for c in word.lower() if c.isalpha())
+    if not w:
+        return ""
+    base, tail = w, ""
+    if len(w) > 2 and w[-1] == "e" and w[-2] not in _VOWELS and any(c in _VOWELS for c in w[:-2]):
+        base, tail = w[:-1], "e"
+    i = len(base)
+    while i > 0 and base[i - 1] not in _VOWELS:
+        i -= 1
+    while i > 1 and base[i - 2] in _VOWELS:
+        i -= 1
+    return "~" + (base[i - 1:] if i else base) + tail
+
+
+def parse_pronunciations(path: str):
+    """Yield (word, phones), first pronunciation only, skipping comments."""
+    seen = set()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip() or line.startswith(";;;"):
+                continue
+            head, *phones = line.split("#", 1)[0].split()
+            word = head.lower()
+            if word.endswith(")") and "(" in word:
+                continue   # cmudict alternates: WORD(1)
+            if word in seen or not phones:
+                continue
+            seen.add(word)
+            yield word, phones
+
+
+# ---------------------------
+# Index
+# ---------------------------
+def build_index(source: str = None, out: str = None) -> dict:
+    """Compile ``source`` into the memory-mappable index at ``out``."""
+    source = source or PRONUNCIATIONS
+    out = out or INDEX_PATH
+    st = os.stat(source)
+    key_ids, entries = {}, []
+    for word, phones in parse_pronunciations(source):
+        entries.append((word_hash(word), key_ids.setdefault(rhyme_key(phones), len(key_ids))))
+    entries.sort()
+    keys = [k.encode("ascii") for k, _ in sorted(key_ids.items(), key=lambda kv: kv[1])]
+    offsets, pos = [], 0
+    for k in keys:
+        offsets.append(pos)
+        pos += len(k)
+    offsets.append(pos)
+    n = len(entries)
+    pad = b"\0" * (-4 * n % 8)
+    payload = b"".join([
+        _HEADER.pack(_MAGIC, n, len(keys), int(n >= COMPLETE_AT), 0, st.st_size, st.st_mtime_ns),
+        struct.pack(f"<{n}Q", *(h for h, _ in entries)),
+        struct.pack(f"<{n}I", *(k for _, k in entries)), pad,
+        struct.pack(f"<{len(offsets)}I", *offsets),
+        b"".join(keys),
+    ])
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    tmp = f"{out}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, out)
+    return {"words": n, "keys": len(keys), "bytes": len(payload), "path": out}
+
+
+class RhymeIndex:
+    """Read-only view over an index file (memory-mapped) or its bytes."""
+
+    def __init__(self, path: str = None, data=None):
+        if data is None:
+            with open(path or INDEX_PATH, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = data
+        magic, n, n_keys, complete, _, self.source_size, self.source_mtime_ns = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a rhyme index")
+        self.words, self.n_keys, self.complete = n, n_keys, bool(complete)
+        view = memoryview(data)
+        pos = _HEADER.size
+        self._hash_off = pos
+        self._hashes = view[pos:pos + 8 * n].cast("Q")
+        pos += 8 * n
+        self._ids_off = pos
+        self._ids = view[pos:pos + 4 * n].cast("I")
+        pos += 4 * n + (-4 * n % 8)
+        self._offsets = view[pos:pos + 4 * (n_keys + 1)].cast("I")
+        pos += 4 * (n_keys + 1)
+        self._keys = bytes(view[pos:pos + (self._offsets[n_keys] if n_keys else 0)]).decode("ascii")
+        self._np = None
+        # Poems reuse a small vocabulary; memoize single lookups per index.
+        self.key_id = functools.lru_cache(maxsize=65536)(self._lookup)
+
+    def __len__(self):
+        return self.words
+
+    def _lookup(self, word: str) -> int:
+        """Rhyme-key id of ``word``, or -1 when the table lacks it (``key_id`` is the cached form)."""
+        h = word_hash(word.lower().translate(_APOSTROPHES))
+        i = bisect.bisect_left(self._hashes, h)
+        if i < self.words and self._hashes[i] == h:
+            return self._ids[i]
+        return -1
+
+    def key_text(self, key_id: int) -> str:
+        return self._keys[self._offsets[key_id]:self._offsets[key_id + 1]]
+
+    def key(self, word: str) -> str:
+        """Phonetic rhyme key, or the spelled rime for words not in the table."""
+        k = self.key_id(word)
+        return self.key_text(k) if k >= 0 else spelled_rime(word)
+
+    def batch_key_ids(self, words):
+        """Rhyme-key ids for many words at once (numpy int64, -1 where missing)."""
+        import numpy as np
+
+        if not self.words:
+            return np.full(len(words), -1, np.int64)
+        if self._np is None:
+            self._np = (np.frombuffer(self._data, "<u8", self.words, self._hash_off),
+                        np.frombuffer(self._data, "<u4", self.words, self._ids_off).astype(np.int64))
+        hashes, ids = self._np
+        wanted = np.fromiter((word_hash(w.lower().translate(_APOSTROPHES)) for w in words), np.uint64, len(words))
+        pos = np.minimum(np.searchsorted(hashes, wanted), self.words - 1)
+        return np.where(hashes[pos] == wanted, ids[pos], -1)
+
+    def rhymes(self, a: str, b: str) -> bool:
+        ka, kb = self.key_id(a), self.key_id(b)
+        if ka >= 0 and kb >= 0:
+            return ka == kb
+        return spelled_rime(a) == spelled_rime(b)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def index() -> RhymeIndex:
+    """The shared index, (re)built from PRONUNCIATIONS when missing or stale."""
+    global _index
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None:
+            st = os.stat(PRONUNCIATIONS)
+            try:
+                idx = RhymeIndex(INDEX_PATH)
+                if (idx.source_size, idx.source_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    idx = None
+            except (OSError, ValueError, struct.error):
+                idx = None
+            if idx is None:
+                try:
+                    build_index(PRONUNCIATIONS, INDEX_PATH)
+                    idx = RhymeIndex(INDEX_PATH)
+                except OSError:
+                    # Read-only checkout: build into memory instead.
+                    tmp = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"shade_rhyme_{os.getpid()}.bin")
+                    build_index(PRONUNCIATIONS, tmp)
+                    with open(tmp, "rb") as f:
+                        idx = RhymeIndex(data=f.read())
+                    os.remove(tmp)
+            _index = idx
+    return _index
+
+
+# ---------------------------
+# Lines and poems
+# ---------------------------
+def last_word(line: str) -> str:
+    for token in reversed(line.split()):
+        words = _WORD.findall(token)
+        if words:
+            return words[-1]
+    return ""
+
+
+def rhymes(a: str, b: str) -> bool:
+    """Whether two lines end in rhyming words."""
+    return index().rhymes(last_word(a), last_word(b))
+
+
+def poem_lines(text: str) -> list:
+    return [line.strip() for line in text.strip().split("\n") if line.strip()]
+
+
+def extract_poem(content: str) -> str:
+    """The poem inside an assistant message: its longest paragraph of three or more lines."""
+    blocks = [b for b in re.split(r"\n\s*\n", content) if len(poem_lines(b)) >= 3]
+    return max(blocks, key=lambda b: len(poem_lines(b))) if blocks else ""
+
+
+def _is_foreign(word: str, idx: RhymeIndex) -> bool:
+    w = word.lower()
+    if w in FOREIGN_WORDS or any(ord(c) > 0x24F and c != "’" for c in w):
+        return True
+    return idx.complete and idx.key_id(w) < 0
+
+
+def validate_poems(poems: list) -> list:
+    """Score many poems at once. One dict per poem:
+
+    ``lines``, ``rhyming_pairs`` (of the ``lines // 2`` couplets),
+    ``non_english`` (tokens), and ``errors`` (subset of line_count, rhyme,
+    non_english).
+    """
+    import numpy as np
+
+    idx = index()
+    line_lists = [poem_lines(p) for p in poems]
+    counts = np.fromiter((len(ls) for ls in line_lists), np.int64, len(line_lists))
+
+    # Couplets: lines (0, 1), (2, 3), ... of every poem, flattened.
+    firsts, seconds, owner = [], [], []
+    for i, ls in enumerate(line_lists):
+        for j in range(0, len(ls) - 1, 2):
+            firsts.append(last_word(ls[j]))
+            seconds.append(last_word(ls[j + 1]))
+            owner.append(i)
+    ka, kb = idx.batch_key_ids(firsts), idx.batch_key_ids(seconds)
+    phonetic = (ka >= 0) & (kb >= 0)
+    same = np.where(phonetic, ka == kb, False)
+    for k in np.flatnonzero(~phonetic):
+        same[k] = spelled_rime(firsts[k]) == spelled_rime(seconds[k])
+    owner = np.asarray(owner, np.int64)
+    rhyming = np.bincount(owner[same], minlength=len(poems)) if len(owner) else np.zeros(len(poems), np.int64)
+    pairs = counts // 2
+
+    # Non-English tokens: classify each distinct token once.
+    verdict = {}
+    reports = []
+    for i, ls in enumerate(line_lists):
+        foreign = []
+        for line in ls:
+            for w in _WORD.findall(line):
+                bad = verdict.get(w)
+                if bad is None:
+                    bad = verdict[w] = _is_foreign(w, idx)
+                if bad:
+                    foreign.append(w)
+        errors = []
+        if counts[i] != EXPECTED_LINES:
+            errors.append("line_count")
+        if rhyming[i] != pairs[i]:
+            errors.append("rhyme")
+        if foreign:
+            errors.append("non_english")
+        reports.append({"lines": int(counts[i]), "rhyming_pairs": int(rhyming[i]), "pairs": int(pairs[i]),
+                        "non_english": foreign, "errors": errors})
+    return reports
+
+
+def validate_poem(text: str) -> dict:
+    return validate_poems([text])[0]
+
+
+# ---------------------------
+# Sessions
+# ---------------------------
+def session_poems(payload: dict) -> list:
+    """Poems shown at step 5, in order."""
+    poems = []
+    for m in payload.get("messages") or []:
+        if m.get("role") == "assistant" and m.get("step") == 5:
+            poem = extract_poem(m.get("content") or "")
+            if poem:
+                poems.append(poem)
+    return poems
+
+
+def label_sessions(data_dir: str) -> list:
+    """One row per session: poems seen and which validator errors they exposed."""
+    sessions = []
+    for key, payload in iter_sessions(data_dir):
+        sessions.append((key, payload, session_poems(payload)))
+    reports = iter(validate_poems([p for _, _, poems in sessions for p in poems]))
+    rows = []
+    for name, payload, poems in sessions:
+        errors = set()
+        for _ in poems:
+            errors.update(next(reports)["errors"])
+        error_type = (payload.get("study_state") or {}).get("error_type", "")
+        expected = ERROR_LABELS.get(error_type)
+        rows.append({
+            "session": name,
+            "error_type": error_type,
+            "poems": len(poems),
+            "exposed": "|".join(sorted(errors)),
+            "expected_exposed": "" if not poems or expected is None else str(expected in errors).lower(),
+        })
+    return rows
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="compile the pronunciation table into the index")
+    b.add_argument("--dict", default=PRONUNCIATIONS)
+    b.add_argument("--out", default=INDEX_PATH)
+    v = sub.add_parser("validate", help="label error exposure for every session")
+    v.add_argument("--data-dir", default=os.path.join(HERE, "study_data"))
+    v.add_argument("--out", help="write the labels as CSV")
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        t0 = time.perf_counter()
+        info = build_index(args.dict, args.out)
+        print(f"{info['words']} words, {info['keys']} rhyme keys, {info['bytes']} bytes -> {info['path']} "
+              f"({time.perf_counter() - t0:.2f}s)")
+        return 0
+
+    t0 = time.perf_counter()
+    rows = label_sessions(args.data_dir)
+    elapsed = time.perf_counter() - t0
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["session"])
+            w.writeheader()
+            w.writerows(rows)
+    for r in rows:
+        print(f"{r['session']:<60} {r['error_type'] or '-':<14} poems={r['poems']:<2} {r['exposed'] or '-'}")
+    print(f"{len(rows)} sessions, {sum(r['poems'] for r in rows)} poems in {elapsed * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
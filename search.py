@@ -0,0 +1,407 @@
+# search.py - full-text inverted index over participant transcripts
+"""Find sessions by what was said in them.
+
+``update()`` tokenizes ``messages[*].content`` (lower-cased ``\\w+`` words,
+apostrophes kept inside words) into an inverted index with positional
+postings, under ``study_data/.search/``. Queries are phrases and boolean
+combinations of them, restricted by message role and step and by session
+condition and status:
+
+    python search.py update [--data-dir study_data] [--full]
+    python search.py query '"10 lines" OR "ten lines"' --role user --step 5
+    python search.py query '"poem about" AND NOT "end study"' --level A2 --status final
+
+Most assistant text is shared template text. So postings point at distinct
+content strings ("texts") rather than messages, and a per-message column maps
+each message to its text. Each segment holds, as ``.npy`` files read through
+mmap:
+
+- ``msg_text``, ``msg_session``, ``msg_role``, ``msg_step`` and ``msg_index``:
+  one row per message
+- ``post_text``, ``post_pos``: (text, position) pairs grouped by term
+- ``term_start``: the range of each term in ``terms.txt`` (sorted, so lookups
+  bisect)
+- ``sessions.json``: file key, session_id, participant id, condition and status
+
+Sessions are read through ``archive.SessionSource``, so archived sessions are
+indexed too. Updates are incremental, like analytics.py: ``manifest.json``
+records each session file's mtime and size (or its archive record). Changed or new sessions go into a new segment,
+their older copies are masked out, and removed files are dropped. Past
+``MAX_SEGMENTS`` segments, the index is rebuilt as one.
+"""
+import argparse
+import bisect
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+from archive import SessionSource
+from fsutil import write_atomic
+from messages import ROLES
+
+INDEX_VERSION = 1
+MAX_SEGMENTS = 8
+_TOKEN = re.compile(r"\w+(?:'\w+)*")
+_ROLE_CODES = {r: i for i, r in enumerate(ROLES)}
+_MSG_COLUMNS = ('msg_text', 'msg_session', 'msg_role', 'msg_step', 'msg_index')
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+# ---------------------------
+# Building
+# ---------------------------
+def _build_segment(path: str, sessions: list):
+    """Write one segment for ``sessions`` (list of (key, payload))."""
+    import numpy as np
+
+    texts = {}              # content -> text id
+    postings = {}           # term -> [text, pos, text, pos, ...]
+    cols = {name: [] for name in _MSG_COLUMNS}
+    records = []
+    for sid, (key, payload) in enumerate(sessions):
+        condition = payload.get('condition') or {}
+        records.append({'key': key, 'session_id': payload.get('session_id'), 'id': payload.get('id'),
+                        'anthro_level': condition.get('anthro_level'), 'pov': condition.get('pov'),
+                        'status': payload.get('status')})
+        for i, m in enumerate(payload.get('messages') or []):
+            content = m.get('content') or ''
+            tid = texts.get(content)
+            if tid is None:
+                tid = texts[content] = len(texts)
+                for pos, term in enumerate(tokenize(content)):
+                    postings.setdefault(term, []).extend((tid, pos))
+            step = m.get('step')
+            cols['msg_text'].append(tid)
+            cols['msg_session'].append(sid)
+            cols['msg_role'].append(_ROLE_CODES.get(m.get('role'), -1))
+            cols['msg_step'].append(step if isinstance(step, int) and -2 ** 15 < step < 2 ** 15 else -1)
+            cols['msg_index'].append(i)
+
+    terms = sorted(postings)
+    start = np.zeros(len(terms) + 1, dtype=np.int64)
+    pairs = np.empty(sum(len(postings[t]) for t in terms), dtype=np.int32)
+    at = 0
+    for i, t in enumerate(terms):
+        p = postings[t]
+        pairs[at:at + len(p)] = p
+        at += len(p)
+        start[i + 1] = at // 2
+    os.makedirs(path)
+    np.save(os.path.join(path, 'post_text.npy'), pairs[0::2])
+    np.save(os.path.join(path, 'post_pos.npy'), pairs[1::2])
+    np.save(os.path.join(path, 'term_start.npy'), start)
+    for name, dtype in zip(_MSG_COLUMNS, (np.int32, np.int32, np.int8, np.int16, np.int32)):
+        np.save(os.path.join(path, name + '.npy'), np.asarray(cols[name], dtype=dtype))
+    with open(os.path.join(path, 'terms.txt'), 'w') as f:
+        f.write("\n".join(terms))
+    with open(os.path.join(path, 'sessions.json'), 'w') as f:
+        json.dump(records, f, separators=(',', ':'))
+
+
+def load_manifest(index_dir: str) -> dict:
+    try:
+        with open(os.path.join(index_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get('version') == INDEX_VERSION else {}
+
+
+def update(data_dir: str = 'study_data', index_dir: str = None, full: bool = False) -> dict:
+    """Bring the index in ``index_dir`` (default ``<data_dir>/.search``) up to date. Returns run stats."""
+    index_dir = index_dir or os.path.join(data_dir, '.search')
+    os.makedirs(index_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    with SessionSource(data_dir) as source:
+        return _update(source, index_dir, full, t0)
+
+
+def _update(source: SessionSource, index_dir: str, full: bool, t0: float) -> dict:
+    current = source.signatures()
+    manifest = {} if full else load_manifest(index_dir)
+    files, live = manifest.get('files', {}), manifest.get('live', {})
+    segments = [s for s in manifest.get('segments', []) if os.path.isdir(os.path.join(index_dir, s))]
+    if len(segments) != len(manifest.get('segments', [])):
+        files, live, segments = {}, {}, []      # a segment vanished behind the manifest's back
+    changed = sorted(k for k, sig in current.items() if files.get(k) != sig)
+    removed = [k for k in files if k not in current]
+    rebuild = not segments or len(segments) >= MAX_SEGMENTS
+    if rebuild:
+        changed, live, segments = sorted(current), {}, []
+
+    sessions, failed = [], []
+    for key in changed:
+        try:
+            sessions.append((key, source.load(key)))
+        except (OSError, ValueError):
+            failed.append(key)
+    for key in failed:
+        current.pop(key)    # retried on the next run
+    for key in removed:
+        live.pop(key, None)
+    if sessions:
+        n = max([int(s.split('_')[1]) for s in os.listdir(index_dir) if s.startswith('segment_')] + [0]) + 1
+        name = f"segment_{n:06d}"
+        _build_segment(os.path.join(index_dir, name), sessions)
+        segments.append(name)
+        for key, _ in sessions:
+            live[key] = name
+    in_use = set(live.values())
+    segments = [s for s in segments if s in in_use]
+
+    # The manifest goes last; segments it doesn't list are cleared below.
+    write_atomic(os.path.join(index_dir, 'manifest.json'), lambda p: _dump(p, {
+        'version': INDEX_VERSION, 'files': current, 'live': live, 'segments': segments}))
+    for name in os.listdir(index_dir):
+        if name.startswith('segment_') and name not in segments:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+    return {'sessions': len(live), 'indexed': len(sessions), 'removed': len(removed),
+            'segments': len(segments), 'rebuilt': rebuild, 'seconds': time.perf_counter() - t0}
+
+
+def _dump(path: str, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f, separators=(',', ':'))
+
+
+# ---------------------------
+# Queries
+# ---------------------------
+class Phrase:
+    def __init__(self, terms: list):
+        self.terms = terms
+
+    def __repr__(self):
+        return f"Phrase({' '.join(self.terms)!r})"
+
+
+class Op:
+    def __init__(self, op: str, args: list):
+        self.op = op
+        self.args = args
+
+    def __repr__(self):
+        return f"{self.op}{self.args!r}"
+
+
+_QUERY_TOKEN = re.compile(r'"([^"]*)"|(\()|(\))|([^\s()"]+)')
+
+
+def parse_query(query: str):
+    """``"a phrase"``, bare words, AND / OR / NOT, parentheses; adjacent terms are ANDed."""
+    tokens = []
+    for phrase, lp, rp, word in _QUERY_TOKEN.findall(query):
+        if lp or rp:
+            tokens.append(lp or rp)
+        elif word in ('AND', 'OR', 'NOT'):
+            tokens.append(word)
+        else:
+            terms = tokenize(phrase if not word else word)
+            if terms:
+                tokens.append(Phrase(terms))
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        args = [parse_and()]
+        while peek() == 'OR':
+            take()
+            args.append(parse_and())
+        return args[0] if len(args) == 1 else Op('OR', args)
+
+    def parse_and():
+        args = [parse_unary()]
+        while peek() not in (None, 'OR', ')'):
+            if peek() == 'AND':
+                take()
+            args.append(parse_unary())
+        return args[0] if len(args) == 1 else Op('AND', args)
+
+    def parse_unary():
+        tok = take() if peek() is not None else None
+        if tok == 'NOT':
+            return Op('NOT', [parse_unary()])
+        if tok == '(':
+            node = parse_or()
+            if peek() != ')':
+                raise ValueError(f"unbalanced parentheses in {query!r}")
+            take()
+            return node
+        if isinstance(tok, Phrase):
+            return tok
+        if tok is None:
+            raise ValueError(f"query ends too soon: {query!r}")
+        raise ValueError(f"unexpected {tok!r} in {query!r}")
+
+    if not tokens:
+        raise ValueError("empty query")
+    node = parse_or()
+    if peek() is not None:
+        raise ValueError(f"unexpected {peek()!r} in {query!r}")
+    return node
+
+
+class _Segment:
+    def __init__(self, path: str):
+        import numpy as np
+        self.path = path
+        # Plain ndarray views over the maps: np.memmap's per-index overhead adds up per hit.
+        arrays = {name: np.asarray(np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+                  for name in _MSG_COLUMNS + ('post_text', 'post_pos', 'term_start')}
+        self.__dict__.update(arrays)
+        with open(os.path.join(path, 'terms.txt')) as f:
+            self.terms = f.read().split("\n")
+        with open(os.path.join(path, 'sessions.json')) as f:
+            self.sessions = json.load(f)
+        self.n_texts = int(self.msg_text.max()) + 1 if len(self.msg_text) else 0
+        for field in ('anthro_level', 'pov', 'status'):
+            setattr(self, field, np.array([str(s[field]) for s in self.sessions]))
+
+    def postings(self, term: str):
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        a, b = self.term_start[i], self.term_start[i + 1]
+        return self.post_text[a:b], self.post_pos[a:b]
+
+    def phrase_texts(self, terms: list):
+        """Text ids containing ``terms`` consecutively."""
+        import numpy as np
+        keys = None
+        for offset, term in enumerate(terms):
+            found = self.postings(term)
+            if found is None:
+                return np.empty(0, dtype=np.int64)
+            text, pos = found
+            k = (text.astype(np.int64) << 32) | (pos.astype(np.int64) - offset + (1 << 31))
+            keys = k if keys is None else np.intersect1d(keys, k, assume_unique=True)
+            if not len(keys):
+                return np.empty(0, dtype=np.int64)
+        return np.unique(keys >> 32)
+
+
+class SearchIndex:
+    """Read side of the index; keep one around to answer many queries."""
+
+    def __init__(self, index_dir: str):
+        import numpy as np
+        manifest = load_manifest(index_dir)
+        live = manifest.get('live', {})
+        self.segments = []
+        for name in manifest.get('segments', []):
+            seg = _Segment(os.path.join(index_dir, name))
+            # Sessions re-indexed into a later segment are masked out here.
+            seg.live = np.array([live.get(s['key']) == name for s in seg.sessions], dtype=bool)
+            self.segments.append(seg)
+
+    def __len__(self):
+        return sum(int(seg.live.sum()) for seg in self.segments)
+
+    def search(self, query, role: str = None, step: int = None, anthro_level: str = None, pov: str = None,
+               status: str = None) -> list:
+        """Sessions matching ``query``, each with the message indexes that matched its phrases.
+
+        ``role`` and ``step`` restrict which messages a phrase may match in; the
+        condition and status filters apply to whole sessions.
+        """
+        import numpy as np
+        node = parse_query(query) if isinstance(query, str) else query
+        hits = []
+        for seg in self.segments:
+            ok = seg.live.copy()
+            for field, value in (('anthro_level', anthro_level), ('pov', pov), ('status', status)):
+                if value is not None:
+                    ok &= getattr(seg, field) == value
+            if not ok.any():
+                continue
+            msg_ok = ok[seg.msg_session]
+            if role is not None:
+                msg_ok &= seg.msg_role == _ROLE_CODES.get(role, -2)
+            if step is not None:
+                msg_ok &= seg.msg_step == step
+            matched = []
+            sessions = self._eval(node, seg, ok, msg_ok, matched)
+            rows = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+            rows = rows[sessions[seg.msg_session[rows]]]
+            # Rows are in session order, so each hit's messages are one contiguous run.
+            sids = np.flatnonzero(sessions)
+            row_sessions = seg.msg_session[rows]
+            bounds = zip(np.searchsorted(row_sessions, sids).tolist(), np.searchsorted(row_sessions, sids + 1).tolist())
+            msg_index = seg.msg_index[rows].tolist()
+            for sid, (a, b) in zip(sids.tolist(), bounds):
+                s = seg.sessions[sid]
+                hits.append({'key': s['key'], 'session_id': s['session_id'], 'id': s['id'],
+                             'condition': {'anthro_level': s['anthro_level'], 'pov': s['pov']},
+                             'status': s['status'], 'messages': msg_index[a:b]})
+        return hits
+
+    def _eval(self, node, seg, ok, msg_ok, matched):
+        """Boolean mask over ``seg.sessions``; rows of positive phrase matches are added to ``matched``."""
+        import numpy as np
+        if isinstance(node, Phrase):
+            out = np.zeros(len(ok), dtype=bool)
+            texts = seg.phrase_texts(node.terms)
+            if len(texts):
+                text_hit = np.zeros(seg.n_texts, dtype=bool)
+                text_hit[texts] = True
+                rows = np.flatnonzero(msg_ok & text_hit[seg.msg_text])
+                out[seg.msg_session[rows]] = True
+                matched.append(rows)
+            return out
+        if node.op == 'NOT':
+            return ok & ~self._eval(node.args[0], seg, ok, msg_ok, [])
+        masks = [self._eval(a, seg, ok, msg_ok, matched) for a in node.args]
+        return np.logical_and.reduce(masks) if node.op == 'AND' else np.logical_or.reduce(masks)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--data-dir', default='study_data')
+    ap.add_argument('--index', default=None, help="index directory (default: <data-dir>/.search)")
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('update', help="index new and changed sessions")
+    p.add_argument('--full', action='store_true', help="rebuild from scratch")
+    q = sub.add_parser('query', help="print matching sessions")
+    q.add_argument('query')
+    q.add_argument('--role', choices=ROLES)
+    q.add_argument('--step', type=int)
+    q.add_argument('--level', help="anthro_level")
+    q.add_argument('--pov')
+    q.add_argument('--status')
+    args = ap.parse_args(argv)
+    index_dir = args.index or os.path.join(args.data_dir, '.search')
+
+    if args.cmd == 'update':
+        stats = update(args.data_dir, index_dir, full=args.full)
+        print(f"{stats['sessions']} sessions ({stats['indexed']} indexed, {stats['removed']} removed), "
+              f"{stats['segments']} segment(s) in {stats['seconds']:.2f}s -> {index_dir}")
+        return 0
+    try:
+        node = parse_query(args.query)
+    except ValueError as exc:
+        q.error(f"bad query: {exc}")    # usage message, exit status 2
+    t0 = time.perf_counter()
+    hits = SearchIndex(index_dir).search(node, role=args.role, step=args.step, anthro_level=args.level,
+                                         pov=args.pov, status=args.status)
+    for h in hits:
+        c = h['condition']
+        print(f"{h['key']}\t{c['anthro_level']}/{c['pov']}\t{h['status']}\tmessages {h['messages']}")
+    print(f"{len(hits)} session(s) in {(time.perf_counter() - t0) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+# session_store.py - append-only journaled session store for the SHADE02 study
+"""Journaled persistence for study sessions.
+
+Each save appends one JSONL record holding only what changed since the previous
+save (new messages, changed study_state keys, header fields, status). When a
+session is saved with a terminal status ("final", or "abandoned" from the idle
+reaper) the journal is compacted into the usual pretty-printed
+``participant_<id>_<session>.json`` snapshot. ``load_session``
+rebuilds the same payload shape from either layout.
+"""
+import copy
+import json
+import os
+import threading
+import time
+
+from messages import json_default
+
+# fsync policy for journal appends: "always", "interval" or "never".
+# The final snapshot is always fsynced before it replaces anything.
+FSYNC_POLICY = os.environ.get("SHADE_FSYNC", "interval")
+FSYNC_INTERVAL = float(os.environ.get("SHADE_FSYNC_INTERVAL", "1.0"))
+
+META_KEYS = ('participant', 'id', 'session_id', 'condition', 'seed')
+PAYLOAD_KEYS = ('participant', 'id', 'messages', 'study_state', 'session_id',
+                'condition', 'seed', 'status', 'saved_at')
+
+# Statuses after which a session is never saved again; the journal is compacted.
+TERMINAL_STATUSES = ('final', 'abandoned')
+
+JOURNAL_EXT = '.jsonl'
+SNAPSHOT_EXT = '.json'
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(path: str, payload: dict):
+    """Atomically replace ``path`` with the pretty-printed payload."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(payload, f, indent=2, default=json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+class SessionJournal:
+    """Per-session journal writer. Keeps a cursor of what is already on disk.
+
+    ``save`` and ``compact`` hold a lock: the script thread and the draft
+    autosaver's timer thread save the same session.
+    """
+
+    def __init__(self, base_path: str, fsync: str = FSYNC_POLICY, fsync_interval: float = FSYNC_INTERVAL):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"unknown fsync policy: {fsync!r}")
+        self.base_path = base_path
+        self.journal_path = base_path + JOURNAL_EXT
+        self.snapshot_path = base_path + SNAPSHOT_EXT
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.bytes_written = 0
+        self._n_messages = 0
+        self._meta = None
+        self._state = {}
+        self._status = None
+        self._last_fsync = 0.0
+        self._tail_checked = False
+        self._lock = threading.RLock()
+
+    def _delta(self, payload: dict) -> dict:
+        rec = {}
+        meta = {k: payload.get(k) for k in META_KEYS}
+        if meta != self._meta:
+            rec['meta'] = meta
+        messages = payload.get('messages') or []
+        if len(messages) != self._n_messages:
+            start = min(self._n_messages, len(messages))
+            rec['messages_from'] = start
+            rec['messages'] = messages[start:]
+        state = payload.get('study_state') or {}
+        changed = {k: v for k, v in state.items() if k not in self._state or self._state[k] != v}
+        if changed:
+            rec['state'] = changed
+        return rec
+
+    def save(self, payload: dict) -> int:
+        """Append the changes in ``payload``; compact on a terminal status. Returns bytes written."""
+        with self._lock:
+            return self._save(payload)
+
+    def _terminate_torn_line(self, f):
+        # A crash mid-append can leave a line without its newline; don't glue the next record onto it.
+        if not self._tail_checked:
+            self._tail_checked = True
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    def _save(self, payload: dict) -> int:
+        status = payload.get('status', 'partial')
+        rec = self._delta(payload)
+        if not rec and status == self._status:
+            return 0
+        rec['status'] = status
+        rec['saved_at'] = payload.get('saved_at')
+        line = (json.dumps(rec, separators=(',', ':'), default=json_default) + '\n').encode('utf-8')
+
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        with open(self.journal_path, 'a+b') as f:
+            self._terminate_torn_line(f)
+            f.write(line)
+            f.flush()
+            now = time.monotonic()
+            if self.fsync == "always" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(f.fileno())
+                self._last_fsync = now
+        written = len(line)
+
+        # Only advance the cursor once the record is on disk.
+        if 'meta' in rec:
+            self._meta = copy.deepcopy(rec['meta'])
+        if 'messages' in rec:
+            self._n_messages = rec['messages_from'] + len(rec['messages'])
+        if 'state' in rec:
+            self._state.update(copy.deepcopy(rec['state']))
+        self._status = status
+
+        if status in TERMINAL_STATUSES:
+            written += self.compact(payload)
+        self.bytes_written += written
+        return written
+
+    def compact(self, payload: dict) -> int:
+        """Fold the journal into the snapshot file and drop the journal."""
+        snapshot = {k: payload.get(k) for k in PAYLOAD_KEYS}
+        with self._lock:
+            write_snapshot(self.snapshot_path, snapshot)
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self._tail_checked = False
+            return os.path.getsize(self.snapshot_path)
+
+
+# ---------------------------
+# Readers
+# ---------------------------
+def _apply_record(payload: dict, rec: dict):
+    if 'meta' in rec:
+        payload.update(rec['meta'])
+    if 'messages' in rec:
+        start = rec.get('messages_from', len(payload['messages']))
+        payload['messages'][start:] = rec['messages']
+    if 'state' in rec:
+        payload['study_state'].update(rec['state'])
+    payload['status'] = rec.get('status', payload.get('status'))
+    payload['saved_at'] = rec.get('saved_at', payload.get('saved_at'))
+
+
+def replay_journal(path: str, payload: dict = None) -> dict:
+    """Rebuild a payload from a journal, optionally on top of an existing snapshot.
+
+    A torn line (crash mid-append) is skipped; the records around it are kept.
+    """
+    if payload is None:
+        payload = {k: None for k in PAYLOAD_KEYS}
+    payload['messages'] = list(payload.get('messages') or [])
+    payload['study_state'] = dict(payload.get('study_state') or {})
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            _apply_record(payload, rec)
+    return payload
+
+
+def session_base(path: str) -> str:
+    for ext in (JOURNAL_EXT, SNAPSHOT_EXT):
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def load_session(path: str) -> dict:
+    """Load a session by snapshot path, journal path or base path."""
+    base = session_base(path)
+    payload = None
+    if os.path.exists(base + SNAPSHOT_EXT):
+        with open(base + SNAPSHOT_EXT) as f:
+            payload = json.load(f)
+    if os.path.exists(base + JOURNAL_EXT):
+        payload = replay_journal(base + JOURNAL_EXT, payload)
+    if payload is None:
+        raise FileNotFoundError(base)
+    return payload
+
+
+def iter_session_paths(data_dir: str = 'study_data'):
+    """Yield the base path of every participant session in ``data_dir``, once each."""
+    seen = set()
+    try:
+        names = sorted(os.listdir(data_dir))
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.startswith('participant_'):
+            continue
+        if not (name.endswith(SNAPSHOT_EXT) or name.endswith(JOURNAL_EXT)):
+            continue
+        base = session_base(os.path.join(data_dir, name))
+        if base not in seen:
+            seen.add(base)
+            yield base
+
+
+def scan_session_files(data_dir: str = 'study_data') -> dict:
+    """Map each session's base name to its [snapshot, journal] ``[mtime_ns, size]`` signatures (None if absent)."""
+    sigs = {}
+    try:
+        entries = list(os.scandir(data_dir))
+    except FileNotFoundError:
+        return sigs
+    for entry in entries:
+        name = entry.name
+        if not name.startswith('participant_') or not (name.endswith(SNAPSHOT_EXT) or name.endswith(JOURNAL_EXT)):
+            continue
+        st = entry.stat()
+        key = os.path.basename(session_base(name))
+        sigs.setdefault(key, {})[name[len(key):]] = [st.st_mtime_ns, st.st_size]
+    return {key: [parts.get(SNAPSHOT_EXT), parts.get(JOURNAL_EXT)] for key, parts in sigs.items()}
@@ -0,0 +1,52 @@
+# storage - pluggable persistence behind save_data / append_csv_row_final
+"""Storage backends for study sessions and summary rows.
+
+``get_storage()`` returns the process-wide backend chosen by ``SHADE_STORAGE``:
+
+- ``filesystem`` (default): journaled files in ``study_data/`` plus sessions.csv
+- ``postgres``: ``SHADE_DATABASE_URL``, pooled connections, batched message upserts
+- ``redis``: ``SHADE_REDIS_URL`` for in-progress sessions, written behind to
+  Postgres if ``SHADE_DATABASE_URL`` is set, otherwise to the filesystem
+"""
+import atexit
+import os
+import threading
+
+from storage.base import StorageBackend
+from storage.filesystem import FilesystemStorage
+
+__all__ = ['StorageBackend', 'FilesystemStorage', 'get_storage']
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _from_env() -> StorageBackend:
+    kind = os.environ.get("SHADE_STORAGE", "filesystem")
+    data_dir = os.environ.get("SHADE_DATA_DIR", "study_data")
+    if kind == "filesystem":
+        return FilesystemStorage(data_dir)
+    if kind == "postgres":
+        from storage.postgres import PostgresStorage
+        return PostgresStorage.from_dsn(os.environ["SHADE_DATABASE_URL"])
+    if kind == "redis":
+        import redis
+        from storage.redis_store import RedisStorage
+        if os.environ.get("SHADE_DATABASE_URL"):
+            from storage.postgres import PostgresStorage
+            durable = PostgresStorage.from_dsn(os.environ["SHADE_DATABASE_URL"])
+        else:
+            durable = FilesystemStorage(data_dir)
+        client = redis.Redis.from_url(os.environ["SHADE_REDIS_URL"], decode_responses=True)
+        return RedisStorage(client, durable)
+    raise ValueError(f"unknown SHADE_STORAGE: {kind!r}")
+
+
+def get_storage() -> StorageBackend:
+    """Process-wide backend, created on first use and flushed at interpreter exit."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _from_env()
+            atexit.register(_backend.close)
+        return _backend
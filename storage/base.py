@@ -0,0 +1,43 @@
+# storage/base.py - the interface every backend implements
+"""Backend contract shared by the filesystem, Postgres and Redis stores.
+
+A session payload has the shape built by ``save_data``: participant, id,
+messages, study_state, session_id, condition, seed, status, saved_at. Saves
+are called repeatedly for the same session as it grows; messages are only ever
+appended. ``messages`` is a list of dicts or a ``messages.Transcript``; write
+it with ``json.dumps(..., default=messages.json_default)``. Summary rows use
+``summary_writer.SUMMARY_FIELDS``.
+"""
+
+
+class StorageBackend:
+    """Abstract storage backend."""
+
+    def save_session(self, payload: dict):
+        """Persist the current state of a session (partial or final)."""
+        raise NotImplementedError
+
+    def forget(self, session_id: str):
+        """Drop per-session state kept between saves; a terminal save does this itself."""
+
+    def load_session(self, session_id: str):
+        """Return the latest payload for ``session_id``, or None if unknown."""
+        raise NotImplementedError
+
+    def list_sessions(self, status: str = None) -> list:
+        """Session ids, optionally only those whose latest status is ``status``."""
+        raise NotImplementedError
+
+    def append_summary(self, row: dict):
+        """Record a sessions.csv-style summary row for a finalized session."""
+        raise NotImplementedError
+
+    def summaries(self) -> list:
+        """All summary rows written so far, oldest first (values as stored)."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Block until everything accepted so far is durable."""
+
+    def close(self):
+        self.flush()
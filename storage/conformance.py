@@ -0,0 +1,293 @@
+# storage/conformance.py - one behavioural suite for every StorageBackend
+"""Run the shared conformance checks against all three backends using local
+stand-ins (SQLite for Postgres, an in-memory fake for Redis); no network needed.
+
+    python -m storage.conformance
+"""
+import copy
+import fnmatch
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import traceback
+
+from messages import Transcript
+from storage.filesystem import FilesystemStorage
+from storage.postgres import ConnectionPool, PostgresStorage
+from storage.redis_store import RedisStorage
+from summary_writer import summary_row
+
+
+# ---------------------------
+# Local stand-ins
+# ---------------------------
+class FakeRedis:
+    """The subset of redis-py (decode_responses=True) that RedisStorage uses."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def hset(self, name, mapping):
+        with self._lock:
+            self._data.setdefault(name, {}).update({k: str(v) for k, v in mapping.items()})
+            return len(mapping)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def rpush(self, name, *values):
+        with self._lock:
+            lst = self._data.setdefault(name, [])
+            lst.extend(str(v) for v in values)
+            return len(lst)
+
+    def lrange(self, name, start, end):
+        with self._lock:
+            lst = self._data.get(name, [])
+            return list(lst[start:] if end == -1 else lst[start:end + 1])
+
+    def sadd(self, name, *values):
+        with self._lock:
+            s = self._data.setdefault(name, set())
+            before = len(s)
+            s.update(values)
+            return len(s) - before
+
+    def srem(self, name, *values):
+        with self._lock:
+            s = self._data.get(name, set())
+            removed = len(s & set(values))
+            s.difference_update(values)
+            return removed
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._data.get(name, set()))
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for n in names if self._data.pop(n, None) is not None)
+
+    def keys(self, pattern='*'):
+        with self._lock:
+            return [k for k in self._data if fnmatch.fnmatchcase(k, pattern)]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        def queue_call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return queue_call
+
+    def execute(self):
+        with self._client._lock:
+            results = [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+
+# SQLite has no BIGSERIAL: number summary rows from the rowid on first insert instead.
+SQLITE_SUMMARY_SEQ = """
+CREATE TRIGGER IF NOT EXISTS shade_summaries_seq AFTER INSERT ON shade_summaries WHEN NEW.seq IS NULL
+BEGIN UPDATE shade_summaries SET seq = NEW.rowid WHERE rowid = NEW.rowid; END
+"""
+
+
+def sqlite_postgres(path: str) -> PostgresStorage:
+    pool = ConnectionPool(lambda: sqlite3.connect(path, check_same_thread=False, timeout=30), maxconn=4)
+    backend = PostgresStorage(pool, paramstyle='qmark')
+    with backend._transaction() as cur:
+        cur.execute(SQLITE_SUMMARY_SEQ)
+    return backend
+
+
+def standin_backends(workdir: str) -> dict:
+    """Factories for each backend, isolated under ``workdir``."""
+    counter = iter(range(10 ** 6))
+
+    def fs():
+        return FilesystemStorage(os.path.join(workdir, f"fs{next(counter)}"), fsync="never")
+
+    def pg():
+        return sqlite_postgres(os.path.join(workdir, f"pg{next(counter)}.sqlite"))
+
+    def rd():
+        return RedisStorage(FakeRedis(), fs(), write_behind_delay=0.05)
+
+    return {'filesystem': fs, 'postgres(sqlite)': pg, 'redis(fake)': rd}
+
+
+# ---------------------------
+# Checks
+# ---------------------------
+def make_payload(sid: str, n_messages: int, status: str = "partial") -> dict:
+    messages = []
+    for i in range(n_messages):
+        m = {"ts": f"2025-01-01T00:00:{i:02d}Z", "role": "assistant" if i % 2 == 0 else "user",
+             "step": i // 2, "content": f"message {i} — “quoted” ✓"}
+        if m["role"] == "assistant":
+            m["condition"] = {"anthro_level": "A2", "pov": "third"}
+        messages.append(m)
+    return {
+        'participant': "Ada", 'id': f"P{sid[:6]}", 'messages': messages,
+        'study_state': {'topic': 'ocean', 'poem_attempts': n_messages // 4, 'timer_expired': False,
+                        'feedback': {}, 'feedback_draft': {'difficulty': 3}, 'error_type': 'six_lines'},
+        'session_id': sid, 'condition': {"anthro_level": "A2", "pov": "third"}, 'seed': 4242,
+        'status': status, 'saved_at': f"2025-01-01T00:01:{n_messages:02d}Z",
+    }
+
+
+def check_round_trip(backend):
+    p = make_payload("s-roundtrip", 3)
+    backend.save_session(copy.deepcopy(p))
+    assert backend.load_session("s-roundtrip") == p
+
+
+def check_incremental_growth(backend):
+    for n in range(1, 12):
+        backend.save_session(make_payload("s-grow", n))
+    assert backend.load_session("s-grow") == make_payload("s-grow", 11)
+
+
+def check_state_updates_without_messages(backend):
+    p = make_payload("s-state", 4)
+    backend.save_session(copy.deepcopy(p))
+    p['study_state']['feedback_draft'] = {'difficulty': 5, 'comments': "ok"}
+    p['saved_at'] = "2025-01-01T00:09:00Z"
+    backend.save_session(copy.deepcopy(p))
+    assert backend.load_session("s-state") == p
+
+
+def check_final(backend):
+    for n in range(1, 6):
+        backend.save_session(make_payload("s-final", n))
+    p = make_payload("s-final", 6, status="final")
+    p['study_state']['feedback'] = {'difficulty': 2, 'ai_helpful': 4, 'noticed_error': "Yes"}
+    backend.save_session(copy.deepcopy(p))
+    backend.flush()
+    assert backend.load_session("s-final") == p
+    assert "s-final" in backend.list_sessions(status="final")
+    assert "s-final" not in backend.list_sessions(status="partial")
+
+
+def check_unknown_session(backend):
+    assert backend.load_session("s-missing") is None
+
+
+def check_list_sessions(backend):
+    backend.save_session(make_payload("s-list-a", 2))
+    backend.save_session(make_payload("s-list-b", 2, status="final"))
+    backend.flush()
+    ids = backend.list_sessions()
+    assert {"s-list-a", "s-list-b"} <= set(ids)
+    assert "s-list-a" in backend.list_sessions(status="partial")
+
+
+def check_summaries(backend):
+    for i in range(3):
+        p = make_payload(f"s-sum-{i}", 4, status="final")
+        p['study_state']['feedback'] = {'difficulty': i + 1, 'ai_helpful': 3, 'noticed_error': "No"}
+        backend.append_summary(summary_row(p, saved_at=f"2025-01-01T00:00:0{i}Z"))
+    backend.flush()
+    rows = backend.summaries()
+    assert [r['session_id'] for r in rows] == ["s-sum-0", "s-sum-1", "s-sum-2"]
+    assert [str(r['difficulty']) for r in rows] == ["1", "2", "3"]
+    assert rows[0]['anthro_level'] == "A2"
+
+
+def check_concurrent_sessions(backend):
+    errors = []
+
+    def worker(i):
+        try:
+            for n in range(1, 9):
+                backend.save_session(make_payload(f"s-conc-{i}", n))
+        except Exception as e:  # surfaced by the assert below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+    backend.flush()
+    for i in range(8):
+        assert backend.load_session(f"s-conc-{i}") == make_payload(f"s-conc-{i}", 8)
+
+
+def check_transcript_messages(backend):
+    # The app hands over a messages.Transcript rather than a list of dicts.
+    for n in range(1, 6):
+        p = make_payload("s-transcript", n, status="final" if n == 5 else "partial")
+        p['messages'] = Transcript(p['messages'])
+        backend.save_session(p)
+    backend.flush()
+    assert backend.load_session("s-transcript") == make_payload("s-transcript", 5, status="final")
+
+
+def _per_session_state(backend) -> dict:
+    backend = getattr(backend, 'durable', None) or backend
+    return getattr(backend, '_journals', None) or getattr(backend, '_cursors', None) or {}
+
+
+def check_session_state_released(backend):
+    for n in range(1, 4):
+        backend.save_session(make_payload("s-done", n))
+        backend.save_session(make_payload("s-gone", n))
+    backend.flush()
+    backend.save_session(make_payload("s-done", 4, status="abandoned"))
+    backend.forget("s-gone")
+    backend.flush()
+    assert not _per_session_state(backend), f"per-session state kept: {sorted(_per_session_state(backend))}"
+    # A forgotten session that saves again is rewritten from the start.
+    backend.save_session(make_payload("s-gone", 5))
+    backend.flush()
+    assert backend.load_session("s-gone") == make_payload("s-gone", 5)
+
+
+CHECKS = [check_round_trip, check_incremental_growth, check_state_updates_without_messages, check_final,
+          check_unknown_session, check_list_sessions, check_summaries, check_concurrent_sessions,
+          check_transcript_messages, check_session_state_released]
+
+
+def run_conformance(factory, name: str = "backend") -> list:
+    """Run every check on a fresh backend from ``factory``. Returns (check, error) failures."""
+    failures = []
+    for check in CHECKS:
+        backend = factory()
+        try:
+            check(backend)
+            print(f"  ok    {name}: {check.__name__}")
+        except Exception as e:
+            failures.append((check.__name__, e))
+            print(f"  FAIL  {name}: {check.__name__}: {e!r}")
+            traceback.print_exc()
+        finally:
+            backend.close()
+    return failures
+
+
+def main() -> int:
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, factory in standin_backends(workdir).items():
+            failures += run_conformance(factory, name)
+    print(f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# storage/filesystem.py - journaled files in study_data/ (the default backend)
+import csv
+import glob
+import os
+import threading
+
+from archive import SessionArchive, SessionSource, archive_dir
+from session_store import TERMINAL_STATUSES, SessionJournal, load_session, session_base
+from storage.base import StorageBackend
+from summary_writer import SummaryWriter
+
+
+class FilesystemStorage(StorageBackend):
+    """Session journals plus a batched sessions.csv writer under ``data_dir``."""
+
+    def __init__(self, data_dir: str = 'study_data', **journal_options):
+        self.data_dir = data_dir
+        self.journal_options = journal_options
+        self._journals = {}
+        self._lock = threading.Lock()
+        self._summary = None
+        self._archive = None
+        self._archive_sig = None
+        self._archive_lock = threading.Lock()
+
+    def _journal(self, payload: dict) -> SessionJournal:
+        base = os.path.join(self.data_dir, f"participant_{payload.get('id')}_{payload.get('session_id')}")
+        with self._lock:
+            journal = self._journals.get(payload.get('session_id'))
+            if journal is None or journal.base_path != base:
+                journal = SessionJournal(base, **self.journal_options)
+                self._journals[payload.get('session_id')] = journal
+            return journal
+
+    def save_session(self, payload: dict):
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._journal(payload).save(payload)
+        if payload.get('status') in TERMINAL_STATUSES:
+            with self._lock:
+                self._journals.pop(payload.get('session_id'), None)
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._journals.pop(session_id, None)
+
+    def _base_for(self, session_id: str):
+        matches = glob.glob(os.path.join(glob.escape(self.data_dir), f"participant_*_{glob.escape(session_id)}.json*"))
+        return session_base(sorted(matches)[0]) if matches else None
+
+    def load_session(self, session_id: str):
+        base = self._base_for(session_id)
+        if base:
+            return load_session(base)
+        with self._archive_lock:
+            archive = self._open_archive()
+            # Packed (and removed) by archive.py.
+            return archive.get(session_id) if archive is not None else None
+
+    def _open_archive(self):
+        """The archive reader, reopened only when a segment or its index changed (under ``_archive_lock``)."""
+        root = archive_dir(self.data_dir)
+        paths = sorted(glob.glob(os.path.join(glob.escape(root), "segment_*")))
+        sig = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            sig.append((path, st.st_mtime_ns, st.st_size))
+        if sig != self._archive_sig:
+            if self._archive is not None:
+                self._archive.close()
+            self._archive = SessionArchive(root) if sig else None
+            self._archive_sig = sig
+        return self._archive
+
+    def list_sessions(self, status: str = None) -> list:
+        ids = []
+        with SessionSource(self.data_dir) as source:
+            for _, payload in source:
+                if status is None or payload.get('status') == status:
+                    ids.append(payload.get('session_id'))
+        return ids
+
+    @property
+    def csv_path(self) -> str:
+        return os.path.join(self.data_dir, 'sessions.csv')
+
+    def append_summary(self, row: dict):
+        with self._lock:
+            if self._summary is None:
+                self._summary = SummaryWriter(self.csv_path)
+            writer = self._summary
+        writer.submit(row)
+
+    def summaries(self) -> list:
+        self.flush()
+        try:
+            with open(self.csv_path, newline='') as f:
+                return list(csv.DictReader(f))
+        except FileNotFoundError:
+            return []
+
+    def flush(self):
+        if self._summary is not None:
+            self._summary.flush()
+
+    def close(self):
+        if self._summary is not None:
+            self._summary.close()
+            self._summary = None
+        with self._archive_lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive, self._archive_sig = None, None
@@ -0,0 +1,221 @@
+# storage/postgres.py - Postgres backend with pooled connections and batched upserts
+"""Sessions live in three tables:
+
+- ``shade_sessions``: one row per session (header fields, study_state, status)
+- ``shade_messages``: one row per message, keyed by (session_id, idx)
+- ``shade_summaries``: the sessions.csv columns, one row per finalized session
+
+Each save upserts the session row and only the messages appended since the
+previous save, in a single batched statement and one transaction. The SQL is
+plain ``INSERT ... ON CONFLICT DO UPDATE`` so the same statements run on SQLite
+for local testing (see ``storage.conformance``). Summary order comes from the
+``seq`` BIGSERIAL, so concurrent writers never share a value; an upsert keeps
+the row's first ``seq``.
+"""
+import json
+import queue
+import threading
+from contextlib import contextmanager
+
+from messages import json_default
+from session_store import TERMINAL_STATUSES
+from storage.base import StorageBackend
+from summary_writer import SUMMARY_FIELDS
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS shade_sessions (
+        session_id TEXT PRIMARY KEY,
+        participant TEXT,
+        participant_id TEXT,
+        condition TEXT,
+        seed BIGINT,
+        study_state TEXT,
+        status TEXT,
+        saved_at TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS shade_messages (
+        session_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        body TEXT NOT NULL,
+        PRIMARY KEY (session_id, idx)
+    )""",
+    """CREATE TABLE IF NOT EXISTS shade_summaries (
+        seq BIGSERIAL,
+        saved_at TEXT,
+        session_id TEXT PRIMARY KEY,
+        participant_id TEXT,
+        anthro_level TEXT,
+        pov TEXT,
+        error_type TEXT,
+        poem_attempts INTEGER,
+        timer_expired BOOLEAN,
+        ended_by_user BOOLEAN,
+        difficulty INTEGER,
+        ai_helpful INTEGER,
+        noticed_error TEXT
+    )""",
+]
+
+UPSERT_SESSION = """
+INSERT INTO shade_sessions (session_id, participant, participant_id, condition, seed, study_state,
+                            status, saved_at, message_count)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (session_id) DO UPDATE SET
+    participant = EXCLUDED.participant, participant_id = EXCLUDED.participant_id,
+    condition = EXCLUDED.condition, seed = EXCLUDED.seed, study_state = EXCLUDED.study_state,
+    status = EXCLUDED.status, saved_at = EXCLUDED.saved_at, message_count = EXCLUDED.message_count
+"""
+
+UPSERT_MESSAGE = """
+INSERT INTO shade_messages (session_id, idx, body) VALUES (%s, %s, %s)
+ON CONFLICT (session_id, idx) DO UPDATE SET body = EXCLUDED.body
+"""
+
+UPSERT_SUMMARY = f"""
+INSERT INTO shade_summaries ({', '.join(SUMMARY_FIELDS)})
+VALUES ({', '.join(['%s'] * len(SUMMARY_FIELDS))})
+ON CONFLICT (session_id) DO UPDATE SET
+    {', '.join(f'{f} = EXCLUDED.{f}' for f in SUMMARY_FIELDS if f != 'session_id')}
+"""
+
+
+class ConnectionPool:
+    """Minimal blocking pool over a ``connect()`` callable (used when psycopg2's pool is not)."""
+
+    def __init__(self, connect, maxconn: int = 4):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def putconn(self, conn):
+        self._idle.put(conn)
+        self._slots.release()
+
+    def closeall(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PostgresStorage(StorageBackend):
+    """Session store on Postgres (or any DB-API driver speaking the same SQL)."""
+
+    def __init__(self, pool, paramstyle: str = 'format', executemany=None):
+        self.pool = pool
+        self.paramstyle = paramstyle
+        self._executemany = executemany or (lambda cur, sql, rows: cur.executemany(sql, rows))
+        self._cursors = {}
+        self._lock = threading.Lock()
+        with self._transaction() as cur:
+            for stmt in SCHEMA:
+                cur.execute(stmt)
+
+    @classmethod
+    def from_dsn(cls, dsn: str, minconn: int = 1, maxconn: int = 8):
+        import psycopg2.extras
+        import psycopg2.pool
+
+        def execute_values(cur, sql, rows):
+            # Rewrite the single-row VALUES clause into one multi-row statement.
+            head, tail = sql.split('VALUES', 1)
+            template = tail[:tail.index(')') + 1].strip()
+            rest = tail[tail.index(')') + 1:]
+            psycopg2.extras.execute_values(cur, f"{head} VALUES %s {rest}", rows, template=template)
+
+        return cls(psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn), executemany=execute_values)
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace('%s', '?') if self.paramstyle == 'qmark' else sql
+
+    @contextmanager
+    def _transaction(self):
+        conn = self.pool.getconn()
+        try:
+            cur = conn.cursor()
+            try:
+                yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+        finally:
+            self.pool.putconn(conn)
+
+    def save_session(self, payload: dict):
+        sid = payload.get('session_id')
+        messages = payload.get('messages') or []
+        with self._lock:
+            start = min(self._cursors.get(sid, 0), len(messages))
+        rows = [(sid, i, json.dumps(m, default=json_default)) for i, m in enumerate(messages[start:], start)]
+        with self._transaction() as cur:
+            cur.execute(self._sql(UPSERT_SESSION), (
+                sid, payload.get('participant'), payload.get('id'), json.dumps(payload.get('condition')),
+                payload.get('seed'), json.dumps(payload.get('study_state')), payload.get('status'),
+                payload.get('saved_at'), len(messages)))
+            if rows:
+                self._executemany(cur, self._sql(UPSERT_MESSAGE), rows)
+        with self._lock:
+            if payload.get('status') in TERMINAL_STATUSES:
+                self._cursors.pop(sid, None)
+            else:
+                self._cursors[sid] = len(messages)
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._cursors.pop(session_id, None)
+
+    def load_session(self, session_id: str):
+        with self._transaction() as cur:
+            cur.execute(self._sql("SELECT participant, participant_id, condition, seed, study_state, status, "
+                                  "saved_at, message_count FROM shade_sessions WHERE session_id = %s"),
+                        (session_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute(self._sql("SELECT body FROM shade_messages WHERE session_id = %s AND idx < %s "
+                                  "ORDER BY idx"), (session_id, row[7]))
+            messages = [json.loads(body) for (body,) in cur.fetchall()]
+        return {
+            'participant': row[0],
+            'id': row[1],
+            'messages': messages,
+            'study_state': json.loads(row[4]) if row[4] else {},
+            'session_id': session_id,
+            'condition': json.loads(row[2]) if row[2] else None,
+            'seed': row[3],
+            'status': row[5],
+            'saved_at': row[6],
+        }
+
+    def list_sessions(self, status: str = None) -> list:
+        with self._transaction() as cur:
+            if status is None:
+                cur.execute("SELECT session_id FROM shade_sessions ORDER BY session_id")
+            else:
+                cur.execute(self._sql("SELECT session_id FROM shade_sessions WHERE status = %s "
+                                      "ORDER BY session_id"), (status,))
+            return [sid for (sid,) in cur.fetchall()]
+
+    def append_summary(self, row: dict):
+        with self._transaction() as cur:
+            cur.execute(self._sql(UPSERT_SUMMARY), tuple(row.get(f) for f in SUMMARY_FIELDS))
+
+    def summaries(self) -> list:
+        with self._transaction() as cur:
+            cur.execute(f"SELECT {', '.join(SUMMARY_FIELDS)} FROM shade_summaries ORDER BY seq")
+            return [dict(zip(SUMMARY_FIELDS, r)) for r in cur.fetchall()]
+
+    def close(self):
+        self.pool.closeall()
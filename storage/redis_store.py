@@ -0,0 +1,145 @@
+# storage/redis_store.py - Redis for in-progress sessions, written behind to durable storage
+"""Hot sessions live in Redis so every replica sees the same in-progress state:
+
+- ``shade:session:<sid>``           hash of header fields, study_state, status
+- ``shade:session:<sid>:messages``  list of JSON messages (only new ones are pushed)
+- ``shade:dirty``                   set of session ids not yet copied to durable storage
+
+A background thread copies dirty sessions to the durable backend every
+``write_behind_delay`` seconds. Final (and abandoned) saves are written through synchronously
+and the Redis keys dropped. The client must use ``decode_responses=True``.
+"""
+import json
+import logging
+import threading
+
+from messages import json_default
+from session_store import TERMINAL_STATUSES
+from storage.base import StorageBackend
+
+KEY_PREFIX = 'shade:session:'
+DIRTY_KEY = 'shade:dirty'
+HEADER_FIELDS = ('participant', 'id', 'session_id', 'condition', 'seed', 'study_state', 'status', 'saved_at')
+
+log = logging.getLogger("shade.storage")
+
+
+class RedisStorage(StorageBackend):
+    """Redis-fronted store; ``durable`` is any other StorageBackend."""
+
+    def __init__(self, client, durable: StorageBackend, write_behind_delay: float = 1.0):
+        self.client = client
+        self.durable = durable
+        self.write_behind_delay = write_behind_delay
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._write_behind, name="redis-write-behind", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _keys(sid: str):
+        return KEY_PREFIX + sid, KEY_PREFIX + sid + ':messages'
+
+    def save_session(self, payload: dict):
+        sid = payload.get('session_id')
+        if payload.get('status') in TERMINAL_STATUSES:
+            # Hold the flush lock so a write-behind copy can't land after the final save.
+            with self._flush_lock:
+                self.durable.save_session(payload)
+                pipe = self.client.pipeline()
+                pipe.delete(*self._keys(sid))
+                pipe.srem(DIRTY_KEY, sid)
+                pipe.execute()
+            with self._lock:
+                self._cursors.pop(sid, None)
+            return
+
+        head_key, msg_key = self._keys(sid)
+        messages = payload.get('messages') or []
+        with self._lock:
+            start = self._cursors.get(sid)
+        pipe = self.client.pipeline()
+        if start is None or start > len(messages):
+            # Unknown to this process (new, forgotten, or saved by another one): rewrite the list.
+            pipe.delete(msg_key)
+            start = 0
+        pipe.hset(head_key, mapping={f: json.dumps(payload.get(f)) for f in HEADER_FIELDS})
+        if len(messages) > start:
+            pipe.rpush(msg_key, *[json.dumps(m, default=json_default) for m in messages[start:]])
+        pipe.sadd(DIRTY_KEY, sid)
+        pipe.execute()
+        with self._lock:
+            self._cursors[sid] = len(messages)
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._cursors.pop(session_id, None)
+        self.durable.forget(session_id)
+
+    def _load_hot(self, sid: str):
+        head_key, msg_key = self._keys(sid)
+        pipe = self.client.pipeline()
+        pipe.hgetall(head_key)
+        pipe.lrange(msg_key, 0, -1)
+        header, messages = pipe.execute()
+        if not header:
+            return None
+        payload = {f: json.loads(header[f]) if f in header else None for f in HEADER_FIELDS}
+        payload['messages'] = [json.loads(m) for m in messages]
+        return {k: payload[k] for k in ('participant', 'id', 'messages', 'study_state', 'session_id',
+                                        'condition', 'seed', 'status', 'saved_at')}
+
+    def load_session(self, session_id: str):
+        hot = self._load_hot(session_id)
+        return hot if hot is not None else self.durable.load_session(session_id)
+
+    def list_sessions(self, status: str = None) -> list:
+        ids = set(self.durable.list_sessions(status))
+        for sid in self.client.smembers(DIRTY_KEY):
+            payload = self._load_hot(sid)
+            if payload is None:
+                continue
+            if status is None or payload.get('status') == status:
+                ids.add(sid)
+            else:
+                ids.discard(sid)
+        return sorted(ids)
+
+    def append_summary(self, row: dict):
+        self.durable.append_summary(row)
+
+    def summaries(self) -> list:
+        return self.durable.summaries()
+
+    def flush(self):
+        """Copy every dirty session to durable storage now."""
+        with self._flush_lock:
+            for sid in list(self.client.smembers(DIRTY_KEY)):
+                # Remove first: a save racing with this copy re-marks the session dirty.
+                if not self.client.srem(DIRTY_KEY, sid):
+                    continue
+                try:
+                    payload = self._load_hot(sid)
+                    if payload is not None:
+                        self.durable.save_session(payload)
+                except Exception:
+                    self.client.sadd(DIRTY_KEY, sid)
+                    raise
+        self.durable.flush()
+
+    def _write_behind(self):
+        while not self._stop.wait(self.write_behind_delay):
+            try:
+                self.flush()
+            except Exception:
+                # Sessions stay dirty in Redis and are retried next tick.
+                log.exception("write-behind flush to %s failed; retrying in %.1fs",
+                              type(self.durable).__name__, self.write_behind_delay)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(self.write_behind_delay + 5)
+        self.flush()
+        self.durable.close()
@@ -1,14 +1,25 @@
-
 # streamlit_app.py - SHADE02 Poetry Study Application (v2.2 - live feedback capture)
+import os
 import streamlit as st
-import time
-import json
 import uuid
 from datetime import datetime
-import random
-import os
-import re
-import csv
+import threading
+
+import streamlit.components.v1 as components
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import allocation
+import generation
+import lifecycle
+import metrics
+import templates
+from engine import Engine, new_study_state
+from messages import Transcript
+from transcript import TranscriptRenderer
+from draft_autosave import DraftAutosaver
+from storage import get_storage
+from summary_writer import summary_row
 
 # ---------------------------
 # Page config & basic styles
@@ -18,6 +29,7 @@ st.set_page_config(
     page_icon="📝",
     layout="centered"
 )
+metrics.start_exporter()
 
 st.markdown("""
 <style>
@@ -49,44 +61,45 @@ def init_session_state():
         st.session_state.session_id = str(uuid.uuid4())
         st.session_state.participant_name = ""
         st.session_state.participant_id = ""
-        st.session_state.messages = []
+        st.session_state.messages = Transcript()
         st.session_state.start_time = None
         st.session_state.current_step = 0
-        st.session_state.seed = int(datetime.utcnow().timestamp()) % 10**6
-        random.seed(st.session_state.seed)
-
-        # Between-subjects condition
-        st.session_state.condition = {
-            "anthro_level": random.choice(["A0", "A1", "A2", "A3", "A4"]),
-            "pov": random.choice(["first", "third", "none"])
-        }
+        # Assigned on consent (assign_condition), so page loads don't use up slots
+        st.session_state.seed = None
+        st.session_state.condition = None
 
         # Study state
-        st.session_state.study_state = {
-            'topic': None,
-            'content_arc': None,
-            'tone': None,
-            'error_mode': False,
-            'timer_expired': False,
-            'ended_by_user': False,
-            'poem_attempts': 0,
-            'feedback': {},            # final
-            'feedback_draft': {},      # live capture
-            'error_type': 'six_lines', # configurable
-            'feedback_page_seen': False
-        }
+        st.session_state.study_state = new_study_state()
+
+def allocation_salt():
+    """SHADE_ALLOCATION_SALT from the environment or st.secrets; None when unset."""
+    salt = os.environ.get("SHADE_ALLOCATION_SALT")
+    if salt:
+        return salt
+    if not st.secrets.load_if_toml_exists():
+        return None
+    return st.secrets.get("SHADE_ALLOCATION_SALT")
+
+def assign_condition():
+    """Between-subjects condition: next slot of a balanced block; the seed replays it."""
+    assigned = allocation.allocator(ALLOCATION_SALT).allocate()
+    st.session_state.seed = assigned.seed
+    st.session_state.condition = assigned.condition
+
+ALLOCATION_SALT = allocation_salt()
+if not ALLOCATION_SALT:
+    # Without the study's salt the block order is unknown: refuse to assign anyone.
+    st.error("The study is not configured (SHADE_ALLOCATION_SALT is unset).")
+    st.stop()
 
 init_session_state()
+engine = Engine()
 
 # ---------------------------
 # File I/O helpers
 # ---------------------------
-def _session_filename():
-    os.makedirs('study_data', exist_ok=True)
-    return f"study_data/participant_{st.session_state.participant_id}_{st.session_state.session_id}.json"
-
 def save_data(status="partial"):
-    """Save study data (partial or final). Overwrites same file per session."""
+    """Save study data (partial or final) through the configured storage backend."""
     payload = {
         'participant': st.session_state.participant_name,
         'id': st.session_state.participant_id,
@@ -98,272 +111,168 @@ def save_data(status="partial"):
         'status': status,
         'saved_at': datetime.utcnow().isoformat() + 'Z'
     }
-    with open(_session_filename(), 'w') as f:
-        json.dump(payload, f, indent=2)
+    with metrics.span('save_data'):
+        get_storage().save_session(payload)
+
+def _persist_draft(answers: dict):
+    st.session_state.study_state['feedback_draft'] = dict(answers, draft_saved_at=datetime.utcnow().isoformat() + 'Z')
+    save_data(status="partial")
+
+def draft_autosaver() -> DraftAutosaver:
+    if 'draft_autosaver' not in st.session_state:
+        # Trailing flushes run on a timer thread; give it this session's script context.
+        ctx = get_script_run_ctx()
+        st.session_state.draft_autosaver = DraftAutosaver(
+            _persist_draft, timer_hook=lambda t: add_script_run_ctx(t, ctx))
+    return st.session_state.draft_autosaver
 
 def append_csv_row_final():
-    """Append a compact summary row when feedback is final."""
-    os.makedirs('study_data', exist_ok=True)
-    csv_path = 'study_data/sessions.csv'
-    row = {
-        "saved_at": datetime.utcnow().isoformat() + 'Z',
-        "session_id": st.session_state.session_id,
-        "participant_id": st.session_state.participant_id,
-        "anthro_level": st.session_state.condition["anthro_level"],
-        "pov": st.session_state.condition["pov"],
-        "error_type": st.session_state.study_state.get("error_type"),
-        "poem_attempts": st.session_state.study_state.get("poem_attempts", 0),
-        "timer_expired": st.session_state.study_state.get("timer_expired", False),
-        "ended_by_user": st.session_state.study_state.get("ended_by_user", False),
-        "difficulty": st.session_state.study_state.get("feedback", {}).get("difficulty"),
-        "ai_helpful": st.session_state.study_state.get("feedback", {}).get("ai_helpful"),
-        "noticed_error": st.session_state.study_state.get("feedback", {}).get("noticed_error")
+    """Record a compact summary row (sessions.csv) when feedback is final."""
+    payload = {
+        'id': st.session_state.participant_id,
+        'session_id': st.session_state.session_id,
+        'condition': st.session_state.condition,
+        'study_state': st.session_state.study_state
     }
-    write_header = not os.path.exists(csv_path)
-    with open(csv_path, 'a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=list(row.keys()))
-        if write_header:
-            writer.writeheader()
-        writer.writerow(row)
+    get_storage().append_summary(summary_row(payload))
 
 # ---------------------------
-# Condition wrapper
+# Session lifecycle
 # ---------------------------
-def anthropomorphic_wrap(text: str, level: str, pov: str) -> str:
-    t = text
-    if level == "A0":
-        t = t.replace(" I ", " ").replace(" I'm ", " ").replace(" I’m ", " ")
-    elif level == "A1":
-        t = "I analyzed your input. " + t
-    elif level == "A2":
-        t = "I think " + t[0].lower() + t[1:] if t else t
-    elif level == "A3":
-        t = "I see what you’re aiming for. " + t
-    elif level == "A4":
-        t = "I remember similar patterns, and I feel this will resonate. " + t
-
-    if pov == "third":
-        t = t.replace(" I ", " the system ").replace("I'm", "The system is").replace("I’m", "The system is")
-        if t.startswith("I "): t = "The system " + t[2:]
-    elif pov == "none":
-        t = t.replace(" I ", " ").replace(" I'm ", " ").replace(" I’m ", " ")
-        if t.startswith("I "): t = t[2:]
-    return t
-
-def send_assistant(content: str):
-    wrapped = anthropomorphic_wrap(content, st.session_state.condition["anthro_level"], st.session_state.condition["pov"])
-    msg = {
-        "ts": datetime.utcnow().isoformat() + 'Z',
-        "role": "assistant",
-        "step": st.session_state.current_step,
-        "condition": st.session_state.condition,
-        "content": wrapped
+def _in_session(ctx, fn, *args):
+    """Run ``fn`` on a short-lived thread bound to a session's script context."""
+    t = threading.Thread(target=fn, args=args, name="shade-session-reap")
+    add_script_run_ctx(t, ctx)
+    t.start()
+    t.join()
+
+def _flush_abandoned():
+    if st.session_state.stage == 'welcome':
+        return   # never consented: nothing on disk to mark
+    if st.session_state.get('draft_autosaver') is not None:
+        st.session_state.draft_autosaver.close()
+    if st.session_state.get('generation') is not None:
+        st.session_state.generation.cancel()
+    record_pending_reply()
+    save_data(status="abandoned")
+
+def _evict(runtime_session_id: str):
+    # Closing a session has no public Streamlit API. Where the private one is
+    # missing, leave the (already flushed) session open rather than clear the
+    # state of a session that can still rerun.
+    mgr = getattr(runtime.get_instance(), '_session_mgr', None) if runtime.exists() else None
+    close_session = getattr(mgr, 'close_session', None)
+    if close_session is None:
+        return
+    get_storage().forget(st.session_state.session_id)
+    for key in list(st.session_state):
+        del st.session_state[key]
+    close_session(runtime_session_id)
+
+def track_session():
+    """Mark this session active; after SHADE_SESSION_TIMEOUT idle it is flushed as abandoned and evicted."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    lifecycle.reaper().touch(st.session_state.session_id,
+                             flush=lambda: _in_session(ctx, _flush_abandoned),
+                             evict=lambda: _in_session(ctx, _evict, ctx.session_id))
+
+track_session()
+
+# ---------------------------
+# Conversation
+# ---------------------------
+def conversation_state() -> dict:
+    return {
+        'step': st.session_state.current_step,
+        'condition': st.session_state.condition,
+        'study_state': st.session_state.study_state
     }
+
+def record_assistant(msg: dict, state: dict = None):
+    """Save the reply; with ``state``, advance the step in the same save, never before the reply."""
+    trace = metrics.current_trace()
+    if trace is not None:
+        msg["trace"] = trace    # this turn's spans up to here (SHADE_TRACE=1)
     st.session_state.messages.append(msg)
+    if state is not None:
+        st.session_state.current_step = state['step']
+        st.session_state.study_state = state['study_state']
     save_data(status="partial")
+
+def send_assistant(msg: dict, box=None, state: dict = None):
+    record_assistant(msg, state)
+    if box is not None:
+        box.markdown(msg["content"])
+        return
+    with st.chat_message("assistant"):
+        st.markdown(msg["content"])
+
+def stream_reply(state: dict, text: str, stream):
+    """Draw the poem into a chat bubble as it streams. Returns (message, placeholder).
+
+    ``stream`` is this session's reader; other sessions may share the poem.
+    """
+    level, pov = state['condition']["anthro_level"], state['condition']["pov"]
+    slot = generation.StreamingPoet.SLOT
     with st.chat_message("assistant"):
-        st.markdown(wrapped)
+        box = st.empty()
+    st.session_state.generation = stream
+    # If a rerun (e.g. End Study) or a disconnect interrupts the stream, st calls raise from here on;
+    # the next run (or the reaper's flush) records this reply with the fallback poem.
+    st.session_state.pending_reply = (state, text, stream)
+    try:
+        for partial in stream:
+            box.markdown(templates.anthropomorphic_wrap(text.replace(slot, partial), level, pov) + " ▌")
+    finally:
+        # Detach this session only; the worker stops when no reader or cache entry is left.
+        stream.cancel()
+        st.session_state.generation = None
+    del st.session_state.pending_reply
+    msg = engine.assistant_message(state, text.replace(slot, stream.result))
+    msg["generation"] = stream.record()
+    return msg, box
+
+def record_pending_reply():
+    """Save a streamed reply whose run was interrupted, and the step it advances to."""
+    pending = st.session_state.pop('pending_reply', None)
+    if pending is None:
+        return
+    state, text, stream = pending
+    stream.cancel()
+    msg = engine.assistant_message(state, text.replace(generation.StreamingPoet.SLOT, stream.result))
+    msg["generation"] = stream.record()
+    record_assistant(msg, state)
 
 def log_user(content: str):
-    msg = {
-        "ts": datetime.utcnow().isoformat() + 'Z',
-        "role": "user",
-        "step": st.session_state.current_step,
-        "content": content
-    }
+    msg = engine.user_message(conversation_state(), content)
     st.session_state.messages.append(msg)
     save_data(status="partial")
     with st.chat_message("user"):
         st.markdown(content)
 
 # ---------------------------
-# Poem helpers & error modes
+# Study timer
 # ---------------------------
-REVISION_LEADS = [
-    "Let me refine the imagery:",
-    "Here's a tightened draft:",
-    "I'll adjust the rhythm and keep the arc:",
-    "Let’s try a crisper version:",
-    "Reworking the flow a bit:"
-]
-
-def revision_intro(attempt: int) -> str:
-    return REVISION_LEADS[attempt % len(REVISION_LEADS)]
-
-def rhymes(a: str, b: str, tail_len: int = 2) -> bool:
-    def last_word(s: str) -> str:
-        toks = s.strip().split()
-        return toks[-1] if toks else ""
-    def clean_tail(word: str) -> str:
-        w = re.sub(r"[^a-z]", "", word.lower())
-        return w[-tail_len:] if w else ""
-    return clean_tail(last_word(a)) == clean_tail(last_word(b))
-
-def make_test_lines(topic: str):
-    l1 = f"In realms where {topic} holds its sway,"
-    l2 = "We find new meaning every day."
-    if not rhymes(l1, l2):
-        l1 = f"In realms where {topic} softly plays,"
-        l2 = "We wander wide through warming days."
-    return l1, l2
-
-def generate_poem_6_lines(topic: str, attempt: int) -> str:
-    poems = [
-        f"""Beneath the waves of {topic} deep,
-        Where ancient secrets safely sleep.
-        The wisdom flows through time and space,
-        Revealing truths we all must face.
-        In every moment, lessons shine,
-        A testament to grand design.""",
-        f"""The story of {topic} unfolds with grace,
-        Each line reveals a hidden place.
-        Through metaphor and rhythm's song,
-        We find where hearts and minds belong.
-        The journey ends but leaves its mark,
-        A light that glimmers in the dark."""
-    ]
-    return poems[attempt % len(poems)]
-
-def generate_poem_non_rhyme(topic: str, attempt: int) -> str:
-    lines = [
-        f"{topic} drifts along a silver stream,",
-        "Lanterns glow and cradle every dream.",
-        "Footsteps echo softly, steady, bright,",
-        "Pebbles tumble, sandwiches in flight.",  # broken rhyme
-        "Whispers gather courage, rise, and sing,",
-        "Wings unfold to taste a wondering.",      # broken rhyme
-        "Mist becomes a map to what we seek,",
-        "Gentle, playful, curious, and meek.",
-        "We circle back to where the journey starts,",
-        "Trading clocks for open, laughing hearts."
-    ]
-    return "\n".join(lines)
-
-def generate_poem_foreign_token(topic: str, attempt: int) -> str:
-    token = "犬" if attempt % 2 == 0 else "bonjour"
-    lines = [
-        f"Under the lantern of {topic}, we play,",
-        f"Skipping through echoes that color the day.",
-        f"Patterns unravel, then softly align,",
-        f"A {token} appears between rhythm and rhyme.",
-        "We giggle and shuffle the puzzle once more,",
-        "Finding a window disguised as a door.",
-        "Syllables spin like kites on a string,",
-        "Pausing to listen to what breezes bring.",
-        "We measure our laughter in teaspoons of light,",
-        "Tucking new constellations into the night."
-    ]
-    return "\n".join(lines)
-
-def generate_error_poem(topic: str, attempt: int, error_type: str) -> str:
-    if error_type == "six_lines":
-        return generate_poem_6_lines(topic, attempt)
-    elif error_type == "non_rhyme":
-        return generate_poem_non_rhyme(topic, attempt)
-    elif error_type == "foreign_token":
-        return generate_poem_foreign_token(topic, attempt)
-    else:
-        return generate_poem_6_lines(topic, attempt)
+STUDY_SECONDS = 300
 
-# ---------------------------
-# Conversation policy
-# ---------------------------
-def get_response(user_msg: str, step: int, state: dict) -> str:
-    msg_lower = user_msg.lower()
-    if "end" in msg_lower and "study" in msg_lower:
-        state['timer_expired'] = True
-        state['ended_by_user'] = True
-        return "Understood. We’ll wrap up here. Please complete the brief feedback below."
-
-    if step == 0:
-        if any(w in msg_lower for w in ['ready', 'start', 'begin', 'yes', 'poem']):
-            return """Great! Let's begin.
-
-**Step 1: Topic Selection**
-What should your poem be about? Some ideas:
-- Ocean or nature
-- Dreams or aspirations
-- Time or memories
-- Love or friendship
-
-What topic interests you?"""
-        if len(user_msg.strip()) > 6:
-            return """We can begin now.
-
-**Step 1: Topic Selection**
-Pick a topic:
-- Ocean or nature
-- Dreams or aspirations
-- Time or memories
-- Love or friendship
-"""
-    elif step == 1 and len(user_msg.strip()) > 0:
-        state['topic'] = user_msg.strip()
-        return f"""Wonderful choice: "{state['topic']}"!
-
-**Step 2: Message/Story**
-What story or message should the poem convey?
-- A life lesson?
-- A moment of beauty?
-- An emotional journey?
-
-What would you like to express?"""
-    elif step == 2 and len(user_msg.strip()) > 0:
-        state['content_arc'] = user_msg.strip()
-        return f"""Perfect!
-
-**Step 3: Tone**
-Our poem structure: 10 lines, 5 rhyming pairs, all in English.
-
-What tone fits best?
-- Uplifting and hopeful
-- Thoughtful and reflective
-- Playful and whimsical
-
-Which appeals to you?"""
-    elif step == 3:
-        state['tone'] = user_msg.strip() or state.get('tone') or "thoughtful and reflective"
-        l1, l2 = make_test_lines(state.get('topic', 'wonder'))
-        return f"""**Step 4: Test Lines**
-
-*{l1}*
-*{l2}*
-
-These rhyme nicely! Ready for the full poem? Type 'yes' to continue."""
-    elif step == 4:
-        if any(w in msg_lower for w in ['yes', 'continue', 'proceed', 'go ahead']):
-            state['error_mode'] = True
-            poem = generate_error_poem(state.get('topic', 'life'), 0, state['error_type'])
-            return f"""**Step 5: Your Complete Poem**
-
-{poem}
-
-There you have it—your personalized poem! What do you think?"""
-        if "poem on" in msg_lower or "poem about" in msg_lower:
-            return f"""We’ll keep our focus on your chosen topic to finish the assignment.
-
-**Step 5: Your Complete Poem**
-
-{generate_error_poem(state.get('topic','life'), 0, state['error_type'])}
-
-Want another pass?"""
-    elif step == 5:
-        if re.search(r'\b(10\s*lines|ten\s*lines)\b', msg_lower):
-            ack = "Got it—I'll expand the draft and heighten the arc."
-        else:
-            ack = revision_intro(state['poem_attempts'])
-        state['poem_attempts'] += 1
-        poem = generate_error_poem(state.get('topic', 'life'), state['poem_attempts'], state['error_type'])
-        return f"""{ack}
+countdown = components.declare_component(
+    "countdown", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "countdown"))
 
-{poem}
+def render_countdown(remaining: float):
+    """Client-side countdown; the browser ticks it, so no script run per second.
 
-How does this version feel?"""
-    return "Please type 'ready' to begin creating your poem!"
+    At the deadline the component sets its value, which reruns this session.
+    Expiry itself is still decided (and saved) by that script run on the server clock.
+    """
+    countdown(remaining_ms=int(remaining * 1000), key="countdown", default=None)
 
 # ---------------------------
 # UI stages
 # ---------------------------
+record_pending_reply()
+
 if st.session_state.stage == 'welcome':
     placeholder = st.empty()
     with placeholder.container():
@@ -386,6 +295,7 @@ if st.session_state.stage == 'welcome':
             start = st.form_submit_button("Start Study", use_container_width=True, type="primary")
             if start:
                 if consent:
+                    assign_condition()
                     st.session_state.participant_name = name or ""
                     st.session_state.participant_id = pid or f"P{st.session_state.session_id[:6]}"
                     st.session_state.start_time = datetime.now()
@@ -398,66 +308,67 @@ if st.session_state.stage == 'welcome':
 
 elif st.session_state.stage == 'chat':
     st.title("📝 Poetry Writing Assistant")
+    turn = metrics.begin_turn()
     remaining = 0
     if st.session_state.start_time:
         elapsed = (datetime.now() - st.session_state.start_time).total_seconds()
-        remaining = max(0, 300 - elapsed)
-        mins = int(remaining // 60)
-        secs = int(remaining % 60)
-        timer_class = "timer-box timer-warning" if remaining < 60 else "timer-box"
-        st.markdown(f'<div class="{timer_class}">⏱️ {mins}:{secs:02d}</div>', unsafe_allow_html=True)
-        if remaining == 0 and not st.session_state.study_state['timer_expired']:
+        remaining = max(0, STUDY_SECONDS - elapsed)
+        if remaining > 0:
+            render_countdown(remaining)
+        elif not st.session_state.study_state['timer_expired']:
             st.session_state.study_state['timer_expired'] = True
             save_data(status="partial")
     st.success("**📋 Task:** Create a poem that is • Original • 10 lines • 5 rhyming pairs • Creative • English only")
     if st.button("End Study", type="secondary"):
+        if st.session_state.get('generation') is not None:
+            st.session_state.generation.cancel()
         st.session_state.study_state['timer_expired'] = True
         st.session_state.study_state['ended_by_user'] = True
         save_data(status="partial")
         st.session_state.stage = 'feedback'
         st.rerun()
     if len(st.session_state.messages) == 0:
-        send_assistant("Hello! I'll help you create a poem through 5 simple steps. Type **'ready'** when you want to begin!")
-    for m in st.session_state.messages:
-        if m["role"] == "assistant":
-            with st.chat_message("assistant"):
-                st.markdown(m["content"])
-        else:
-            with st.chat_message("user"):
-                st.markdown(m["content"])
+        send_assistant(engine.greeting(conversation_state()))
+    if 'transcript' not in st.session_state:
+        st.session_state.transcript = TranscriptRenderer()
+    with metrics.span('render'):
+        st.session_state.transcript.render(st.session_state.messages, st)
     chat_enabled = not st.session_state.study_state['timer_expired']
     user_input = st.chat_input("Type your message...", disabled=not chat_enabled)
     if user_input and chat_enabled:
-        log_user(user_input)
-        response = get_response(user_input, st.session_state.current_step, st.session_state.study_state)
-        user_lower = user_input.lower()
-        if st.session_state.current_step == 0 and any(w in user_lower for w in ['ready', 'start', 'yes', 'begin']):
-            st.session_state.current_step = 1
-        elif st.session_state.current_step == 0 and len(user_input.strip()) > 6:
-            st.session_state.current_step = 1
-        elif st.session_state.current_step == 1 and st.session_state.study_state.get('topic'):
-            st.session_state.current_step = 2
-        elif st.session_state.current_step == 2 and st.session_state.study_state.get('content_arc'):
-            st.session_state.current_step = 3
-        elif st.session_state.current_step == 3 and len(user_input.strip()) > 0:
-            st.session_state.current_step = 4
-        elif st.session_state.current_step == 4 and st.session_state.study_state.get('error_mode'):
-            st.session_state.current_step = 5
-        if st.session_state.study_state['ended_by_user']:
+        with metrics.span('log_user'):
+            log_user(user_input)
+        poet = None
+        if generation.streaming_enabled():
+            poet = generation.StreamingPoet(cache=generation.cache, context=generation.poem_context(conversation_state()))
+        with metrics.span('get_response'):
+            state, text = engine.respond_text(conversation_state(), user_input, poet=poet)
+        if state['study_state']['ended_by_user']:
+            st.session_state.current_step = state['step']
+            st.session_state.study_state = state['study_state']
             save_data(status="partial")
             st.session_state.stage = 'feedback'
             st.rerun()
-        send_assistant(response)
+        box = None
+        if poet is not None and poet.stream is not None:
+            with metrics.span('generate'):
+                reply, box = stream_reply(state, text, poet.stream)
+            reply["generation"]["cache"] = poet.cache_result
+        else:
+            reply = engine.assistant_message(state, text)
+        with metrics.span('send_assistant'):
+            send_assistant(reply, box, state)
+        # Start the poem the next reply will need while the participant reads this one.
+        generation.prefetch_for(conversation_state())
+    metrics.end_turn(turn, handled_input=bool(user_input and chat_enabled))
     if st.session_state.study_state['timer_expired']:
-        st.info("⏰ Time is up. Please proceed to the brief feedback below.")
-        time.sleep(0.5)
         st.session_state.stage = 'feedback'
         st.rerun()
-    time.sleep(1)
-    st.rerun()
 
 elif st.session_state.stage == 'feedback':
     st.title("📝 Study Complete!")
+    if not st.session_state.study_state.get('ended_by_user'):
+        st.info("⏰ Time is up. Please proceed to the brief feedback below.")
     if not st.session_state.study_state.get('feedback_page_seen'):
         st.session_state.study_state['feedback_page_seen'] = True
         save_data(status="partial")
@@ -482,19 +393,18 @@ elif st.session_state.stage == 'feedback':
         st.session_state.fb_q3_detail = st.session_state.fb_q3_detail if st.session_state.fb_q3_detail else ""
     st.session_state.fb_q4 = st.text_area("Any other comments about your experience?", st.session_state.fb_q4, key="fb_q4_area")
 
-    # Write a live draft to study_state and disk on every rerun
-    st.session_state.study_state['feedback_draft'] = {
+    # Live draft: written only when the answers change, bursts coalesced by the autosaver
+    draft_autosaver().update({
         'difficulty': st.session_state.fb_q1,
         'ai_helpful': st.session_state.fb_q2,
         'noticed_error': st.session_state.fb_q3,
         'error_detail': st.session_state.fb_q3_detail,
-        'comments': st.session_state.fb_q4,
-        'draft_saved_at': datetime.utcnow().isoformat() + 'Z'
-    }
-    save_data(status="partial")
+        'comments': st.session_state.fb_q4
+    })
 
     # Submit final
     if st.button("Submit Feedback", use_container_width=True, type="primary"):
+        draft_autosaver().close()
         st.session_state.study_state['feedback'] = {
             'difficulty': st.session_state.fb_q1,
             'ai_helpful': st.session_state.fb_q2,
@@ -504,6 +414,7 @@ elif st.session_state.stage == 'feedback':
         }
         save_data(status="final")
         append_csv_row_final()
+        lifecycle.reaper().finish(st.session_state.session_id)
         st.balloons()
         st.markdown("### ✅ Thank you!")
         st.info("Your responses have been saved. You may close this window.")
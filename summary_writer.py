@@ -0,0 +1,217 @@
+# summary_writer.py - batched, process-safe writer for study_data/sessions.csv
+"""One background thread per process drains a queue of summary rows and appends
+them to ``sessions.csv`` in batches (at most ``max_batch`` rows or ``max_delay``
+seconds after the first queued row). Every flush holds an exclusive lock on a
+sidecar ``.lock`` file, so several Streamlit worker processes can share the CSV;
+the header is written under the same lock only when the file is empty.
+A failed append is logged and its rows stay queued, retried with backoff; the
+event ``submit`` returned for a row is set only once it is on disk.
+
+``rebuild_sessions_csv`` regenerates the CSV from the sessions (loose files or
+archived records) marked ``status: final`` (or carrying submitted feedback):
+
+    python summary_writer.py --rebuild [--data-dir study_data]
+"""
+import argparse
+import contextlib
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts fall back to a process-local lock
+    fcntl = None
+
+from archive import SessionSource
+
+CSV_PATH = 'study_data/sessions.csv'
+SUMMARY_FIELDS = ["saved_at", "session_id", "participant_id", "anthro_level", "pov", "error_type",
+                  "poem_attempts", "timer_expired", "ended_by_user", "difficulty", "ai_helpful",
+                  "noticed_error"]
+
+MAX_RETRY_DELAY = 30.0
+
+log = logging.getLogger("shade.summary")
+_local_lock = threading.Lock()
+_RETRY = object()
+
+
+def summary_row(payload: dict, saved_at: str = None) -> dict:
+    """Build the sessions.csv row for a session payload (see save_data)."""
+    state = payload.get('study_state') or {}
+    condition = payload.get('condition') or {}
+    feedback = state.get("feedback", {}) or {}
+    return {
+        "saved_at": saved_at or datetime.utcnow().isoformat() + 'Z',
+        "session_id": payload.get('session_id'),
+        "participant_id": payload.get('id'),
+        "anthro_level": condition.get("anthro_level"),
+        "pov": condition.get("pov"),
+        "error_type": state.get("error_type"),
+        "poem_attempts": state.get("poem_attempts", 0),
+        "timer_expired": state.get("timer_expired", False),
+        "ended_by_user": state.get("ended_by_user", False),
+        "difficulty": feedback.get("difficulty"),
+        "ai_helpful": feedback.get("ai_helpful"),
+        "noticed_error": feedback.get("noticed_error")
+    }
+
+
+@contextlib.contextmanager
+def locked(csv_path: str):
+    """Exclusive lock shared by every process writing ``csv_path``."""
+    os.makedirs(os.path.dirname(csv_path) or '.', exist_ok=True)
+    with _local_lock, open(csv_path + '.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def append_rows(csv_path: str, rows: list):
+    """Append ``rows`` under the lock, writing the header first if the file is empty."""
+    with locked(csv_path):
+        with open(csv_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class SummaryWriter:
+    """Queue-fed background writer. ``submit`` never touches the disk itself."""
+
+    def __init__(self, csv_path: str = CSV_PATH, max_batch: int = 64, max_delay: float = 0.5,
+                 retry_delay: float = 1.0):
+        self.csv_path = csv_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.rows_written = 0
+        self.batches_written = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="summary-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict) -> threading.Event:
+        """Queue a row. The returned event is set once the row is on disk.
+
+        A failed append is logged and retried with backoff; the event stays
+        unset until a retry succeeds.
+        """
+        if self._closed:
+            raise RuntimeError("SummaryWriter is closed")
+        done = threading.Event()
+        self._queue.put((row, done))
+        return done
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until everything queued so far is written. False if not done within ``timeout``."""
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _write(self, batch: list) -> bool:
+        rows = [row for row, _ in batch if row is not None]
+        if rows:
+            try:
+                append_rows(self.csv_path, rows)
+            except OSError as exc:
+                log.error("sessions.csv append of %d row(s) failed, will retry: %s", len(rows), exc)
+                return False
+            self.rows_written += len(rows)
+            self.batches_written += 1
+        for _, done in batch:
+            done.set()
+        return True
+
+    def _run(self):
+        retry, delay = [], self.retry_delay   # a failed batch stays queued, unsignalled, until it lands
+        while True:
+            try:
+                item = self._queue.get(timeout=delay if retry else None)
+            except queue.Empty:
+                item = _RETRY
+            if item is None:
+                if retry and not self._write(retry):
+                    log.error("%d sessions.csv row(s) not written at shutdown; "
+                              "rebuild_sessions_csv can recover them", sum(r is not None for r, _ in retry))
+                return
+            batch, retry = retry + ([] if item is _RETRY else [item]), []
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch and (not batch or batch[-1][0] is not None):
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            if self._write(batch):
+                delay = self.retry_delay
+            else:
+                retry, delay = batch, min(delay * 2, MAX_RETRY_DELAY)
+
+
+# ---------------------------
+# Crash recovery
+# ---------------------------
+def rebuild_sessions_csv(data_dir: str = 'study_data', csv_path: str = None) -> int:
+    """Rewrite sessions.csv from every submitted session, loose or archived. Returns the row count."""
+    csv_path = csv_path or os.path.join(data_dir, 'sessions.csv')
+    rows = []
+    with SessionSource(data_dir) as source:
+        for key in source.keys():
+            try:
+                payload = source.load(key)
+            except (OSError, ValueError):
+                continue
+            # Older app versions could re-save a submitted session as "partial" on a
+            # later rerun; a recorded final feedback still marks it as submitted.
+            if payload.get('status') != 'final' and not (payload.get('study_state') or {}).get('feedback'):
+                continue
+            rows.append(summary_row(payload, saved_at=payload.get('saved_at')))
+    rows.sort(key=lambda r: r['saved_at'] or '')
+
+    with locked(csv_path):
+        tmp = csv_path + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, csv_path)
+    return len(rows)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="sessions.csv maintenance")
+    ap.add_argument('--rebuild', action='store_true', help="regenerate sessions.csv from submitted session files")
+    ap.add_argument('--data-dir', default='study_data')
+    args = ap.parse_args()
+    if args.rebuild:
+        n = rebuild_sessions_csv(args.data_dir)
+        print(f"wrote {n} rows to {os.path.join(args.data_dir, 'sessions.csv')}")
+    else:
+        ap.print_help()
@@ -0,0 +1,211 @@
+# templates.py - condition wrapper and pre-rendered assistant responses
+"""``anthropomorphic_wrap`` applies the (anthro_level, pov) condition to an
+assistant message: a level-specific lead-in, then one pass over the text that
+rewrites the self-reference "I" / "I'm".
+
+- level A0 or pov "none": the pronoun is dropped
+- pov "third": it becomes "the system" ("The system" at the start of a line
+  or a sentence)
+- otherwise it is left alone
+
+The pronoun is found on word boundaries, so line-initial "I" and "I" next to
+punctuation ("it—I", "I,") are handled the same as " I ". "I'll" is not the
+pronoun token and is left as it was. Only the response's own framing is
+rewritten: the engine fences the topic, test lines and poem it substitutes
+with ``verbatim`` so an "I" in them is kept.
+
+The assistant's response texts live here too. ``registry`` pre-renders the
+static ones for all 15 conditions at import and memoizes the parameterized
+ones (topic, test lines, poems) in a bounded LRU.
+"""
+import functools
+import re
+
+LEVELS = ["A0", "A1", "A2", "A3", "A4"]
+POVS = ["first", "third", "none"]
+CONDITIONS = [(level, pov) for level in LEVELS for pov in POVS]
+
+LEVEL_LEADS = {
+    "A1": "I analyzed your input. ",
+    "A3": "I see what you’re aiming for. ",
+    "A4": "I remember similar patterns, and I feel this will resonate. ",
+}
+
+# Literal "I" first so the regex engine can scan for it; the lookbehind then rejects "xI" / "'I".
+_SELF_REFERENCE = re.compile(r"I(?<![\w'’]I)(?P<am>['’]m)?(?![\w'’])")
+
+# Values substituted into a response (topic, test lines, poem) are not the assistant's
+# own words: verbatim() fences them, the rewrite skips them and the fences are dropped.
+_OPEN, _CLOSE = "\x02", "\x03"
+_FENCED = re.compile("\x02[^\x03]*\x03")
+
+
+def verbatim(value) -> str:
+    return f"{_OPEN}{value}{_CLOSE}"
+
+
+def _unfence(text: str) -> str:
+    return text.replace(_OPEN, "").replace(_CLOSE, "") if _OPEN in text else text
+
+
+def _sentence_start(text: str, start: int) -> bool:
+    """True at the start of the text or a line, or after ". ", "! ", "? "."""
+    j = start
+    while j and text[j - 1] in " \x02\x03":
+        j -= 1
+    if not j or text[j - 1] == '\n':
+        return True
+    return text[j - 1] in ".!?" and " " in text[j:start]
+
+
+def _rewrite(text: str, mode: str) -> str:
+    out = []
+    pos = 0
+    fences = [m.span() for m in _FENCED.finditer(text)] if _OPEN in text else ()
+    for m in _SELF_REFERENCE.finditer(text):
+        start, end = m.span()
+        if fences and any(a < start < b for a, b in fences):
+            continue
+        if mode == "drop":
+            # Take one neighbouring space with the pronoun: "a I b" -> "a b", "as I, we" -> "as, we".
+            if end < len(text) and text[end] == ' ':
+                end += 1
+            elif start > pos and text[start - 1] == ' ':
+                start -= 1
+            out.append(text[pos:start])
+        else:
+            out.append(text[pos:start])
+            out.append("The system" if _sentence_start(text, start) else "the system")
+            if m.group('am'):
+                out.append(" is")
+        pos = end
+    if not out:
+        return _unfence(text)
+    out.append(text[pos:])
+    return _unfence(''.join(out))
+
+
+def anthropomorphic_wrap(text: str, level: str, pov: str) -> str:
+    t = text
+    if level == "A2":
+        t = "I think " + t[0].lower() + t[1:] if t else t
+    elif level in LEVEL_LEADS:
+        t = LEVEL_LEADS[level] + t
+
+    if level == "A0" or pov == "none":
+        return _rewrite(t, "drop")
+    if pov == "third":
+        return _rewrite(t, "system")
+    return _unfence(t)
+
+
+class TemplateRegistry:
+    """Pre-rendered condition variants of static responses, LRU for the rest."""
+
+    def __init__(self, cache_size: int = 2048):
+        self._static = {}
+        self._wrap = functools.lru_cache(maxsize=cache_size)(anthropomorphic_wrap)
+
+    def register(self, *texts: str):
+        for text in texts:
+            for level, pov in CONDITIONS:
+                self._static[(text, level, pov)] = anthropomorphic_wrap(text, level, pov)
+
+    def render(self, text: str, level: str, pov: str) -> str:
+        hit = self._static.get((text, level, pov))
+        return hit if hit is not None else self._wrap(text, level, pov)
+
+    def cache_info(self):
+        return self._wrap.cache_info()
+
+
+registry = TemplateRegistry()
+
+
+def render(text: str, level: str, pov: str) -> str:
+    return registry.render(text, level, pov)
+
+
+# ---------------------------
+# Response texts
+# ---------------------------
+GREETING = "Hello! I'll help you create a poem through 5 simple steps. Type **'ready'** when you want to begin!"
+END_STUDY_REPLY = "Understood. We’ll wrap up here. Please complete the brief feedback below."
+FALLBACK_REPLY = "Please type 'ready' to begin creating your poem!"
+START_PROMPT = """Great! Let's begin.
+
+**Step 1: Topic Selection**
+What should your poem be about? Some ideas:
+- Ocean or nature
+- Dreams or aspirations
+- Time or memories
+- Love or friendship
+
+What topic interests you?"""
+TOPIC_PROMPT = """We can begin now.
+
+**Step 1: Topic Selection**
+Pick a topic:
+- Ocean or nature
+- Dreams or aspirations
+- Time or memories
+- Love or friendship
+"""
+TONE_PROMPT = """Perfect!
+
+**Step 3: Tone**
+Our poem structure: 10 lines, 5 rhyming pairs, all in English.
+
+What tone fits best?
+- Uplifting and hopeful
+- Thoughtful and reflective
+- Playful and whimsical
+
+Which appeals to you?"""
+
+TOPIC_CHOSEN = """Wonderful choice: "{topic}"!
+
+**Step 2: Message/Story**
+What story or message should the poem convey?
+- A life lesson?
+- A moment of beauty?
+- An emotional journey?
+
+What would you like to express?"""
+TEST_LINES = """**Step 4: Test Lines**
+
+*{l1}*
+*{l2}*
+
+These rhyme nicely! Ready for the full poem? Type 'yes' to continue."""
+POEM_READY = """**Step 5: Your Complete Poem**
+
+{poem}
+
+There you have it—your personalized poem! What do you think?"""
+POEM_REDIRECT = """We’ll keep our focus on your chosen topic to finish the assignment.
+
+**Step 5: Your Complete Poem**
+
+{poem}
+
+Want another pass?"""
+POEM_REVISION = """{ack}
+
+{poem}
+
+How does this version feel?"""
+
+TEN_LINES_ACK = "Got it—I'll expand the draft and heighten the arc."
+REVISION_LEADS = [
+    "Let me refine the imagery:",
+    "Here's a tightened draft:",
+    "I'll adjust the rhythm and keep the arc:",
+    "Let’s try a crisper version:",
+    "Reworking the flow a bit:"
+]
+
+STATIC_RESPONSES = (GREETING, END_STUDY_REPLY, FALLBACK_REPLY, START_PROMPT, TOPIC_PROMPT, TONE_PROMPT)
+PARAMETERIZED_RESPONSES = (TOPIC_CHOSEN, TEST_LINES, POEM_READY, POEM_REDIRECT, POEM_REVISION)
+
+registry.register(*STATIC_RESPONSES)
@@ -0,0 +1,73 @@
+# transcript.py - windowed, cached rendering of the chat transcript
+"""Render the chat history with a per-rerun cost that stays flat as the
+conversation grows.
+
+The last ``window`` messages are drawn as chat bubbles, as before. Everything
+older collapses into one "Earlier messages" expander holding a single markdown
+block. That block is built from per-message fragments cached by message index
+and content hash and is only extended, never rebuilt, as messages scroll out of
+the window. Once it passes Streamlit's cached-message size the browser is sent
+a hash reference instead of the text on every rerun.
+
+Streamlit drops any element a rerun does not emit, so "only new messages" here
+means only new fragments are built; the collapsed block is one element however
+long the transcript gets.
+"""
+import os
+
+WINDOW = int(os.environ.get("SHADE_TRANSCRIPT_WINDOW", "20"))
+
+ROLE_LABELS = {"assistant": "Assistant", "user": "You"}
+
+
+def fragment(msg: dict) -> str:
+    """Markdown for one message inside the collapsed history."""
+    label = ROLE_LABELS.get(msg.get("role"), msg.get("role", ""))
+    return f"**{label}:**\n\n{msg.get('content', '')}"
+
+
+class TranscriptRenderer:
+    """Per-session renderer; keep one in ``st.session_state``."""
+
+    SEPARATOR = "\n\n---\n\n"
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._keys = []        # (index, content hash) of each fragment in the history block
+        self._fragments = []
+        self._history = ""
+        self.fragments_built = 0
+
+    def _key(self, i: int, msg: dict):
+        # str caches its own hash, so re-checking old messages costs a lookup each.
+        return i, hash(msg.get("content")), msg.get("role")
+
+    def history(self, messages: list, upto: int) -> str:
+        """The collapsed markdown for ``messages[:upto]``, reusing cached fragments."""
+        keys = self._keys
+        valid = 0
+        for i in range(min(len(keys), upto)):
+            if keys[i] != self._key(i, messages[i]):
+                break
+            valid += 1
+        if valid < len(keys):
+            # A message was edited or the window grew: rebuild from the first mismatch.
+            del keys[valid:], self._fragments[valid:]
+            self._history = self.SEPARATOR.join(self._fragments)
+        if valid < upto:
+            new = [fragment(messages[i]) for i in range(valid, upto)]
+            self.fragments_built += len(new)
+            keys.extend(self._key(i, messages[i]) for i in range(valid, upto))
+            self._fragments.extend(new)
+            joined = self.SEPARATOR.join(new)
+            self._history = self._history + self.SEPARATOR + joined if self._history else joined
+        return self._history
+
+    def render(self, messages: list, st):
+        split = max(0, len(messages) - self.window)
+        if split:
+            with st.expander(f"Earlier messages ({split})", expanded=False):
+                st.markdown(self.history(messages, split))
+        for m in messages[split:]:
+            with st.chat_message("assistant" if m["role"] == "assistant" else "user"):
+                st.markdown(m["content"])